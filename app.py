@@ -1,17 +1,17 @@
 import streamlit as st
+import atexit
 import os
-import json
-import uuid
 import sys
 import importlib.util
 
 # Add src to path to allow imports
 sys.path.append(os.path.abspath("src"))
 
-from lib.python import helpers
-from lib.python import trivia as trivia_module
-from lib.python.chess import puzzle as puzzle_module
-from lib.python.logger import MoviePyStreamlitLogger
+from lib.python import catalog, question_bank
+from lib.python import jobs as render_jobs
+from lib.python import shorts
+from lib.python.chess import library as pgn_library
+from lib.python.chess import mining as puzzle_mining
 
 st.set_page_config(page_title="JA Studio", layout="wide", page_icon="🎬")
 
@@ -29,6 +29,102 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+
+@st.cache_resource
+def start_render_workers():
+    """Starts the background render workers once per server (RENDER_WORKERS=0 to run them by hand)."""
+    workers = render_jobs.start_workers()
+    if workers is not None:
+        atexit.register(workers.terminate)
+    return workers
+
+
+@st.fragment(run_every=2)
+def render_queue():
+    """Shows this session's renders, refreshing while they run."""
+    job_ids = st.session_state.get("jobs", [])
+    if not job_ids:
+        return
+
+    st.subheader("Render Queue")
+    st.caption(f"{render_jobs.count_jobs(render_jobs.QUEUED)} waiting, {render_jobs.count_jobs(render_jobs.RUNNING)} rendering")
+
+    for job_id in reversed(job_ids[-5:]):
+        job = render_jobs.get_job(job_id)
+        if job is None:
+            continue
+
+        output_filename = os.path.basename(job["spec"]["output"])
+        if job["status"] == render_jobs.DONE:
+            st.success(f"Generated: {output_filename}")
+            if job_id == job_ids[-1]:
+                st.session_state.last_video = job["output"]
+        elif job["status"] == render_jobs.FAILED:
+            st.error(job["message"])
+            with st.expander("Details"):
+                st.text(job["error"])
+        else:
+            st.progress(job["progress"], text=f"{output_filename}: {job['message'] or 'Waiting for a worker...'}")
+
+    if "last_video" in st.session_state and os.path.exists(st.session_state.last_video):
+        st.subheader("Latest Render")
+        col_prev, _ = st.columns([0.4, 0.6])
+        with col_prev:
+            st.video(st.session_state.last_video)
+
+
+@st.fragment(run_every=2)
+def preview_panel():
+    """Shows the pending short's poster and preview, and queues the full render once confirmed."""
+    pending = st.session_state.get("pending")
+    if pending is None:
+        return
+
+    st.subheader("Preview")
+    poster_job = render_jobs.get_job(pending["poster_job"])
+    preview_job = render_jobs.get_job(pending["preview_job"])
+
+    col_poster, col_preview, _ = st.columns([0.2, 0.2, 0.6])
+    with col_poster:
+        if poster_job is not None and poster_job["status"] == render_jobs.DONE:
+            st.image(poster_job["output"])
+        elif poster_job is not None and poster_job["status"] == render_jobs.FAILED:
+            st.error(poster_job["message"])
+        else:
+            st.caption("Drawing poster...")
+    with col_preview:
+        if preview_job is not None and preview_job["status"] == render_jobs.DONE:
+            st.video(preview_job["output"])
+        elif preview_job is not None and preview_job["status"] == render_jobs.FAILED:
+            st.error(preview_job["message"])
+        elif preview_job is not None:
+            st.progress(preview_job["progress"], text=preview_job["message"] or "Rendering preview...")
+
+    col_confirm, col_discard, _ = st.columns([0.2, 0.2, 0.6])
+    with col_confirm:
+        if st.button("✅ RENDER FULL SHORT"):
+            job_id = render_jobs.submit(pending["type"], pending["spec"])
+            st.session_state.setdefault("jobs", []).append(job_id)
+            del st.session_state.pending
+            st.rerun()
+    with col_discard:
+        if st.button("🗑️ Discard"):
+            del st.session_state.pending
+            st.rerun()
+
+
+def queue_preview(short_type: str, spec: dict):
+    """Queues a poster and a low resolution preview of a prepared short, pending confirmation."""
+    st.session_state.pending = {
+        "type": short_type,
+        "spec": spec,
+        "poster_job": render_jobs.submit(short_type, shorts.get_preview_spec(spec, poster=True)),
+        "preview_job": render_jobs.submit(short_type, shorts.get_preview_spec(spec))
+    }
+
+
+start_render_workers()
+
 st.title("JA Studio 🎬")
 
 # Tabs
@@ -41,180 +137,121 @@ with tab_generate:
     short_type = st.selectbox("Short Type", ["Trivia", "Chess Puzzle"])
     
     if short_type == "Trivia":
-        questions_data = helpers.load_trivia_questions()
-        categories = list(questions_data.keys())
+        categories = question_bank.get_categories()
         category = st.selectbox("Category", categories)
         
         if st.button("✨ PRODUCE TRIVIA SHORT"):
-            with st.spinner("Generating Trivia Short..."):
-                try:
-                    # 1. Get Resources
-                    questions = helpers.get_random_trivia_questions(category)
-                    music_path = helpers.get_random_music("lofi")
-                    
-                    if not questions:
-                        st.error("No questions found for this category.")
-                    elif not music_path:
-                        st.error("No music found.")
-                    else:
-                        # 2. Setup Paths
-                        output_filename = f"{uuid.uuid4()}.mp4"
-                        output_path = os.path.join("out", output_filename)
-                        if not os.path.exists("out"):
-                            os.makedirs("out")
-
-                        # 3. Call Generation Logic
-                        # Trivia module expects dicts for questions, which we have from json
-                        prog_bar = st.progress(0, text="Rendering video...")
-                        logger = MoviePyStreamlitLogger(progress_bar=prog_bar, label_widget=st.empty())
-
-                        trivia_module.produce_short(
-                            questions=questions,
-                            background="src/resources/parkour.mp4",
-                            music=music_path,
-                            font="src/resources/default.ttf",
-                            output=output_path,
-                            logger=logger
-                        )
-                        
-                        prog_bar.empty()
-
-                        # 4. Update DB
-                        helpers.add_video_to_db(output_filename, "trivia", "Trivia Short")
-                        st.success(f"Generated: {output_filename}")
-                        st.session_state.last_video = output_path
-                        
-                except Exception as e:
-                    st.error(f"Error producing video: {e}")
-                    import traceback
-                    st.text(traceback.format_exc())
+            try:
+                # 1. Get Resources
+                spec = shorts.prepare_trivia(category)
+
+                # 2. Preview it first; the full render is queued once confirmed
+                queue_preview("trivia", spec)
+
+            except ValueError as e:
+                st.error(str(e))
+            except Exception as e:
+                st.error(f"Error queueing video: {e}")
+                import traceback
+                st.text(traceback.format_exc())
 
     elif short_type == "Chess Puzzle":
-        # Load Phonk tracks for drops
-        phonk_tracks_path = os.path.join("src", "resources", "music", "phonk", "tracks.json")
-        try:
-            with open(phonk_tracks_path, "r") as f:
-                phonk_tracks = json.load(f)
-        except:
-            phonk_tracks = []
-            
         pgn_input = st.text_area("PGN (leave empty for random)", height=150)
-        
-        # Player selection for random game
-        # We need to bridge the PGN library logic here.
-        # The TS version used 'src/lib/pgn/library.ts' which reads from 'games' folder.
-        # We can implement a simple python version or rely on user pasting PGN.
-        # For now, let's allow pasting.
+        mined_puzzle_count = puzzle_mining.count_puzzles()
+        use_mined_puzzle = st.checkbox(
+            f"Use a pre-mined puzzle when PGN is empty ({mined_puzzle_count} available)",
+            value=mined_puzzle_count > 0,
+            disabled=mined_puzzle_count == 0
+        )
         
         if st.button("✨ PRODUCE PUZZLE SHORT"):
-             with st.spinner("Generating Chess Puzzle..."):
-                try:
-                    import chess.pgn
-                    import io
-                    import random
-                    
-                    final_pgn = pgn_input.strip()
-                    
-                    # If empty, try to pick a random game from 'games' dir if possible
-                    if not final_pgn:
-                        games_dir = os.path.join("games")
-                        if os.path.exists(games_dir):
-                            pgn_files = [f for f in os.listdir(games_dir) if f.endswith(".pgn")]
-                            if pgn_files:
-                                selected_file = random.choice(pgn_files)
-                                with open(os.path.join(games_dir, selected_file), "r") as f:
-                                    # Read one game? or all? Assuming one per file or we pick random
-                                    # Simulating the library logic: just read the whole file text
-                                    final_pgn = f.read()
-                    
-                    if not final_pgn:
-                        st.error("Please provide a PGN or ensure 'games/' directory has PGN files.")
-                    else:
-                         # 2. Get Music
-                        track = random.choice(phonk_tracks) if phonk_tracks else None
-                        if not track:
-                             st.error("No phonk tracks found.")
-                        else:
-                            music_filename = track["filename"]
-                            music_drop = track["dropTime"]
-                            music_path = f"src/resources/music/phonk/{music_filename}"
-                            
-                            # 3. Setup Paths
-                            output_filename = f"{uuid.uuid4()}.mp4"
-                            output_path = os.path.join("out", output_filename)
-                            if not os.path.exists("out"):
-                                os.makedirs("out")
-                                
-                            # 4. Call Generation Logic
-                            prog_bar = st.progress(0, text="Rendering video...")
-                            logger = MoviePyStreamlitLogger(progress_bar=prog_bar, label_widget=st.empty())
-
-                            puzzle_module.produce_short(
-                                output=output_path,
-                                game_pgn=final_pgn,
-                                background="src/resources/gridbackground.png",
-                                font="src/resources/default.ttf",
-                                music=music_path,
-                                music_drop_time=music_drop,
-                                logger=logger
-                            )
-                            
-                            prog_bar.empty()
-                            
-                            # 5. Update DB
-                            helpers.add_video_to_db(output_filename, "chess/puzzle", "Chess Puzzle Short")
-                            st.success(f"Generated: {output_filename}")
-                            st.session_state.last_video = output_path
-
-                except Exception as e:
-                    st.error(f"Error producing video: {e}")
-                    import traceback
-                    st.text(traceback.format_exc())
+            try:
+                # 1. Get Puzzle and Music
+                spec = shorts.prepare_puzzle(pgn_input, use_mined_puzzle)
 
-    if "last_video" in st.session_state and os.path.exists(st.session_state.last_video):
-        st.subheader("Preview")
-        col_prev, _ = st.columns([0.4, 0.6])
-        with col_prev:
-            st.video(st.session_state.last_video)
+                # 2. Preview it first; the full render is queued once confirmed
+                queue_preview("chess/puzzle", spec)
+
+            except ValueError as e:
+                st.error(str(e))
+            except Exception as e:
+                st.error(f"Error queueing video: {e}")
+                import traceback
+                st.text(traceback.format_exc())
+
+    preview_panel()
+    render_queue()
 
 
 # --- Feed Tab ---
+FEED_PAGE_SIZE = 10
+
 with tab_feed:
     st.header("Video Feed")
     
     if st.button("🔄 Refresh Feed"):
-        helpers.sync_db()
+        catalog.sync(force=True)
         st.rerun()
 
-    # Load videos
-    helpers.sync_db() # Sync on load
-    videos = helpers.load_db()
-    # Sort by date desc
-    videos.sort(key=lambda x: x.get("date", ""), reverse=True)
+    # out/ is only rescanned when it changed
+    catalog.sync()
+
+    type_filter = st.selectbox(
+        "Type",
+        ["All", *catalog.list_types()],
+        format_func=lambda video_type: shorts.SHORT_TITLES.get(video_type, video_type.title())
+    )
+    video_type = None if type_filter == "All" else type_filter
+
+    # One page of videos, newest first, straight from the catalog's indexes
+    video_count = catalog.count_videos(video_type)
+    page_count = max(1, -(-video_count // FEED_PAGE_SIZE))
+    page = st.session_state.get("feed_page", 1)
+    page = min(max(page, 1), page_count)
+    videos = catalog.list_videos(video_type, limit=FEED_PAGE_SIZE, offset=(page - 1) * FEED_PAGE_SIZE)
     
     if not videos:
         st.info("No videos found. Generate some!")
     
     for video in videos:
-        col_info, col_del = st.columns([0.85, 0.15])
+        col_poster, col_info, col_del = st.columns([0.15, 0.7, 0.15])
+        with col_poster:
+            poster_path = shorts.get_poster(video)
+            if poster_path is not None:
+                st.image(poster_path)
         with col_info:
              st.subheader(video.get("title", "Untitled"))
              st.caption(f"Filename: {video['filename']} | Date: {video.get('date', 'Unknown')}")
+
+             # The player, and the video file with it, only loads once asked for
+             file_path = os.path.join("out", video['filename'])
+             if not os.path.exists(file_path):
+                 st.error("File not found on disk.")
+             elif st.toggle("▶️ Play", key=f"play_{video['id']}"):
+                 col_vid, _ = st.columns([0.5, 0.5])
+                 with col_vid:
+                     st.video(file_path)
         with col_del:
              if st.button("🗑️ Delete", key=f"del_{video['id']}"):
-                helpers.delete_video(video['filename'])
+                catalog.delete_video(video['filename'])
+                shorts.delete_poster(video['filename'])
                 st.rerun()
-
-        file_path = os.path.join("out", video['filename'])
-        if os.path.exists(file_path):
-            col_vid, _ = st.columns([0.4, 0.6])
-            with col_vid:
-                st.video(file_path)
-        else:
-            st.error("File not found on disk.")
         
         st.divider()
 
+    if page_count > 1:
+        col_prev, col_page, col_next = st.columns([0.2, 0.6, 0.2])
+        with col_prev:
+            if st.button("⬅️ Newer", disabled=page == 1):
+                st.session_state.feed_page = page - 1
+                st.rerun()
+        with col_page:
+            st.caption(f"Page {page} of {page_count} ({video_count} videos)")
+        with col_next:
+            if st.button("Older ➡️", disabled=page == page_count):
+                st.session_state.feed_page = page + 1
+                st.rerun()
+
 # --- Library Tab ---
 with tab_library:
     st.header("PGN Library")
@@ -244,7 +281,8 @@ with tab_library:
             with col_name:
                 file_path = os.path.join("games", pgn_file)
                 size_kb = os.path.getsize(file_path) / 1024
-                st.write(f"📄 **{pgn_file}** ({size_kb:.1f} KB)")
+                game_count = pgn_library.count_games(pgn_file)
+                st.write(f"📄 **{pgn_file}** ({size_kb:.1f} KB, {game_count} games)")
                 
                 with st.expander("Preview"):
                     try:
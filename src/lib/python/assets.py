@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from glob import glob
+
+import proglog
+from moviepy.config import get_setting
+
+from lib.python.helpers import BASE_DIR, DATA_DIR, MUSIC_DIR
+from lib.python.media import get_cover_filter
+
+
+ASSETS_DIR = os.path.join(DATA_DIR, "assets")
+MANIFEST_PATH = os.path.join(ASSETS_DIR, "manifest.json")
+
+# Source file hashes, keyed by absolute path and refreshed by mtime and size
+SOURCES_DB_PATH = os.path.join(DATA_DIR, "cache", "sources.db")
+
+# Render-ready backgrounds: output size and fps, a keyframe every second
+BACKGROUND_SIZE = (1080, 1920)
+BACKGROUND_FPS = 24
+BACKGROUND_KEYFRAME_INTERVAL = 24
+
+# Render-ready music: PCM WAV at the mixing rate, loudness normalized (EBU R128)
+MUSIC_SAMPLE_RATE = 44100
+MUSIC_LOUDNESS = -16
+
+ASSET_DIRECTORIES = {
+    "background": "backgrounds",
+    "music": "music"
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+"""
+
+_manifest_lock = threading.Lock()
+
+_source_hashes = {}
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+
+
+def load_manifest():
+    """
+    Loads the prepared asset manifest: the assets made from every source
+    hash. It is read from disk every time, so assets prepared by another
+    process are picked up.
+    """
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"assets": {}}
+
+
+def save_manifest(manifest: dict):
+    """Saves the manifest, writing then renaming so readers never see a partial file."""
+    if not os.path.exists(ASSETS_DIR):
+        os.makedirs(ASSETS_DIR, exist_ok=True)
+
+    temporary_path = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_path, MANIFEST_PATH)
+
+
+def connect():
+    """Opens this process's connection to the source hashes."""
+    global _connection, _connection_pid
+
+    if _connection is None or _connection_pid != os.getpid():
+        directory = os.path.dirname(SOURCES_DB_PATH)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        _connection = sqlite3.connect(
+            SOURCES_DB_PATH,
+            timeout=60,
+            check_same_thread=False
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+        _connection_pid = os.getpid()
+    return _connection
+
+
+def get_source_hash(path: str):
+    """
+    Hashes a source file's contents. Hashes are remembered per path, in
+    this process and in a database shared by all processes, and only
+    recomputed when the file's mtime or size changes.
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime, stat.st_size)
+
+    with _lock:
+        source = _source_hashes.get(key)
+        if source is not None and source[0] == version:
+            return source[1]
+
+        row = connect().execute(
+            "SELECT mtime, size, hash FROM sources WHERE path = ?",
+            (key,)
+        ).fetchone()
+    if row is not None and (row[0], row[1]) == version:
+        source_hash = row[2]
+    else:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b""):
+                sha1.update(chunk)
+        source_hash = sha1.hexdigest()
+
+        with _lock:
+            connection = connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO sources (path, mtime, size, hash) VALUES (?, ?, ?, ?)",
+                (key, stat.st_mtime, stat.st_size, source_hash)
+            )
+            connection.commit()
+
+    with _lock:
+        _source_hashes[key] = (version, source_hash)
+    return source_hash
+
+
+def _get_asset_key(kind: str, source_hash: str):
+    if kind == "background":
+        return f"background:{source_hash}:{BACKGROUND_SIZE[0]}x{BACKGROUND_SIZE[1]}@{BACKGROUND_FPS}"
+    return f"music:{source_hash}:{MUSIC_SAMPLE_RATE}:{MUSIC_LOUDNESS}"
+
+
+def _get_asset_path(asset: dict):
+    return os.path.join(ASSETS_DIR, asset["path"])
+
+
+def _run_ffmpeg(arguments: list):
+    process = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", *arguments],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL
+    )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed: {process.stderr.decode('utf-8', 'replace')[-500:]}"
+        )
+
+
+def _transcode(kind: str, source: str, output: str):
+    # Write to a temporary file first so a crash never leaves a partial asset
+    temporary_output = f"{output}.{os.getpid()}.tmp{os.path.splitext(output)[1]}"
+
+    if kind == "background":
+        _run_ffmpeg([
+            "-i", source,
+            "-an",
+            "-vf", get_cover_filter(BACKGROUND_SIZE),
+            "-r", str(BACKGROUND_FPS),
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+            "-crf", "18",
+            "-pix_fmt", "yuv420p",
+            "-g", str(BACKGROUND_KEYFRAME_INTERVAL),
+            "-keyint_min", str(BACKGROUND_KEYFRAME_INTERVAL),
+            "-sc_threshold", "0",
+            "-movflags", "+faststart",
+            temporary_output
+        ])
+    else:
+        _run_ffmpeg([
+            "-i", source,
+            "-vn",
+            "-af", f"loudnorm=I={MUSIC_LOUDNESS}:TP=-1.5:LRA=11",
+            "-ar", str(MUSIC_SAMPLE_RATE),
+            "-ac", "2",
+            "-c:a", "pcm_s16le",
+            temporary_output
+        ])
+
+    os.replace(temporary_output, output)
+
+
+def prepare(kind: str, source: str, force: bool = False):
+    """
+    Makes the render-ready version of a "background" or "music" source
+    unless the manifest already has one for the same contents, and returns
+    its path.
+    """
+    source_hash = get_source_hash(source)
+    key = _get_asset_key(kind, source_hash)
+
+    with _manifest_lock:
+        asset = load_manifest()["assets"].get(key)
+    if asset is not None and not force and os.path.exists(_get_asset_path(asset)):
+        return _get_asset_path(asset)
+
+    extension = ".mp4" if kind == "background" else ".wav"
+    directory = os.path.join(ASSETS_DIR, ASSET_DIRECTORIES[kind])
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    output = os.path.join(directory, f"{source_hash}{extension}")
+
+    started = time.perf_counter()
+    _transcode(kind, source, output)
+
+    with _manifest_lock:
+        manifest = load_manifest()
+        manifest["assets"][key] = {
+            "kind": kind,
+            "source": os.path.relpath(os.path.abspath(source), BASE_DIR),
+            "path": os.path.relpath(output, ASSETS_DIR),
+            "created": time.time(),
+            "seconds": time.perf_counter() - started
+        }
+        save_manifest(manifest)
+
+    return output
+
+
+def get_prepared(kind: str, source: str):
+    """
+    Returns the render-ready version of a source if it was prepared,
+    otherwise the source itself, so renders never wait on a transcode.
+    """
+    try:
+        source_hash = get_source_hash(source)
+    except OSError:
+        return source
+
+    with _manifest_lock:
+        asset = load_manifest()["assets"].get(_get_asset_key(kind, source_hash))
+    if asset is not None and os.path.exists(_get_asset_path(asset)):
+        return _get_asset_path(asset)
+    return source
+
+
+def get_background(source: str):
+    """Returns the prepared 1080x1920 version of a background video, if any."""
+    return get_prepared("background", source)
+
+
+def get_music(source: str):
+    """Returns the prepared, loudness normalized WAV of a track, if any."""
+    return get_prepared("music", source)
+
+
+def find_sources():
+    """Lists the background videos and music tracks shipped in src/resources."""
+    resources_dir = os.path.join(BASE_DIR, "src", "resources")
+    backgrounds = sorted(glob(os.path.join(resources_dir, "*.mp4")))
+    music = sorted(glob(os.path.join(MUSIC_DIR, "**", "*.mp3"), recursive=True))
+    return [("background", path) for path in backgrounds] + [("music", path) for path in music]
+
+
+def prepare_all(sources: list = None, force: bool = False, logger="bar"):
+    """Prepares every source, skipping those already prepared."""
+    logger = proglog.default_bar_logger(logger)
+    sources = sources if sources is not None else find_sources()
+
+    prepared = []
+    for kind, source in logger.iter_bar(asset=sources):
+        try:
+            prepared.append(prepare(kind, source, force))
+        except (OSError, RuntimeError) as e:
+            logger(message=f"Could not prepare {source}: {e}")
+
+    logger(message=f"Prepared {len(prepared)} of {len(sources)} assets in {ASSETS_DIR}")
+    return prepared
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Transcode backgrounds and music into render-ready assets."
+    )
+    parser.add_argument("backgrounds", nargs="*", help="background videos (default: src/resources/*.mp4 and all music)")
+    parser.add_argument("--music", nargs="*", default=[], help="music tracks to prepare")
+    parser.add_argument("--force", action="store_true", help="transcode again even if prepared")
+    args = parser.parse_args()
+
+    sources = None
+    if args.backgrounds or args.music:
+        sources = (
+            [("background", path) for path in args.backgrounds]
+            + [("music", path) for path in args.music]
+        )
+    prepare_all(sources, force=args.force)
@@ -0,0 +1,170 @@
+import os
+import struct
+import subprocess
+import tempfile
+import wave
+from functools import lru_cache
+
+import numpy as np
+from moviepy.config import get_setting
+
+from lib.python.assets import MUSIC_SAMPLE_RATE
+
+
+SAMPLE_RATE = MUSIC_SAMPLE_RATE
+CHANNELS = 2
+
+# Undecoded tracks kept in memory; prepared WAVs are memory-mapped instead
+DECODED_CACHE_SIZE = 16
+
+
+def sound(
+    path: str,
+    start: float = 0,
+    gain: float = 1,
+    offset: float = 0,
+    duration: float = None
+):
+    """
+    Describes one sound in a soundtrack: `path` played from `offset`
+    seconds into the file, at `start` seconds into the short, scaled by
+    `gain` and cut after `duration` seconds if given.
+    """
+    return {
+        "path": path,
+        "start": start,
+        "gain": gain,
+        "offset": offset,
+        "duration": duration
+    }
+
+
+def _find_wav_data(path: str):
+    # Returns the offset and size of the PCM data of a 16-bit stereo WAV at
+    # the mixing rate, or None for any other file
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            return None
+
+        pcm_format = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+
+            if chunk_id == b"fmt ":
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack(
+                    "<HHIIHH", f.read(16)
+                )
+                pcm_format = (audio_format, channels, sample_rate, bits)
+                f.seek(chunk_size - 16 + chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if pcm_format != (1, CHANNELS, SAMPLE_RATE, 16):
+                    return None
+                return f.tell(), chunk_size
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _decode(path: str):
+    process = subprocess.run(
+        [
+            get_setting("FFMPEG_BINARY"),
+            "-loglevel", "error",
+            "-i", path,
+            "-vn",
+            "-f", "s16le",
+            "-acodec", "pcm_s16le",
+            "-ar", str(SAMPLE_RATE),
+            "-ac", str(CHANNELS),
+            "-"
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL
+    )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"could not decode {path}: {process.stderr.decode('utf-8', 'replace')[-500:]}"
+        )
+    return np.frombuffer(process.stdout, dtype=np.int16).reshape((-1, CHANNELS))
+
+
+@lru_cache(maxsize=DECODED_CACHE_SIZE)
+def load_samples(path: str):
+    """
+    Returns a file's samples as a read-only (frames, 2) int16 array at the
+    mixing rate. Prepared WAVs are memory-mapped, so only the part a short
+    plays is read; anything else is decoded by ffmpeg once per process.
+    """
+    wav_data = _find_wav_data(path) if path.endswith(".wav") else None
+    if wav_data is not None:
+        offset, size = wav_data
+        frame_count = min(size, os.path.getsize(path) - offset) // (2 * CHANNELS)
+        return np.memmap(
+            path,
+            dtype=np.int16,
+            mode="r",
+            offset=offset,
+            shape=(frame_count, CHANNELS)
+        )
+
+    samples = _decode(path)
+    samples.setflags(write=False)
+    return samples
+
+
+def mix(sounds: list, duration: float):
+    """
+    Mixes sounds into one soundtrack of `duration` seconds, as a float32
+    (frames, 2) array. Each sound is added with a single vectorized
+    multiply-add over the samples it covers.
+    """
+    total_frames = int(round(duration * SAMPLE_RATE))
+    soundtrack = np.zeros((total_frames, CHANNELS), dtype=np.float32)
+
+    for event in sounds:
+        samples = load_samples(event["path"])
+
+        first = int(round(event["offset"] * SAMPLE_RATE))
+        start = int(round(event["start"] * SAMPLE_RATE))
+        frame_count = min(len(samples) - first, total_frames - start)
+        if event["duration"] is not None:
+            frame_count = min(frame_count, int(round(event["duration"] * SAMPLE_RATE)))
+        if frame_count <= 0 or start < 0:
+            continue
+
+        soundtrack[start:start + frame_count] += (
+            samples[first:first + frame_count].astype(np.float32)
+            * (event["gain"] / 32768)
+        )
+
+    np.clip(soundtrack, -1, 1, out=soundtrack)
+    return soundtrack
+
+
+def write_wav(soundtrack: np.ndarray, path: str):
+    """Writes a mixed soundtrack as a 16-bit PCM WAV."""
+    with wave.open(path, "wb") as f:
+        f.setnchannels(CHANNELS)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((soundtrack * 32767).astype("<i2").tobytes())
+
+
+def write_soundtrack(sounds: list, duration: float, directory: str = None):
+    """
+    Mixes sounds into a temporary WAV file, by default in the system's
+    temporary directory, and returns its path. A failed or interrupted mix
+    leaves no file behind.
+    """
+    descriptor, path = tempfile.mkstemp(suffix=".wav", dir=directory)
+    os.close(descriptor)
+    try:
+        write_wav(mix(sounds, duration), path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
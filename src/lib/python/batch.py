@@ -0,0 +1,160 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from lib.python import shorts
+from lib.python.encoder import ENCODE_PROFILES
+
+
+def load_manifest(path: str):
+    """
+    Reads a JSONL manifest with one short per line, e.g.
+    `{"type": "trivia", "category": "animals"}` or
+    `{"type": "chess/puzzle", "puzzleId": 12, "output": "out/puzzle.mp4"}`.
+    An entry may pick its own `encodeProfile`.
+    Blank lines and lines starting with # are skipped.
+    """
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                entries.append((line_number, json.loads(line)))
+    return entries
+
+
+def prepare(entry: dict):
+    """Resolves a manifest entry into a short type and `produce_short` arguments."""
+    short_type = entry.get("type", "trivia")
+
+    if short_type == "trivia":
+        spec = shorts.prepare_trivia(entry["category"], output=entry.get("output"))
+    elif short_type == "chess/puzzle":
+        spec = shorts.prepare_puzzle(
+            entry.get("pgn", ""),
+            use_mined_puzzle=entry.get("useMinedPuzzle", True),
+            puzzle_id=entry.get("puzzleId"),
+            output=entry.get("output")
+        )
+        if "musicDropTime" in entry:
+            spec["music_drop_time"] = entry["musicDropTime"]
+    else:
+        raise ValueError(f"unknown short type: {short_type}")
+
+    # Optional asset overrides
+    for key in ("music", "background", "font"):
+        if key in entry:
+            spec[key] = entry[key]
+
+    if entry.get("encodeProfile"):
+        spec["encode_profile"] = entry["encodeProfile"]
+
+    return short_type, spec
+
+
+def _init_worker(short_types):
+    shorts.warm_up(short_types)
+
+
+def _produce(task):
+    line_number, entry = task
+    result = {
+        "line": line_number,
+        "type": entry.get("type", "trivia"),
+        "output": None,
+        "error": None
+    }
+
+    started = time.perf_counter()
+    try:
+        short_type, spec = prepare(entry)
+        result["output"] = shorts.produce(short_type, spec, logger=None)
+    except Exception as e:
+        result["error"] = f"{e}"
+        traceback.print_exc()
+    result["elapsed"] = time.perf_counter() - started
+
+    return result
+
+
+def produce_batch(entries: list, workers: int = 1):
+    """
+    Renders every manifest entry in this long-lived process (or a pool of
+    `workers` processes), with fonts, sprites and engines loaded once per
+    process. Failed shorts are reported and the batch continues.
+    """
+    short_types = {entry.get("type", "trivia") for _, entry in entries}
+
+    results = []
+    started = time.perf_counter()
+
+    if workers == 1:
+        _init_worker(short_types)
+        for task in entries:
+            result = _produce(task)
+            print(_format_result(result), flush=True)
+            results.append(result)
+    else:
+        with multiprocessing.Pool(workers, _init_worker, (short_types,)) as pool:
+            for result in pool.imap_unordered(_produce, entries):
+                print(_format_result(result), flush=True)
+                results.append(result)
+
+    results.sort(key=lambda result: result["line"])
+    return results, time.perf_counter() - started
+
+
+def _format_result(result: dict):
+    outcome = result["output"] if result["error"] is None else f"FAILED: {result['error']}"
+    return f"line {result['line']:>4}  {result['type']:<13} {result['elapsed']:>8.1f}s  {outcome}"
+
+
+def print_summary(results: list, elapsed: float):
+    """Prints each short's render time and the batch totals."""
+    print()
+    print("Summary")
+    for result in results:
+        print(_format_result(result))
+
+    produced = [result for result in results if result["error"] is None]
+    render_time = sum(result["elapsed"] for result in produced)
+    print(
+        f"{len(produced)}/{len(results)} shorts in {elapsed:.1f}s, "
+        f"{render_time / max(len(produced), 1):.1f}s per short, "
+        f"{len(produced) * 60 / max(elapsed, 1e-9):.2f} shorts/min"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render every short listed in a JSONL manifest in one process."
+    )
+    parser.add_argument("manifest", help="JSONL file with one short spec per line")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="shorts rendered in parallel, each worker keeping its own warm caches"
+    )
+    parser.add_argument(
+        "--encode-profile",
+        choices=ENCODE_PROFILES.keys(),
+        default="throughput",
+        help="x264 settings for entries without their own encodeProfile"
+    )
+    args = parser.parse_args()
+
+    # Shared encode profiles split the cores between the parallel workers
+    os.environ["RENDER_WORKERS"] = str(max(1, args.workers))
+
+    entries = load_manifest(args.manifest)
+    for _, entry in entries:
+        entry.setdefault("encodeProfile", args.encode_profile)
+    results, elapsed = produce_batch(entries, max(1, args.workers))
+    print_summary(results, elapsed)
+
+    if any(result["error"] is not None for result in results):
+        raise SystemExit(1)
@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from lib.python.helpers import DATA_DIR, DB_PATH, OUT_DIR
+
+
+CATALOG_DB_PATH = os.path.join(DATA_DIR, "catalog.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    title TEXT
+);
+CREATE INDEX IF NOT EXISTS videos_date ON videos (date);
+CREATE INDEX IF NOT EXISTS videos_type_date ON videos (type, date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Videos found in out/ without a catalog entry
+LEGACY_TYPE = "legacy"
+LEGACY_TITLE = "Legacy Video"
+
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+
+
+def connect():
+    """Opens this process's connection to the video catalog, migrating db.json on first use."""
+    global _connection, _connection_pid
+
+    if _connection is None or _connection_pid != os.getpid():
+        if not os.path.exists(DATA_DIR):
+            os.makedirs(DATA_DIR)
+        _connection = sqlite3.connect(
+            CATALOG_DB_PATH,
+            timeout=60,
+            check_same_thread=False
+        )
+        _connection.row_factory = sqlite3.Row
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+        _migrate(_connection)
+        _connection_pid = os.getpid()
+    return _connection
+
+
+def _get_meta(connection, key: str):
+    row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def _set_meta(connection, key: str, value):
+    connection.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        (key, str(value))
+    )
+
+
+def _migrate(connection):
+    # Imports the videos of the old JSON database, once; the file is left as is
+    with connection:
+        if _get_meta(connection, "migrated") is not None:
+            return
+
+        try:
+            with open(DB_PATH, "r", encoding="utf-8") as f:
+                videos = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            videos = []
+
+        connection.executemany(
+            "INSERT OR IGNORE INTO videos (id, filename, type, date, title) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    video.get("id") or str(uuid.uuid4()),
+                    video["filename"],
+                    video.get("type", LEGACY_TYPE),
+                    video.get("date", datetime.now().isoformat()),
+                    video.get("title", LEGACY_TITLE)
+                )
+                for video in videos
+                if video.get("filename")
+            ]
+        )
+        _set_meta(connection, "migrated", time.time())
+
+
+def add_video(filename: str, video_type: str, title: str):
+    """
+    Adds a video to the catalog and returns its id. A file already picked
+    up by a sync while it was being written gets its real type and title.
+    """
+    with _lock:
+        connection = connect()
+        with connection:
+            connection.execute(
+                """
+                INSERT INTO videos (id, filename, type, date, title) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (filename) DO UPDATE SET type = excluded.type, title = excluded.title
+                """,
+                (str(uuid.uuid4()), filename, video_type, datetime.now().isoformat(), title)
+            )
+        return connection.execute(
+            "SELECT id FROM videos WHERE filename = ?",
+            (filename,)
+        ).fetchone()[0]
+
+
+def delete_video(filename: str):
+    """Deletes a video from disk and the catalog."""
+    file_path = os.path.join(OUT_DIR, filename)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+    with _lock:
+        connection = connect()
+        with connection:
+            connection.execute("DELETE FROM videos WHERE filename = ?", (filename,))
+
+
+def get_video(filename: str):
+    """Returns a video's catalog entry, or None."""
+    with _lock:
+        row = connect().execute(
+            "SELECT * FROM videos WHERE filename = ?",
+            (filename,)
+        ).fetchone()
+    return dict(row) if row is not None else None
+
+
+def list_videos(video_type: str = None, limit: int = None, offset: int = 0):
+    """Lists videos, newest first, optionally of one type and a page at a time."""
+    query = "SELECT * FROM videos"
+    parameters = []
+    if video_type is not None:
+        query += " WHERE type = ?"
+        parameters.append(video_type)
+    query += " ORDER BY date DESC LIMIT ? OFFSET ?"
+    parameters += [limit if limit is not None else -1, offset]
+
+    with _lock:
+        rows = connect().execute(query, parameters).fetchall()
+    return [dict(row) for row in rows]
+
+
+def count_videos(video_type: str = None):
+    """Counts the videos, optionally of one type."""
+    with _lock:
+        connection = connect()
+        if video_type is None:
+            return connection.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+        return connection.execute(
+            "SELECT COUNT(*) FROM videos WHERE type = ?",
+            (video_type,)
+        ).fetchone()[0]
+
+
+def list_types():
+    """Lists the video types in the catalog."""
+    with _lock:
+        rows = connect().execute("SELECT DISTINCT type FROM videos ORDER BY type").fetchall()
+    return [row[0] for row in rows]
+
+
+def sync(force: bool = False):
+    """
+    Brings the catalog in line with the videos in out/: files added by
+    hand become legacy entries, entries of deleted files are dropped. The
+    directory is only listed when its mtime changed since the last sync
+    (files were added, removed or renamed), unless `force`d. Returns
+    whether anything changed.
+    """
+    if not os.path.exists(OUT_DIR):
+        os.makedirs(OUT_DIR)
+    out_mtime = os.stat(OUT_DIR).st_mtime_ns
+
+    with _lock:
+        connection = connect()
+        if not force and _get_meta(connection, "out_mtime") == str(out_mtime):
+            return False
+
+        files = {
+            entry.name: entry
+            for entry in os.scandir(OUT_DIR)
+            if entry.name.endswith(".mp4") and entry.is_file()
+        }
+        filenames = {row[0] for row in connection.execute("SELECT filename FROM videos")}
+
+        added = files.keys() - filenames
+        removed = filenames - files.keys()
+
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO videos (id, filename, type, date, title) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        str(uuid.uuid4()),
+                        filename,
+                        LEGACY_TYPE,
+                        datetime.fromtimestamp(files[filename].stat().st_mtime).isoformat(),
+                        LEGACY_TITLE
+                    )
+                    for filename in added
+                ]
+            )
+            connection.executemany(
+                "DELETE FROM videos WHERE filename = ?",
+                [(filename,) for filename in removed]
+            )
+            _set_meta(connection, "out_mtime", out_mtime)
+
+    return bool(added or removed)
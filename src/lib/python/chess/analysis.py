@@ -0,0 +1,202 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from chess import Board
+
+from lib.python.helpers import DATA_DIR
+from .engine import analyse_position, get_engine_options, get_search_command
+
+
+ANALYSIS_DB_PATH = os.path.join(DATA_DIR, "analysis.db")
+
+# Least recently used entries are evicted past this many positions
+MAX_ENTRIES = 200000
+EVICT_FRACTION = 0.1
+EVICT_CHECK_INTERVAL = 1000
+
+# Score gap (centipawns) by which the best move must beat the second best
+# for a puzzle to have a unique solution
+UNIQUE_MARGIN = 150
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    fen TEXT NOT NULL,
+    search TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    bestmove TEXT,
+    score INTEGER NOT NULL,
+    pv TEXT NOT NULL,
+    lines TEXT,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (fen, search, engine)
+);
+CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used);
+"""
+
+_connection = None
+_connection_pid = None
+_inserts = 0
+_lock = threading.Lock()
+
+
+def connect():
+    """Opens this process's connection to the analysis cache."""
+    global _connection, _connection_pid
+
+    if _connection is None or _connection_pid != os.getpid():
+        if not os.path.exists(DATA_DIR):
+            os.makedirs(DATA_DIR)
+        _connection = sqlite3.connect(
+            ANALYSIS_DB_PATH,
+            timeout=60,
+            check_same_thread=False
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+
+        # Caches created before multi-PV searches have no lines column
+        columns = [row[1] for row in _connection.execute("PRAGMA table_info(analysis)")]
+        if "lines" not in columns:
+            _connection.execute("ALTER TABLE analysis ADD COLUMN lines TEXT")
+
+        _connection_pid = os.getpid()
+    return _connection
+
+
+def normalize_fen(fen: str):
+    """
+    Drops the move clocks from a FEN and keeps the en passant square only
+    when a capture is actually possible, so transpositions share entries.
+    """
+    return " ".join(Board(fen).fen(en_passant="legal").split(" ")[:4])
+
+
+def get_engine_signature(sf_engine):
+    """Identifies an engine by its name (with the Stockfish version) and UCI options."""
+    signature = getattr(sf_engine, "_analysis_signature", None)
+    if signature is None:
+        signature = json.dumps(
+            {
+                "name": sf_engine.id.get("name"),
+                "options": get_engine_options(sf_engine)
+            },
+            sort_keys=True,
+            default=str
+        )
+        sf_engine._analysis_signature = signature
+    return signature
+
+
+def _evict(connection):
+    global _inserts
+
+    _inserts += 1
+    if _inserts % EVICT_CHECK_INTERVAL != 1:
+        return
+
+    count = connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+    if count <= MAX_ENTRIES:
+        return
+
+    connection.execute(
+        """
+        DELETE FROM analysis WHERE rowid IN (
+            SELECT rowid FROM analysis ORDER BY last_used LIMIT ?
+        )
+        """,
+        (count - int(MAX_ENTRIES * (1 - EVICT_FRACTION)),)
+    )
+
+
+def get_search_key(
+    depth: int = None,
+    movetime: int = None,
+    nodes: int = None,
+    multipv: int = 1
+):
+    """Describes a search limit for the cache key, e.g. `movetime 500 multipv 3`."""
+    key = get_search_command(depth, movetime, nodes)
+    if multipv > 1:
+        key += f" multipv {multipv}"
+    return key
+
+
+def analyse(
+    sf_engine,
+    fen: str,
+    depth: int = None,
+    movetime: int = None,
+    nodes: int = None,
+    multipv: int = 1
+):
+    """
+    Returns the best move, score, principal variation and (with `multipv`)
+    alternative lines of a position, from the cache when this engine
+    already ran the same search on it.
+    """
+    key = (
+        normalize_fen(fen),
+        get_search_key(depth, movetime, nodes, multipv),
+        get_engine_signature(sf_engine)
+    )
+
+    with _lock:
+        connection = connect()
+        row = connection.execute(
+            "SELECT bestmove, score, pv, lines FROM analysis WHERE fen = ? AND search = ? AND engine = ?",
+            key
+        ).fetchone()
+
+        if row is not None:
+            connection.execute(
+                "UPDATE analysis SET last_used = ? WHERE fen = ? AND search = ? AND engine = ?",
+                (time.time(), *key)
+            )
+            connection.commit()
+
+            pv = row[2].split()
+            return {
+                "bestmove": row[0],
+                "score": row[1],
+                "pv": pv,
+                "lines": json.loads(row[3]) if row[3] else (
+                    [{"move": pv[0], "score": row[1], "pv": pv}] if pv else []
+                )
+            }
+
+    result = analyse_position(sf_engine, fen, depth, movetime, nodes, multipv)
+
+    with _lock:
+        connection = connect()
+        connection.execute(
+            """
+            INSERT OR REPLACE INTO analysis (fen, search, engine, bestmove, score, pv, lines, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                *key,
+                result["bestmove"],
+                result["score"],
+                " ".join(result["pv"]),
+                json.dumps(result["lines"]),
+                time.time()
+            )
+        )
+        _evict(connection)
+        connection.commit()
+
+    return result
+
+
+def is_unique(analysis: dict, margin: int = UNIQUE_MARGIN):
+    """
+    Checks a multi-PV analysis for a single clearly best move: either only
+    one line exists or the runner-up scores at least `margin` worse.
+    """
+    lines = analysis["lines"]
+    if len(lines) < 2:
+        return True
+    return lines[0]["score"] - lines[1]["score"] >= margin
@@ -6,9 +6,14 @@ from chess import (
 )
 import os
 
+import numpy as np
 import moviepy.editor as editor
-from moviepy.video.fx.resize import resize
-from moviepy.video.compositing.transitions import crossfadeout
+
+from lib.python.audio import sound
+from lib.python.profiling import timed
+from lib.python.render import mark_static
+from .frames import get_frame, get_key
+from .sprites import get_sprite
 
 
 
@@ -54,6 +59,129 @@ def get_coordinates(square: str, flipped: bool = False, board_width: int = 1080)
     )
 
 
+def preload_sprites(width: int = 1080):
+    """Decodes every board, piece and highlight asset for a board width."""
+    square_size = round(width / 8)
+
+    for flip_suffix in ("", "flipped"):
+        get_sprite(f"{RESOURCES}/board{flip_suffix}.png", width)
+    for piece_name in PIECES.values():
+        get_sprite(f"{RESOURCES}/{piece_name}.webp", square_size)
+    for highlight_type in ("default", "brilliant"):
+        get_sprite(f"{RESOURCES}/{highlight_type}highlight.png", square_size, opaque=True)
+    get_sprite(f"{RESOURCES}/brilliant.webp", round(width / 18))
+
+
+def blend_sprite(frame, sprite, position: tuple[float, float], opacity: float = 1):
+    """Alpha-blends an RGBA sprite into an RGB frame in place, clipped to the frame."""
+    x, y = int(position[0]), int(position[1])
+    x0, y0 = max(x, 0), max(y, 0)
+    x1 = min(x + sprite.shape[1], frame.shape[1])
+    y1 = min(y + sprite.shape[0], frame.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    patch = sprite[y0 - y : y1 - y, x0 - x : x1 - x]
+    alpha = patch[:, :, 3:] * (opacity / 255)
+    region = frame[y0:y1, x0:x1]
+    region[:] = patch[:, :, :3] * alpha + region * (1 - alpha)
+
+
+def get_piece_sprite(piece_symbol: str, width: int = 1080):
+    return get_sprite(f"{RESOURCES}/{PIECES[piece_symbol]}.webp", round(width / 8))
+
+
+def draw_classification_icon(
+    frame,
+    highlighted_move: str,
+    flipped: bool = False,
+    width: int = 1080
+):
+    classification_icon_size = width / 18
+    classification_icon_position = list(
+        get_coordinates(highlighted_move[2:4], flipped, width)
+    )
+    classification_icon_position[0] += (width / 8) - (classification_icon_size / 1.5)
+    classification_icon_position[1] -= classification_icon_size / 3
+
+    blend_sprite(
+        frame,
+        get_sprite(f"{RESOURCES}/brilliant.webp", round(classification_icon_size)),
+        classification_icon_position
+    )
+
+
+def rasterize_board(
+    fen: str,
+    flipped: bool = False,
+    highlighted_move: str = None,
+    brilliancy: bool = False,
+    width: int = 1080,
+    hidden_squares: tuple[str] = (),
+    classification: bool = True
+):
+    """
+    Returns a board position as a read-only width x width RGB array: board,
+    move highlights, pieces (except `hidden_squares`) and, for brilliant
+    moves, the classification icon. Frames are cached by what they show
+    (frames.py), so each board state is drawn once per process.
+    """
+    return get_frame(
+        get_key(fen, flipped, highlighted_move, brilliancy, width, hidden_squares, classification),
+        lambda: _rasterize_board(
+            fen, flipped, highlighted_move, brilliancy, width, hidden_squares, classification
+        )
+    )
+
+
+def _rasterize_board(
+    fen: str,
+    flipped: bool,
+    highlighted_move: str,
+    brilliancy: bool,
+    width: int,
+    hidden_squares: tuple[str],
+    classification: bool
+):
+    # Draws a board position straight into a new array
+    board_flip_suffix = "flipped" if flipped else ""
+    frame = np.array(get_sprite(f"{RESOURCES}/board{board_flip_suffix}.png", width)[:, :, :3])
+
+    # Move highlights
+    if not highlighted_move is None:
+        highlight_type = "brilliant" if brilliancy else "default"
+        highlight = get_sprite(
+            f"{RESOURCES}/{highlight_type}highlight.png",
+            round(width / 8),
+            opaque=True
+        )
+        for i in range(2):
+            blend_sprite(
+                frame,
+                highlight,
+                get_coordinates(highlighted_move[i * 2 : i * 2 + 2], flipped, width),
+                0.7 if brilliancy else 0.5
+            )
+
+    # Pieces
+    for square, piece in Board(fen).piece_map().items():
+        square_name = square_name_of(square)
+        if square_name in hidden_squares:
+            continue
+
+        blend_sprite(
+            frame,
+            get_piece_sprite(piece.symbol(), width),
+            get_coordinates(square_name, flipped, width)
+        )
+
+    if brilliancy and classification and not highlighted_move is None:
+        draw_classification_icon(frame, highlighted_move, flipped, width)
+
+    return frame
+
+
+@timed("draw_board")
 def draw_board(
     fen: str,
     flipped: bool = False,
@@ -64,134 +192,83 @@ def draw_board(
     width: int = 1080,
     duration: float = 10
 ):  
-    # Board
-    board_flip_suffix = "flipped" if flipped else ""
-    background = resize(
-        (
-            editor.ImageClip(f"{RESOURCES}/board{board_flip_suffix}.png")
-            .set_duration(duration)
-        ),
-        newsize=(width, width)
-    )
-    piece_clips = []
-
     board = Board(fen)
 
-    # Pieces on the board with animation if requested
-    ep_square = None
-    ep_fade_square = None
-    
-    if not board.ep_square is None:
-        ep_square = square_name_of(board.ep_square)
-        if ep_square[1] == "3":
-            ep_fade_square = ep_square[0] + "4"
-        else:
-            ep_fade_square = ep_square[0] + "5"
-
-    square_x = 7 if flipped else 0
-    square_y = square_x
-    for char in fen.split(" ")[0]:
-        if char.isdigit():
-            square_x += int(char) * (-1 if flipped else 1)
-        elif char == "/":
-            square_x = 7 if flipped else 0
-            square_y += -1 if flipped else 1
-        else:
-            piece = resize(
-                editor.ImageClip(f"{RESOURCES}/{PIECES[char]}.webp")
-                .set_duration(duration)
-                .set_position((
-                    square_x * (width / 8),
-                    square_y * (width / 8)
-                )),
-                newsize=(
-                    width / 8,
-                    width / 8
-                )
+    if not animated:
+        # Static boards are rasterized once and shown for their whole duration
+        result = mark_static(editor.ImageClip(
+            rasterize_board(fen, flipped, highlighted_move, brilliancy, width)
+        ).set_duration(duration))
+    else:
+        # Only the moving piece (and the pieces it captures) change per frame
+        ep_square = None
+        ep_fade_square = None
+
+        if not board.ep_square is None:
+            ep_square = square_name_of(board.ep_square)
+            if ep_square[1] == "3":
+                ep_fade_square = ep_square[0] + "4"
+            else:
+                ep_fade_square = ep_square[0] + "5"
+
+        moving_square = highlighted_move[0:2]
+        moving_piece = board.piece_at(parse_square(moving_square))
+
+        fading_squares = [highlighted_move[2:4]]
+        if (
+            highlighted_move[2:4] == ep_square
+            and moving_piece.piece_type == PAWN
+        ):
+            fading_squares.append(ep_fade_square)
+        fading_pieces = [
+            (
+                get_piece_sprite(board.piece_at(parse_square(square)).symbol(), width),
+                get_coordinates(square, flipped, width)
             )
-
-            square_name = get_square(square_x, square_y, flipped)
-            if animated:
-                if square_name == highlighted_move[0:2]:
-                    piece = piece.set_position(slide_to_position(
-                        get_coordinates(square_name, flipped),
-                        get_coordinates(highlighted_move[2:4], flipped),
-                        duration - 0.05
-                    ))
-                elif (
-                    square_name == highlighted_move[2:4]
-                    or (
-                        square_name == ep_fade_square
-                        and highlighted_move[2:4] == ep_square
-                        and board.piece_at(parse_square(highlighted_move[0:2])).piece_type == PAWN
-                    )
-                ):
-                    piece = crossfadeout(piece, duration - 0.05)                    
-
-            piece_clips.append(piece)
-
-            square_x += -1 if flipped else 1
-
-    # Move highlight and classification icon
-    move_highlights = []
-    if not highlighted_move is None:
-        highlight_type = "brilliant" if brilliancy else "default"
-
-        move_highlights = [
-            resize(
-                editor.ImageClip(f"{RESOURCES}/{highlight_type}highlight.png") 
-                .set_duration(duration)
-                .set_position(
-                    get_coordinates(highlighted_move[i * 2 : i * 2 + 2], flipped)
-                )
-                .set_opacity(0.7 if brilliancy else 0.5),
-
-                newsize=(
-                    width / 8,
-                    width / 8
-                )
-            ) for i in range(2)
+            for square in fading_squares
+            if not board.piece_at(parse_square(square)) is None
         ]
 
-        classification_icon_size = width / 18
-        classification_icon_position = list(
-            get_coordinates(highlighted_move[2:4], flipped)
+        base_frame = rasterize_board(
+            fen,
+            flipped,
+            highlighted_move,
+            brilliancy,
+            width,
+            hidden_squares=(moving_square, *fading_squares),
+            classification=False
         )
-        classification_icon_position[0] += (width / 8) - (classification_icon_size / 1.5)
-        classification_icon_position[1] -= classification_icon_size / 3
-
-        classification_icon = resize(
-            editor.ImageClip(f"{RESOURCES}/brilliant.webp")
-            .set_duration(duration)
-            .set_position(tuple(classification_icon_position)),
-            newsize=(
-                classification_icon_size, 
-                classification_icon_size
-            )
+        frame = np.empty_like(base_frame)
+
+        moving_sprite = get_piece_sprite(moving_piece.symbol(), width)
+        moving_position = slide_to_position(
+            get_coordinates(moving_square, flipped, width),
+            get_coordinates(highlighted_move[2:4], flipped, width),
+            duration - 0.05
         )
 
-    # Move Audio
-    result_audio_clips = []
-    if (not highlighted_move is None) and audio:
-        highlighted_move_san = board.san(board.parse_uci(highlighted_move))
+        def make_frame(t):
+            np.copyto(frame, base_frame)
 
-        result_audio_clips.append(
-            get_move_audio(highlighted_move_san)
-        )
+            fade_opacity = min(1, max(0, (duration - t) / (duration - 0.05)))
+            for sprite, position in fading_pieces:
+                blend_sprite(frame, sprite, position, fade_opacity)
+
+            blend_sprite(frame, moving_sprite, moving_position(t))
+
+            if brilliancy:
+                draw_classification_icon(frame, highlighted_move, flipped, width)
+
+            return frame
 
-    result_video_clips = [
-        background,
-        *move_highlights,
-        *piece_clips
-    ]
+        result = editor.VideoClip(make_frame, duration=duration)
 
-    if brilliancy:
-        result_video_clips.append(classification_icon)
+    # Move Audio
+    if (not highlighted_move is None) and audio:
+        highlighted_move_san = board.san(board.parse_uci(highlighted_move))
 
-    # Composite result clip
-    result = editor.CompositeVideoClip(result_video_clips)
-    if len(result_audio_clips) > 0:
-        result.audio = editor.CompositeAudioClip(result_audio_clips)
+        # Mixed with the rest of the soundtrack when the short is written
+        result.sounds = [sound(get_move_audio(highlighted_move_san))]
 
     return result
 
@@ -243,4 +320,4 @@ def get_move_audio(move_san: str):
     elif "x" in move_san:
         move_audio_clip_name = "capture"
 
-    return editor.AudioFileClip(f"./src/resources/chess/{move_audio_clip_name}.mp3")
\ No newline at end of file
+    return f"./src/resources/chess/{move_audio_clip_name}.mp3"
\ No newline at end of file
@@ -0,0 +1,308 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+from chess import Board
+from chess.engine import INFO_BASIC, INFO_PV, INFO_SCORE, Limit, SimpleEngine
+
+
+LOCAL_STOCKFISH = "./src/resources/bin/stockfish.exe"
+
+# Engine pool defaults, overridable through the environment
+DEFAULT_POOL_SIZE = int(os.environ.get("STOCKFISH_POOL_SIZE", 2))
+DEFAULT_HASH_SIZE = int(os.environ.get("STOCKFISH_HASH", 128))
+DEFAULT_THREADS = int(os.environ.get("STOCKFISH_THREADS", 1))
+DEFAULT_DEPTH = 18
+
+# Seconds an engine may take to answer a command (or to exceed a timed
+# search) before it is considered hung and replaced
+ENGINE_TIMEOUT = float(os.environ.get("STOCKFISH_TIMEOUT", 10))
+
+# Seconds a depth or node limited search may run before it is cut off
+# and fails
+SEARCH_TIMEOUT = float(os.environ.get("STOCKFISH_SEARCH_TIMEOUT", 120))
+
+# Centipawn score used for forced mates, minus the distance to mate
+MATE_SCORE = 100000
+
+# UCI options set on every pooled engine, part of the analysis cache key
+ENGINE_OPTIONS = ("Hash", "Threads")
+
+
+def get_stockfish_path():
+    """Finds the Stockfish binary, preferring the bundled one."""
+    if os.path.exists(LOCAL_STOCKFISH):
+        return LOCAL_STOCKFISH
+    return shutil.which("stockfish") or "/usr/games/stockfish"
+
+
+def get_default_search():
+    """
+    Returns the search limit used when none is given: a wall-clock budget
+    (STOCKFISH_MOVETIME, ms) or node budget (STOCKFISH_NODES) when set in
+    the environment, otherwise a fixed depth.
+    """
+    if os.environ.get("STOCKFISH_MOVETIME"):
+        return {"movetime": int(os.environ["STOCKFISH_MOVETIME"])}
+    if os.environ.get("STOCKFISH_NODES"):
+        return {"nodes": int(os.environ["STOCKFISH_NODES"])}
+    return {"depth": DEFAULT_DEPTH}
+
+
+def get_search_command(depth: int = None, movetime: int = None, nodes: int = None):
+    """Describes a depth, time or node limited search like the UCI `go` arguments."""
+    if depth is None and movetime is None and nodes is None:
+        return get_search_command(**get_default_search())
+
+    limits = []
+    if depth is not None:
+        limits.append(f"depth {depth}")
+    if movetime is not None:
+        limits.append(f"movetime {movetime}")
+    if nodes is not None:
+        limits.append(f"nodes {nodes}")
+    return " ".join(limits)
+
+
+def get_search_limit(depth: int = None, movetime: int = None, nodes: int = None):
+    """
+    Builds the python-chess limit for a search. Depth and node limited
+    searches are also capped at SEARCH_TIMEOUT seconds, so python-chess
+    gives up on an engine that stops answering past the cap.
+    """
+    if movetime is not None:
+        return Limit(depth=depth, time=movetime / 1000, nodes=nodes)
+    return Limit(depth=depth, time=SEARCH_TIMEOUT, nodes=nodes)
+
+
+def get_engine_options(sf_engine):
+    """Returns the UCI options the pool configures, as set on an engine."""
+    config = sf_engine.protocol.config
+    return {name: config[name] for name in ENGINE_OPTIONS if name in config}
+
+
+def _get_line(info: dict, turn: bool):
+    return {
+        "score": info["score"].pov(turn).score(mate_score=MATE_SCORE) if "score" in info else 0,
+        "pv": [move.uci() for move in info.get("pv", [])]
+    }
+
+
+def analyse_position(
+    sf_engine,
+    fen: str,
+    depth: int = None,
+    movetime: int = None,
+    nodes: int = None,
+    multipv: int = 1
+):
+    """
+    Runs a single search under a depth, wall-clock (ms) or node limit and
+    returns its best move, score and principal variation. With `multipv`
+    above 1 the alternative lines of the same search are returned as well.
+    An engine that does not answer in time, or a depth or node limited
+    search cut off at SEARCH_TIMEOUT, raises TimeoutError.
+    """
+    if depth is None and movetime is None and nodes is None:
+        return analyse_position(sf_engine, fen, multipv=multipv, **get_default_search())
+
+    board = Board(fen)
+    infos = sf_engine.analyse(
+        board,
+        get_search_limit(depth, movetime, nodes),
+        multipv=multipv,
+        # python-chess sends ucinewgame whenever the game changes
+        game=getattr(sf_engine, "checkout", None),
+        info=INFO_BASIC | INFO_SCORE | INFO_PV
+    )
+
+    if movetime is None and infos and infos[0].get("time", 0) >= SEARCH_TIMEOUT:
+        raise TimeoutError(f"search did not finish within {SEARCH_TIMEOUT} seconds")
+
+    lines = [_get_line(info, board.turn) for info in infos]
+    top_line = lines[0] if lines else {"score": 0, "pv": []}
+
+    return {
+        "bestmove": top_line["pv"][0] if top_line["pv"] else None,
+        "score": top_line["score"],
+        "pv": top_line["pv"],
+        "lines": [
+            {"move": line["pv"][0], "score": line["score"], "pv": line["pv"]}
+            for line in lines
+            if line["pv"]
+        ][:multipv]
+    }
+
+
+class EnginePool:
+    """
+    A process-wide pool of long-lived Stockfish engines, run through
+    python-chess. Engines are started lazily up to `size`, start a new game
+    (`ucinewgame`) on every checkout and are replaced when they crash or
+    stop answering within ENGINE_TIMEOUT.
+    """
+
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        hash_size: int = DEFAULT_HASH_SIZE,
+        threads: int = DEFAULT_THREADS,
+        path: str = None
+    ):
+        self.size = size
+        self.hash_size = hash_size
+        self.threads = threads
+        self.path = path or get_stockfish_path()
+
+        self._idle = []
+        self._started = 0
+        self._closed = False
+        self._pid = os.getpid()
+        self._condition = threading.Condition()
+
+        # python-chess talks to every engine from a non-daemon thread, which
+        # the interpreter waits for before running atexit handlers
+        threading._register_atexit(self.close)
+
+    def _spawn(self):
+        popen_params = {}
+        if os.name == "nt":
+            popen_params["creationflags"] = 0x08000000
+
+        sf_engine = SimpleEngine.popen_uci(self.path, timeout=ENGINE_TIMEOUT, **popen_params)
+        try:
+            parameters = {
+                "Hash": self.hash_size,
+                "Threads": self.threads
+            }
+            sf_engine.configure({
+                name: value for name, value in parameters.items()
+                if name in sf_engine.options
+            })
+        except Exception:
+            self._stop(sf_engine)
+            raise
+        return sf_engine
+
+    def is_healthy(self, sf_engine):
+        """Checks that an engine process is alive and answers `isready` in time."""
+        if sf_engine.returncode.done():
+            return False
+        try:
+            sf_engine.ping()
+            return True
+        except Exception:
+            return False
+
+    def _stop(self, sf_engine):
+        try:
+            sf_engine.quit()
+        except Exception:
+            pass
+        finally:
+            sf_engine.close()
+
+    def acquire(self, timeout: float = None):
+        """Checks out a healthy engine, starting or restarting one if needed."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("engine pool is closed")
+
+            while not self._idle and self._started >= self.size:
+                if not self._condition.wait(timeout):
+                    raise TimeoutError("no Stockfish engine became available")
+
+            if self._idle:
+                sf_engine = self._idle.pop()
+            else:
+                sf_engine = None
+                self._started += 1
+
+        try:
+            if sf_engine is not None and not self.is_healthy(sf_engine):
+                print("Stockfish engine stopped responding, restarting it.")
+                self._stop(sf_engine)
+                sf_engine = None
+
+            if sf_engine is None:
+                sf_engine = self._spawn()
+        except Exception:
+            with self._condition:
+                self._started -= 1
+                self._condition.notify()
+            raise
+
+        # Searches pass this as their game, so each checkout is a new game
+        sf_engine.checkout = object()
+        return sf_engine
+
+    def release(self, sf_engine):
+        """Returns an engine to the pool, dropping it if it crashed."""
+        healthy = self.is_healthy(sf_engine)
+
+        with self._condition:
+            if healthy and not self._closed:
+                self._idle.append(sf_engine)
+            else:
+                self._started -= 1
+            self._condition.notify()
+
+        if not healthy or self._closed:
+            self._stop(sf_engine)
+
+    @contextmanager
+    def engine(self, timeout: float = None):
+        """Context manager that checks an engine out for one request."""
+        sf_engine = self.acquire(timeout)
+        try:
+            yield sf_engine
+        finally:
+            self.release(sf_engine)
+
+    def close(self):
+        """Stops every idle engine and refuses further checkouts."""
+        if self._pid != os.getpid():
+            # A forked child never shares its parent's engines
+            return
+
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+            self._condition.notify_all()
+
+        for sf_engine in idle:
+            self._stop(sf_engine)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_engine_pool(**options):
+    """
+    Returns the process-wide engine pool, creating it with `options` on the
+    first call in this process. Later calls share the same warm engines and
+    may only repeat the options the pool was created with.
+    """
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # A forked child never shares its parent's engine pipes
+            _pool = EnginePool(**options)
+            _pool_pid = os.getpid()
+            return _pool
+
+        different = {
+            name: value for name, value in options.items()
+            if getattr(_pool, name) != value
+        }
+        if different:
+            raise ValueError(
+                f"engine pool already created with other options than {different}; "
+                "create an EnginePool of your own instead"
+            )
+        return _pool
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from glob import glob
+
+import numpy as np
+
+from lib.python import profiling
+from lib.python.assets import get_source_hash
+from lib.python.helpers import BASE_DIR, DATA_DIR
+
+
+BOARD_CACHE_DIR = os.path.join(DATA_DIR, "cache", "boards")
+
+# Rasterized boards kept in memory, least recently used dropped first
+MAX_MEMORY_BYTES = int(os.environ.get("BOARD_CACHE_MB", 256)) * 2 ** 20
+
+# Set to 1 to also keep every board drawn in BOARD_CACHE_DIR, shared by
+# all processes and later runs
+DISK_CACHE_ENABLED = os.environ.get("BOARD_CACHE_DISK", "0") not in ("", "0")
+
+# Code deciding what a board looks like; with the chess assets, editing any
+# of it invalidates the boards on disk
+BOARD_SOURCES = (
+    "src/lib/python/chess/board.py",
+    "src/lib/python/chess/sprites.py"
+)
+BOARD_ASSETS = "src/resources/chess"
+
+_frames = OrderedDict()
+_frames_bytes = 0
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_version():
+    """Hashes the board drawing code and assets, so boards on disk never outlive them."""
+    sha1 = hashlib.sha1()
+    for source in BOARD_SOURCES:
+        with open(os.path.join(BASE_DIR, source), "rb") as f:
+            sha1.update(f.read())
+    for path in sorted(glob(os.path.join(BASE_DIR, BOARD_ASSETS, "*"))):
+        if path.endswith((".png", ".webp")):
+            sha1.update(get_source_hash(path).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+def get_key(
+    fen: str,
+    flipped: bool,
+    highlighted_move: str,
+    brilliancy: bool,
+    width: int,
+    hidden_squares: tuple = (),
+    classification: bool = True
+):
+    """
+    Describes a board frame by what is drawn: the piece placement (turn,
+    castling rights and clocks are not drawn), orientation, highlighted
+    squares, brilliancy, size and the squares left empty for animation.
+    """
+    highlighted_move = highlighted_move[:4] if highlighted_move is not None else None
+    return (
+        fen.split(" ")[0],
+        bool(flipped),
+        highlighted_move,
+        bool(brilliancy) and highlighted_move is not None,
+        int(width),
+        tuple(sorted(hidden_squares)),
+        bool(classification) and bool(brilliancy) and highlighted_move is not None
+    )
+
+
+def _get_path(key: tuple):
+    digest = hashlib.sha1(f"{get_version()}:{key!r}".encode("utf-8")).hexdigest()
+    return os.path.join(BOARD_CACHE_DIR, f"{digest}.npz")
+
+
+def _load(key: tuple):
+    try:
+        with np.load(_get_path(key)) as data:
+            return data["frame"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save(key: tuple, frame: np.ndarray):
+    # Written then renamed, so other processes never read a partial file
+    os.makedirs(BOARD_CACHE_DIR, exist_ok=True)
+    handle, temporary_path = tempfile.mkstemp(suffix=".npz.tmp", dir=BOARD_CACHE_DIR)
+    try:
+        with os.fdopen(handle, "wb") as f:
+            np.savez_compressed(f, frame=frame)
+        os.replace(temporary_path, _get_path(key))
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def _remember(key: tuple, frame: np.ndarray):
+    global _frames_bytes
+
+    with _lock:
+        if key in _frames:
+            return
+        _frames[key] = frame
+        _frames_bytes += frame.nbytes
+        while _frames_bytes > MAX_MEMORY_BYTES and len(_frames) > 1:
+            _, dropped = _frames.popitem(last=False)
+            _frames_bytes -= dropped.nbytes
+
+
+def get_frame(key: tuple, draw):
+    """
+    Returns the board frame for a key, read-only, calling `draw()` only
+    for a board not drawn before in this process (or on disk, with
+    BOARD_CACHE_DISK=1).
+    """
+    with _lock:
+        frame = _frames.get(key)
+        if frame is not None:
+            _frames.move_to_end(key)
+    if frame is not None:
+        profiling.add_counters(board_frames_reused=1)
+        return frame
+
+    frame = _load(key) if DISK_CACHE_ENABLED else None
+    if frame is not None:
+        profiling.add_counters(board_frames_loaded=1)
+    else:
+        frame = draw()
+        profiling.add_counters(board_frames_drawn=1)
+        if DISK_CACHE_ENABLED:
+            _save(key, frame)
+
+    frame.setflags(write=False)
+    _remember(key, frame)
+    return frame
+
+
+def clear_frames(disk: bool = False):
+    """Drops every board frame kept in memory, and on disk if `disk`."""
+    global _frames_bytes
+
+    with _lock:
+        _frames.clear()
+        _frames_bytes = 0
+
+    if disk:
+        for path in glob(os.path.join(BOARD_CACHE_DIR, "*.npz")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,190 @@
+import json
+import os
+import random
+import re
+
+from lib.python.helpers import BASE_DIR, DATA_DIR
+
+
+GAMES_DIR = os.path.join(BASE_DIR, "games")
+INDEX_PATH = os.path.join(DATA_DIR, "pgn_index.json")
+INDEX_VERSION = 1
+
+# Header fields kept in the index, stored positionally after offset and length
+INDEX_HEADERS = ("Event", "Site", "Date", "White", "Black", "Result", "ECO")
+
+HEADER_PATTERN = re.compile(rb'^\[(\w+)\s+"(.*)"\]')
+
+_index = None
+
+
+def scan_file(path: str):
+    """
+    Streams through a PGN file once and returns a list of
+    [offset, length, *headers] records, one per game.
+    """
+    games = []
+    current = None
+    in_moves = True
+    offset = 0
+
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"["):
+                if in_moves:
+                    # Header after move text (or at the start) opens a new game
+                    if current is not None:
+                        current[1] = offset - current[0]
+                        games.append(current)
+                    current = [offset, 0, *([""] * len(INDEX_HEADERS))]
+                    in_moves = False
+
+                match = HEADER_PATTERN.match(line)
+                if match:
+                    tag = match.group(1).decode("ascii", "replace")
+                    if tag in INDEX_HEADERS:
+                        current[2 + INDEX_HEADERS.index(tag)] = (
+                            match.group(2).decode("utf-8", "replace")
+                        )
+            elif line.strip() and current is not None:
+                in_moves = True
+
+            offset += len(line)
+
+    if current is not None:
+        current[1] = offset - current[0]
+        games.append(current)
+
+    return games
+
+
+def _file_stat(path: str):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def load_index():
+    """
+    Loads the PGN index, rescanning any file in games/ whose mtime or size
+    changed since it was indexed and dropping files that no longer exist.
+    """
+    global _index
+
+    if _index is None:
+        _index = {"version": INDEX_VERSION, "files": {}}
+        if os.path.exists(INDEX_PATH):
+            try:
+                with open(INDEX_PATH, "r", encoding="utf-8") as f:
+                    stored = json.load(f)
+                if stored.get("version") == INDEX_VERSION:
+                    _index = stored
+            except (json.JSONDecodeError, OSError):
+                pass
+
+    if not os.path.exists(GAMES_DIR):
+        return _index
+
+    files = _index["files"]
+    pgn_files = [f for f in os.listdir(GAMES_DIR) if f.endswith(".pgn")]
+    changed = False
+
+    for filename in pgn_files:
+        mtime, size = _file_stat(os.path.join(GAMES_DIR, filename))
+        entry = files.get(filename)
+        if entry is None or entry["mtime"] != mtime or entry["size"] != size:
+            files[filename] = {
+                "mtime": mtime,
+                "size": size,
+                "games": scan_file(os.path.join(GAMES_DIR, filename))
+            }
+            changed = True
+
+    for filename in list(files.keys()):
+        if filename not in pgn_files:
+            del files[filename]
+            changed = True
+
+    if changed:
+        save_index(_index)
+
+    return _index
+
+
+def save_index(index):
+    """Saves the PGN index."""
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+    with open(INDEX_PATH, "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+
+def _to_record(filename: str, game_index: int, game: list):
+    return {
+        "file": filename,
+        "index": game_index,
+        "offset": game[0],
+        "length": game[1],
+        "headers": dict(zip(INDEX_HEADERS, game[2:]))
+    }
+
+
+def count_games(filename: str = None):
+    """Returns the number of indexed games, in one file or the whole library."""
+    files = load_index()["files"]
+    if filename is not None:
+        return len(files[filename]["games"]) if filename in files else 0
+    return sum(len(entry["games"]) for entry in files.values())
+
+
+def get_games(filename: str = None):
+    """Lists index records for one file or the whole library."""
+    files = load_index()["files"]
+    filenames = [filename] if filename is not None else sorted(files.keys())
+
+    return [
+        _to_record(name, game_index, game)
+        for name in filenames if name in files
+        for game_index, game in enumerate(files[name]["games"])
+    ]
+
+
+def get_game(filename: str, game_index: int):
+    """Returns the index record for a single game."""
+    games = load_index()["files"][filename]["games"]
+    return _to_record(filename, game_index, games[game_index])
+
+
+def read_game(record: dict):
+    """Seeks straight to a game record and returns its PGN text."""
+    with open(os.path.join(GAMES_DIR, record["file"]), "rb") as f:
+        f.seek(record["offset"])
+        return f.read(record["length"]).decode("utf-8", "replace")
+
+
+def get_random_game(filename: str = None):
+    """
+    Picks a random game record, uniformly over every game in the library
+    (or in one file when a filename is given).
+    """
+    files = load_index()["files"]
+    filenames = [filename] if filename is not None else list(files.keys())
+    counts = [
+        len(files[name]["games"]) if name in files else 0
+        for name in filenames
+    ]
+    if sum(counts) == 0:
+        return None
+
+    game_number = random.randrange(sum(counts))
+    for name, count in zip(filenames, counts):
+        if game_number < count:
+            return get_game(name, game_number)
+        game_number -= count
+
+
+def get_random_game_pgn(filename: str = None):
+    """Returns the PGN text of a random game, or None if the library is empty."""
+    record = get_random_game(filename)
+    if record is None:
+        return None
+    return read_game(record)
@@ -0,0 +1,517 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from contextlib import ExitStack
+from io import StringIO
+
+import proglog
+
+from chess import (
+    Board,
+    Move,
+    pgn,
+    PAWN, KING
+)
+
+from lib.python.helpers import DATA_DIR
+from .analysis import analyse, is_unique
+from .engine import EnginePool
+from .solution import piece_values, get_response_move, get_solution_line
+from . import library
+
+
+PUZZLES_DB_PATH = os.path.join(DATA_DIR, "puzzles.db")
+
+# Candidate scoring
+BRILLIANT_SCORE = 5
+MIN_SACRIFICE = 2
+SWING_THRESHOLD = 200
+MIN_SCORE = 3
+UNIQUE_SCORE = 1
+
+# Search used to verify candidates; the solution line uses the engine default
+VERIFY_SEARCH = {"depth": 12}
+
+# Mining checkpoints
+CHUNK_GAMES = 100
+CHECKPOINT_GAMES = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS puzzles (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    game_index INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    fen TEXT NOT NULL,
+    move TEXT NOT NULL,
+    san TEXT NOT NULL,
+    flipped INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    score REAL NOT NULL,
+    reasons TEXT NOT NULL,
+    white TEXT,
+    black TEXT,
+    date TEXT,
+    UNIQUE (file, game_index, ply)
+);
+CREATE INDEX IF NOT EXISTS puzzles_score ON puzzles (score);
+CREATE TABLE IF NOT EXISTS mining_chunks (
+    file TEXT NOT NULL,
+    chunk_start INTEGER NOT NULL,
+    chunk_end INTEGER NOT NULL,
+    resume_offset INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (file, chunk_start)
+);
+"""
+
+
+def connect():
+    """Opens the puzzle store, creating it if needed."""
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+    connection = sqlite3.connect(PUZZLES_DB_PATH, timeout=60)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def get_sacrificed_material(board: Board, move: Move):
+    """
+    Returns how much material a move leaves en prise, net of what it
+    captures and what can be won back, or 0 if it is not a sacrifice.
+    """
+    piece = board.piece_at(move.from_square)
+    if piece is None or piece.piece_type in (PAWN, KING):
+        return 0
+
+    captured = board.piece_at(move.to_square)
+    gained = piece_values[captured.piece_type] if captured else 0
+
+    after = board.copy(stack=False)
+    after.push(move)
+
+    capturing_moves = [
+        legal_move for legal_move in after.legal_moves
+        if legal_move.to_square == move.to_square
+    ]
+    if not capturing_moves:
+        return 0
+
+    value = piece_values[piece.piece_type]
+    if after.attackers(not after.turn, move.to_square):
+        lowest_attacker = min(
+            piece_values[after.piece_type_at(capture.from_square)]
+            for capture in capturing_moves
+        )
+        return max(value - gained - lowest_attacker, 0)
+
+    return max(value - gained, 0)
+
+
+def score_move(board: Board, move: Move, nags: set):
+    """Statically scores a played move as a puzzle candidate."""
+    score = 0
+    reasons = []
+
+    if pgn.NAG_BRILLIANT_MOVE in nags:
+        score += BRILLIANT_SCORE
+        reasons.append("brilliant")
+
+    sacrificed = get_sacrificed_material(board, move)
+    if sacrificed >= MIN_SACRIFICE:
+        score += sacrificed
+        reasons.append("sacrifice")
+
+    return score, reasons
+
+
+def mine_game(
+    game_pgn: str,
+    sf_engine=None,
+    search: dict = None,
+    min_score: float = MIN_SCORE,
+    stats: dict = None
+):
+    """
+    Walks the mainline of a game and returns its puzzle candidates. With an
+    engine, every position is searched once: candidates must be the
+    engine's best move, a large eval swing from the opponent's previous
+    move makes a candidate on its own, and a unique solution adds to the
+    score. Positions walked are counted into `stats["positions"]`.
+    """
+    search = search or VERIFY_SEARCH
+    game = pgn.read_game(StringIO(game_pgn))
+    if game is None:
+        return []
+
+    candidates = []
+    board = game.board()
+    previous_analysis = None
+
+    for ply, node in enumerate(game.mainline()):
+        move = node.move
+        score, reasons = score_move(board, move, node.nags)
+        fen = board.fen()
+
+        if sf_engine is not None:
+            # One multi-PV search answers "best?" and "unique?", and on the
+            # next ply how far the opponent's move swung the eval
+            analysis = analyse(sf_engine, fen, multipv=2, **search)
+            if analysis["bestmove"] != move.uci():
+                score = 0
+            else:
+                if previous_analysis is not None:
+                    # Both scores are from their side to move's perspective
+                    swing = analysis["score"] + previous_analysis["score"]
+                    if swing >= SWING_THRESHOLD:
+                        score += min(swing, 1000) / 100
+                        reasons.append("swing")
+
+                if score > 0 and is_unique(analysis):
+                    score += UNIQUE_SCORE
+                    reasons.append("unique")
+            previous_analysis = analysis
+
+        if score > 0 and score >= min_score:
+            after = board.copy(stack=False)
+            after.push(move)
+
+            if sf_engine is not None:
+                line = get_solution_line(after, move.to_square, sf_engine)
+            else:
+                response_move = get_response_move(after, move.to_square)
+                line = [response_move.uci()] if response_move else []
+
+            candidates.append({
+                "ply": ply,
+                "fen": fen,
+                "move": move.uci(),
+                "san": board.san(move),
+                "flipped": after.turn,
+                "line": line,
+                "score": score,
+                "reasons": reasons,
+                "white": game.headers.get("White"),
+                "black": game.headers.get("Black"),
+                "date": game.headers.get("Date")
+            })
+
+        board.push(move)
+
+        if stats is not None:
+            stats["positions"] = stats.get("positions", 0) + 1
+
+    return candidates
+
+
+def save_candidates(connection, filename: str, game_index: int, candidates: list):
+    """
+    Stores the candidates of one game. Candidates mined before are updated
+    in place, so their puzzle ids stay valid across re-mining.
+    """
+    connection.executemany(
+        """
+        INSERT INTO puzzles (
+            file, game_index, ply, fen, move, san, flipped, line,
+            score, reasons, white, black, date
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (file, game_index, ply) DO UPDATE SET
+            fen = excluded.fen,
+            move = excluded.move,
+            san = excluded.san,
+            flipped = excluded.flipped,
+            line = excluded.line,
+            score = excluded.score,
+            reasons = excluded.reasons,
+            white = excluded.white,
+            black = excluded.black,
+            date = excluded.date
+        """,
+        [
+            (
+                filename, game_index, candidate["ply"], candidate["fen"],
+                candidate["move"], candidate["san"], int(candidate["flipped"]),
+                " ".join(candidate["line"]), candidate["score"],
+                ",".join(candidate["reasons"]), candidate["white"],
+                candidate["black"], candidate["date"]
+            ) for candidate in candidates
+        ]
+    )
+
+
+def _plan_chunks(connection, filenames: list[str]):
+    """
+    Splits the library into checkpointed chunks of games and returns the
+    ones not finished yet. Files whose mtime or size changed since they were
+    planned lose their checkpoints and puzzles, as game indices may shift.
+    """
+    files = library.load_index()["files"]
+    pending = []
+
+    for filename in filenames:
+        entry = files.get(filename)
+        if entry is None:
+            continue
+
+        rows = connection.execute(
+            "SELECT * FROM mining_chunks WHERE file = ? ORDER BY chunk_start",
+            (filename,)
+        ).fetchall()
+
+        if rows and (rows[0]["mtime"] != entry["mtime"] or rows[0]["size"] != entry["size"]):
+            connection.execute("DELETE FROM mining_chunks WHERE file = ?", (filename,))
+            connection.execute("DELETE FROM puzzles WHERE file = ?", (filename,))
+            rows = []
+
+        games = [
+            (game_index, game[0], game[1])
+            for game_index, game in enumerate(entry["games"])
+        ]
+
+        if not rows:
+            for first_game in range(0, len(games), CHUNK_GAMES):
+                chunk_games = games[first_game:first_game + CHUNK_GAMES]
+                connection.execute(
+                    """
+                    INSERT INTO mining_chunks (file, chunk_start, chunk_end, resume_offset, mtime, size)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        filename,
+                        chunk_games[0][1],
+                        chunk_games[-1][1] + chunk_games[-1][2],
+                        chunk_games[0][1],
+                        entry["mtime"],
+                        entry["size"]
+                    )
+                )
+            rows = connection.execute(
+                "SELECT * FROM mining_chunks WHERE file = ? ORDER BY chunk_start",
+                (filename,)
+            ).fetchall()
+
+        for row in rows:
+            if row["resume_offset"] >= row["chunk_end"]:
+                continue
+            pending.append((
+                filename,
+                row["chunk_start"],
+                [
+                    game for game in games
+                    if row["resume_offset"] <= game[1] < row["chunk_end"]
+                ]
+            ))
+
+    connection.commit()
+    return pending
+
+
+_worker = {}
+
+
+def _init_worker(use_engine: bool, search: dict, min_score: float):
+    """Sets up a mining worker with its own single-engine pool."""
+    _worker["search"] = search
+    _worker["min_score"] = min_score
+    _worker["pool"] = EnginePool(size=1, threads=1) if use_engine else None
+
+
+def _mine_chunk(task):
+    """
+    Mines one chunk of games, committing candidates together with the byte
+    offset checkpoint every CHECKPOINT_GAMES games.
+    """
+    filename, chunk_start, games = task
+    stats = {"positions": 0}
+    found = 0
+    started = time.perf_counter()
+
+    connection = connect()
+    with ExitStack() as stack:
+        f = stack.enter_context(open(os.path.join(library.GAMES_DIR, filename), "rb"))
+        sf_engine = None
+        if _worker["pool"] is not None:
+            sf_engine = stack.enter_context(_worker["pool"].engine())
+
+        for count, (game_index, offset, length) in enumerate(games, 1):
+            f.seek(offset)
+            game_pgn = f.read(length).decode("utf-8", "replace")
+
+            candidates = mine_game(
+                game_pgn,
+                sf_engine,
+                _worker["search"],
+                _worker["min_score"],
+                stats
+            )
+            save_candidates(connection, filename, game_index, candidates)
+            found += len(candidates)
+
+            if count % CHECKPOINT_GAMES == 0 or count == len(games):
+                connection.execute(
+                    "UPDATE mining_chunks SET resume_offset = ? WHERE file = ? AND chunk_start = ?",
+                    (offset + length, filename, chunk_start)
+                )
+                connection.commit()
+
+    connection.close()
+
+    return {
+        "worker": os.getpid(),
+        "games": len(games),
+        "positions": stats["positions"],
+        "candidates": found,
+        "elapsed": time.perf_counter() - started
+    }
+
+
+def mine_library(
+    filenames: list[str] = None,
+    use_engine: bool = True,
+    search: dict = None,
+    min_score: float = MIN_SCORE,
+    workers: int = None,
+    restart: bool = False,
+    logger="bar"
+):
+    """
+    Mines puzzle candidates from the PGN library into the puzzle store
+    across a pool of worker processes, each owning a Stockfish process.
+    Interrupted runs resume from their last checkpoint unless `restart`.
+    """
+    logger = proglog.default_bar_logger(logger)
+    if filenames is None:
+        filenames = sorted(library.load_index()["files"].keys())
+    workers = workers or os.cpu_count() or 1
+
+    connection = connect()
+    if restart:
+        for filename in filenames:
+            connection.execute("DELETE FROM mining_chunks WHERE file = ?", (filename,))
+            connection.execute("DELETE FROM puzzles WHERE file = ?", (filename,))
+    pending = _plan_chunks(connection, filenames)
+    connection.close()
+
+    total_games = sum(len(task[2]) for task in pending)
+    logger(message=f"Mining {total_games} games with {workers} workers")
+    logger(games__total=total_games, games__index=0)
+
+    totals = {"games": 0, "positions": 0, "candidates": 0}
+    worker_totals = {}
+    started = time.perf_counter()
+
+    def record(result):
+        for key in totals:
+            totals[key] += result[key]
+
+        worker = worker_totals.setdefault(
+            result["worker"], {"games": 0, "positions": 0, "elapsed": 0}
+        )
+        for key in worker:
+            worker[key] += result[key]
+
+        logger(games__index=totals["games"])
+        logger(message=(
+            f"worker {result['worker']}: "
+            f"{worker['games'] / worker['elapsed']:.1f} games/sec, "
+            f"{worker['positions'] / worker['elapsed']:.0f} positions/sec"
+        ))
+
+    initargs = (use_engine, search or VERIFY_SEARCH, min_score)
+    if workers == 1:
+        _init_worker(*initargs)
+        for task in pending:
+            record(_mine_chunk(task))
+    else:
+        with multiprocessing.Pool(workers, _init_worker, initargs) as pool:
+            for result in pool.imap_unordered(_mine_chunk, pending):
+                record(result)
+
+    elapsed = time.perf_counter() - started
+    logger(message=(
+        f"Mined {totals['games']} games in {elapsed:.1f}s: "
+        f"{totals['candidates']} candidates, "
+        f"{totals['games'] / max(elapsed, 1e-9):.1f} games/sec, "
+        f"{totals['positions'] / max(elapsed, 1e-9):.0f} positions/sec"
+    ))
+
+    return {**totals, "elapsed": elapsed, "workers": worker_totals}
+
+
+def _to_puzzle(row):
+    puzzle = dict(row)
+    puzzle["flipped"] = bool(puzzle["flipped"])
+    puzzle["line"] = puzzle["line"].split()
+    puzzle["reasons"] = puzzle["reasons"].split(",") if puzzle["reasons"] else []
+    return puzzle
+
+
+def get_puzzle(puzzle_id: int):
+    """Loads a mined puzzle by ID."""
+    connection = connect()
+    row = connection.execute(
+        "SELECT * FROM puzzles WHERE id = ?", (puzzle_id,)
+    ).fetchone()
+    connection.close()
+
+    if row is None:
+        raise KeyError(f"puzzle {puzzle_id} not found")
+    return _to_puzzle(row)
+
+
+def count_puzzles(min_score: float = MIN_SCORE):
+    """Returns the number of mined puzzles scoring at least `min_score`."""
+    if not os.path.exists(PUZZLES_DB_PATH):
+        return 0
+    connection = connect()
+    count = connection.execute(
+        "SELECT COUNT(*) FROM puzzles WHERE score >= ?", (min_score,)
+    ).fetchone()[0]
+    connection.close()
+    return count
+
+
+def get_random_puzzle_id(min_score: float = MIN_SCORE):
+    """Picks a random mined puzzle scoring at least `min_score`."""
+    if not os.path.exists(PUZZLES_DB_PATH):
+        return None
+    connection = connect()
+    row = connection.execute(
+        "SELECT id FROM puzzles WHERE score >= ? ORDER BY RANDOM() LIMIT 1",
+        (min_score,)
+    ).fetchone()
+    connection.close()
+    return row["id"] if row else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mine puzzle candidates from games/*.pgn")
+    parser.add_argument("files", nargs="*", help="PGN filenames in games/ (default: all)")
+    parser.add_argument("--no-engine", action="store_true", help="static scoring only")
+    parser.add_argument("--depth", type=int, default=VERIFY_SEARCH["depth"], help="verification search depth")
+    parser.add_argument("--movetime", type=int, default=None, help="verification time budget per search (ms)")
+    parser.add_argument("--nodes", type=int, default=None, help="verification node budget per search")
+    parser.add_argument("--min-score", type=float, default=MIN_SCORE)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints from earlier runs")
+    args = parser.parse_args()
+
+    summary = mine_library(
+        filenames=args.files or None,
+        use_engine=not args.no_engine,
+        search=(
+            {"movetime": args.movetime} if args.movetime
+            else {"nodes": args.nodes} if args.nodes
+            else {"depth": args.depth}
+        ),
+        min_score=args.min_score,
+        workers=args.workers,
+        restart=args.restart
+    )
+    print(json.dumps({key: summary[key] for key in ("games", "positions", "candidates", "elapsed")}))
@@ -1,21 +1,27 @@
 from sys import argv
 from json import loads
 from io import StringIO
+from random import Random
 from chess import (
+    Board,
     Move,
     pgn,
-    parse_square,
-    PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+    parse_square
 )
-from stockfish import Stockfish
 
 import moviepy.editor as editor
 from moviepy.video.fx.resize import resize
-from moviepy.audio.fx.volumex import volumex
 
 from .board import *
-import os
-import shutil
+from .engine import get_engine_pool
+from .frames import get_version as get_board_version
+from .mining import get_puzzle
+from .solution import get_solution_line
+from lib.python.assets import get_music
+from lib.python.audio import sound
+from lib.python.profiling import annotate, profiled, stage
+from lib.python.render import get_frame_size, mark_static, save_poster, write_videofile
+from lib.python.render_cache import get_file_hash
 from lib.python.text_generator import create_text_clip
 
 
@@ -26,35 +32,81 @@ clip_durations = {
     "line_move": 1
 }
 
-piece_values = {
-    PAWN: 1,
-    KNIGHT: 3,
-    BISHOP: 3,
-    ROOK: 5,
-    QUEEN: 9,
-    KING: 2 ** 32
-}
+# Posters show the brilliant move on the board with its annotation
+POSTER_TIME = clip_durations["puzzle"] + clip_durations["move"] + clip_durations["solution"] / 2
 
-def produce_short(
-    output: str,
-    game_pgn: str,
+
+def find_game_puzzle(game_pgn: str, seed: int = None):
+    """
+    Finds the puzzle in a game: the position before its brilliant (!!) move,
+    that move in UCI and the board orientation. A `seed` makes the fallback
+    move repeatable.
+    """
+    game_moves = list(
+        pgn.read_game(StringIO(game_pgn))
+        .mainline()
+    )
+
+    for move_node in game_moves:
+        if pgn.NAG_BRILLIANT_MOVE in move_node.nags:
+            return (
+                move_node.parent.board().fen(),
+                move_node.uci(),
+                move_node.turn()
+            )
+
+    # Fallback: If no brilliant move is found (common in raw PGNs),
+    # pick a random move from the middle of the game to simulate a puzzle.
+    print("Brilliant move (!!) not found. Using random fallback move.")
+
+    # Ensure game is long enough
+    if len(game_moves) > 10:
+        # Pick from middle 50%
+        start = len(game_moves) // 4
+        end = len(game_moves) * 3 // 4
+        fallback_node = game_moves[Random(seed).randint(start, end)]
+
+        # Determine perspective (who made the move)
+        # node.turn() is the side to move *after* the move (the opponent).
+        # If White moved, turn is Black (False) -> flipped=False (White Persp)
+        # If Black moved, turn is White (True) -> flipped=True (Black Persp)
+        return (
+            fallback_node.parent.board().fen(),
+            fallback_node.uci(),
+            fallback_node.turn()
+        )
+
+    raise ValueError("brilliant move not found and game too short for fallback.")
+
+
+def build_clip(
+    start_fen: str,
+    solution_move: str,
+    flipped: bool,
+    line: list[str],
     background: str,
     font: str,
-    music: str,
-    music_drop_time: float,
-    logger=None
+    scale: float = 1
 ):
+    """
+    Builds the frames of a puzzle short, without its music, from the puzzle
+    position, the brilliant move and the engine line played after it.
+    Every argument is JSON, so chunks of the short can build it again.
+    """
+    size = get_frame_size(scale)
+    width = size[0]
+
     # Puzzle question text
     question_text = (
         create_text_clip(
             "Can you find the brilliant move?",
             font_path=font,
-            fontsize=120,
+            fontsize=round(120 * scale),
             color="white",
             stroke_color="black",
-            stroke_width=2,
+            stroke_width=max(1, round(2 * scale)),
             method="caption",
-            size=(1080, None)
+            size=(width, None)
         )
         .set_duration(clip_durations["puzzle"])
         .set_position((0, 0.6), relative=True)
@@ -66,12 +118,12 @@ def produce_short(
             create_text_clip(
                 str(clip_durations["puzzle"] - i),
                 font_path=font,
-                fontsize=120,
+                fontsize=round(120 * scale),
                 color="white",
                 stroke_color="black",
-                stroke_width=2,
+                stroke_width=max(1, round(2 * scale)),
                 method="caption",
-                size=(1080, None)
+                size=(width, None)
             )
             .set_start(i)
             .set_duration(1)
@@ -80,162 +132,56 @@ def produce_short(
     ]
 
     # Initial chess board elements
-    game_moves = list(
-        pgn.read_game(StringIO(game_pgn))
-        .mainline()
-    )
-    flipped = False
+    start_board = Board(start_fen)
+    brilliancy_board = start_board.copy()
+    brilliancy_board.push_uci(solution_move)
 
-    for move_index, move_node in enumerate(game_moves):
-        if pgn.NAG_BRILLIANT_MOVE in move_node.nags:
-            game_moves = game_moves[move_index - 1:]
-            flipped = move_node.turn()
-            
-            break
-    else:
-        # Fallback: If no brilliant move is found (common in raw PGNs),
-        # pick a random move from the middle of the game to simulate a puzzle.
-        print("Brilliant move (!!) not found. Using random fallback move.")
-        from random import randint
-        
-        # Ensure game is long enough
-        if len(game_moves) > 10:
-            # Pick from middle 50%
-            start = len(game_moves) // 4
-            end = len(game_moves) * 3 // 4
-            fallback_index = randint(start, end)
-            
-            # Slice the game to focus on this move
-            # We need [move_before, move_brilliant, ...]
-            # So we slice from fallback_index - 1
-            game_moves = game_moves[fallback_index - 1:]
-            
-            # Determine perspective (who made the move)
-            # game_moves[1] is the brilliant move. 
-            # node.turn() is the side to move *after* the move (the opponent).
-            # If White moved, turn is Black (False) -> flipped=False (White Persp)
-            # If Black moved, turn is White (True) -> flipped=True (Black Persp)
-            flipped = game_moves[1].turn()
-        else:
-            raise ValueError("brilliant move not found and game too short for fallback.")
-    
     board_clips = [
         draw_board(
-            fen=game_moves[0].board().fen(),
+            fen=start_board.fen(),
             flipped=flipped,
+            width=width,
             duration=clip_durations["puzzle"]
         ),
         
         draw_board(
-            fen=game_moves[0].board().fen(),
+            fen=start_board.fen(),
             flipped=flipped,
-            highlighted_move=game_moves[1].uci(),
+            highlighted_move=solution_move,
             animated=True,
             brilliancy=True,
             audio=True,
+            width=width,
             duration=clip_durations["move"]
         ).set_start(clip_durations["puzzle"]),
 
         draw_board(
-            fen=game_moves[1].board().fen(),
+            fen=brilliancy_board.fen(),
             flipped=flipped,
-            highlighted_move=game_moves[1].uci(),
+            highlighted_move=solution_move,
             brilliancy=True,
+            width=width,
             duration=clip_durations["solution"]
         ).set_start(clip_durations["puzzle"] + clip_durations["move"])
     ]
 
-    # Take the sacrificed piece with lowest value attacker
-    # Play through the top engine line after (max of 5 moves into line)
+    # Add the board clips for each move of the line
     line_board_clips = []
-
-    brilliancy_board = game_moves[1].board()
-
-    # Setup engine early
-    local_sf = "./src/resources/bin/stockfish.exe"
-    if os.path.exists(local_sf):
-        sf_path = local_sf
-    else:
-        sf_path = shutil.which("stockfish") or "/usr/games/stockfish"
-
-    sf_engine = Stockfish(sf_path)
-    sf_engine.set_depth(18)
-    sf_engine.set_fen_position(brilliancy_board.fen())
-
-    # Find legal moves that capture the sacrificed piece
-    capturing_moves: list[Move] = []
-
-    sacrifice_square = parse_square(game_moves[1].uci()[2:4])
-    for legal_move in brilliancy_board.legal_moves:
-        if legal_move.to_square == sacrifice_square:
-            capturing_moves.append(legal_move)
-
-    # Determine the response move (either capture or best engine move)
-    response_move = None
-
-    if len(capturing_moves) > 0:
-        # Find the move with the lowest value capturer
-        response_move = min(
-            capturing_moves,
-            key=lambda atk : piece_values[
-                brilliancy_board.piece_at(atk.from_square).piece_type
-            ]
-        )
-    else:
-        # Fallback: Not a sacrifice or capture not possible. Use engine best move.
-        best_move_uci = sf_engine.get_best_move()
-        if best_move_uci:
-            response_move = Move.from_uci(best_move_uci)
-        else:
-             # Just in case engine yields nothing (mate?), try random legal
-             if list(brilliancy_board.legal_moves):
-                 from random import choice
-                 response_move = choice(list(brilliancy_board.legal_moves))
-    
-    if response_move is None:
-         # Game over?
-         print("No legal moves for opponent.")
-         # Should handle gracefully, maybe just end short here?
-         # For now, let it crash if this impossible state is reached
-         pass
-    else:
-        if not response_move.promotion is None:
-            response_move.promotion = QUEEN
-
-        # Add the board clips for this capture and play on the board
-        line_clips_start_time = sum([
-            clip_durations["puzzle"],
-            clip_durations["move"],
-            clip_durations["solution"]
-        ])
-
-        line_board_clips.append(
-            draw_move_with_preview(
-                fen=brilliancy_board.fen(),
-                flipped=flipped,
-                highlighted_move=response_move.uci(),
-                audio=True,
-                move_duration=clip_durations["move"],
-                preview_duration=clip_durations["line_move"]
-            )
-            .set_start(line_clips_start_time)
-        )
-
-        brilliancy_board.push(response_move)
-        # Update engine position for the loop below
-        sf_engine.set_fen_position(brilliancy_board.fen())
-
-    for i in range(7):
-        top_engine_move = sf_engine.get_best_move()
-        if top_engine_move is None:
-            break
-
+    line_clips_start_time = sum([
+        clip_durations["puzzle"],
+        clip_durations["move"],
+        clip_durations["solution"]
+    ])
+
+    line_board = brilliancy_board.copy()
+    for line_move in line:
         line_board_clips.append(
             draw_move_with_preview(
-                fen=sf_engine.get_fen_position(),
+                fen=line_board.fen(),
                 flipped=flipped,
-                highlighted_move=top_engine_move,
+                highlighted_move=line_move,
                 audio=True,
+                width=width,
                 move_duration=clip_durations["move"],
                 preview_duration=clip_durations["line_move"]
             )
@@ -247,7 +193,7 @@ def produce_short(
             )
         )
 
-        sf_engine.make_moves_from_current_position([top_engine_move])
+        line_board.push_uci(line_move)
 
     # Calculate full short duration given these engine line clips
     full_duration = (
@@ -258,70 +204,172 @@ def produce_short(
         )
     )
 
-    # Background image
-    background = resize(
+    # Background image, resized once
+    background = mark_static(resize(
         (
             editor.ImageClip(background)
             .set_duration(full_duration)
             .set_position((0, 0))
         ),
-        height=1920
-    )
+        height=size[1]
+    ))
 
     # Correct move text
-    solution_san = game_moves[1].san()
+    solution_san = start_board.san(Move.from_uci(solution_move))
 
     solution_text = (
         create_text_clip(
             solution_san + "!!",
             font_path=font,
-            fontsize=160,
+            fontsize=round(160 * scale),
             color="#00ff00",
             stroke_color="black",
-            stroke_width=2,
+            stroke_width=max(1, round(2 * scale)),
             method="caption",
-            size=(1080, None)
+            size=(width, None)
         )
         .set_start(clip_durations["puzzle"])
         .set_end(full_duration)
         .set_position((0, 0.65), relative=True)
     )
 
-    # Background music
-    music_start_time = max(0.01, music_drop_time - clip_durations["puzzle"])
-    music_clip = volumex(
-        (
-            editor.AudioFileClip(music)
-            .cutout(0, music_start_time)
-            .set_duration(full_duration)
-        ),
-        0.5
-    )
-
-    # Thunder sound effect on brilliant move
-    thunder_sfx_clip = volumex(
-        editor.AudioFileClip("src/resources/chess/thunder.mp3")
-        .set_start(clip_durations["puzzle"] - 0.4),
-        0.5
-    )
-
-    result = editor.CompositeVideoClip([
+    return editor.CompositeVideoClip([
         background,
         question_text,
         *countdown_texts,
         solution_text,
         *board_clips,
         *line_board_clips
-    ], size=(1080, 1920))
-    result.audio.clips.append(music_clip)
-    result.audio.clips.append(thunder_sfx_clip)
-
-    result.write_videofile(
-        filename=output,
-        fps=24,
-        audio_codec="aac",
-        threads=4,
-        temp_audiofile="out/TEMP_chess_puzzle.mp4",
+    ], size=size)
+
+
+@profiled("chess/puzzle")
+def produce_short(
+    output: str,
+    game_pgn: str,
+    background: str,
+    font: str,
+    music: str,
+    music_drop_time: float,
+    logger=None,
+    puzzle_id: int = None,
+    engine_search: dict = None,
+    encode_profile: str = None,
+    scale: float = 1,
+    fps: float = 24,
+    poster: bool = False,
+    seed: int = None
+):
+    """
+    Renders a puzzle short to `output`. `scale` and `fps` render a smaller,
+    choppier version through the same pipeline, e.g. for previews, and
+    `poster` writes only the frame at the solution moment, as an image.
+    Returns the path of the short.
+    """
+    annotate(output=output, puzzle_id=puzzle_id)
+
+    with stage("puzzle"):
+        if puzzle_id is not None:
+            # Pre-mined puzzle: position, solution and line come from the store
+            puzzle = get_puzzle(puzzle_id)
+            start_fen = puzzle["fen"]
+            solution_move = puzzle["move"]
+            flipped = puzzle["flipped"]
+            line = puzzle["line"]
+        else:
+            start_fen, solution_move, flipped = find_game_puzzle(game_pgn, seed)
+            line = None
+
+    # Take the sacrificed piece with lowest value attacker
+    # Play through the top engine line after (max of 7 moves into line)
+    if line is None and poster:
+        # The poster is taken before the line is shown
+        line = []
+    elif line is None:
+        brilliancy_board = Board(start_fen)
+        brilliancy_board.push_uci(solution_move)
+        with stage("engine"), get_engine_pool().engine() as sf_engine:
+            line = get_solution_line(
+                brilliancy_board,
+                parse_square(solution_move[2:4]),
+                sf_engine,
+                search=engine_search
+            )
+
+    if len(line) == 0 and not poster:
+        print("No legal moves for opponent.")
+
+    # Everything deciding the frames, for the render cache
+    cache_spec = {
+        "type": "chess/puzzle",
+        "fen": start_fen,
+        "move": solution_move,
+        "flipped": flipped,
+        "line": line,
+        "durations": clip_durations,
+        "background": get_file_hash(background),
+        "font": get_file_hash(font),
+        # Board drawing code and the piece and board images
+        "board": get_board_version()
+    }
+
+    # The intro only shows the position and countdown, so puzzles from the
+    # same position share it whatever line or music follows
+    segments = [
+        (0, {
+            "type": "chess/puzzle/intro",
+            "fen": start_fen,
+            "flipped": flipped,
+            "duration": clip_durations["puzzle"],
+            "background": cache_spec["background"],
+            "font": cache_spec["font"],
+            "board": cache_spec["board"]
+        }),
+        (clip_durations["puzzle"], cache_spec)
+    ]
+
+    clip_builder = {
+        "module": "lib.python.chess.puzzle",
+        "function": "build_clip",
+        "args": {
+            "start_fen": start_fen,
+            "solution_move": solution_move,
+            "flipped": flipped,
+            "line": line,
+            "background": background,
+            "font": font,
+            "scale": scale
+        }
+    }
+    result = build_clip(**clip_builder["args"])
+
+    # Background music, dropping as the brilliant move is played
+    music_start_time = max(0.01, music_drop_time - clip_durations["puzzle"])
+    sounds = [
+        sound(get_music(music), gain=0.5, offset=music_start_time),
+
+        # Thunder sound effect on brilliant move
+        sound(
+            "src/resources/chess/thunder.mp3",
+            start=clip_durations["puzzle"] - 0.4,
+            gain=0.5
+        )
+    ]
+
+    if poster:
+        save_poster(result, output, POSTER_TIME)
+        result.close()
+        return output
+
+    stats = write_videofile(
+        result,
+        output,
+        sounds=sounds,
+        encode_profile=encode_profile,
+        fps=fps,
+        cache_spec=cache_spec,
+        clip_builder=clip_builder,
+        segments=segments,
         logger=logger
     )
 
@@ -330,16 +378,24 @@ def produce_short(
     for clip in result.clips:
         clip.close()
 
+    # An identical short rendered earlier is returned instead of a new file
+    return stats["output"]
+
 
 if __name__ == "__main__":
     args = loads(argv[1])
 
     produce_short(
-        game_pgn=args["pgn"],
+        game_pgn=args.get("pgn"),
         background=args["assets"]["background"],
         font=args["assets"]["font"],
         music=args["assets"]["music"],
         music_drop_time=args["musicDropTime"],
 
-        output=args["output"]
+        output=args["output"],
+        puzzle_id=args.get("puzzleId"),
+        encode_profile=args.get("encodeProfile"),
+        scale=args.get("scale", 1),
+        fps=args.get("fps", 24),
+        poster=args.get("poster", False)
     )
\ No newline at end of file
@@ -0,0 +1,106 @@
+from random import choice
+
+from chess import (
+    Board,
+    Move,
+    PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+)
+
+from .analysis import analyse
+
+
+LINE_LENGTH = 7
+
+piece_values = {
+    PAWN: 1,
+    KNIGHT: 3,
+    BISHOP: 3,
+    ROOK: 5,
+    QUEEN: 9,
+    KING: 2 ** 32
+}
+
+
+def get_response_move(
+    board: Board,
+    sacrifice_square: int,
+    sf_engine=None,
+    search: dict = None
+):
+    """
+    Picks the reply to a brilliant move: the sacrificed piece taken with the
+    lowest value attacker, otherwise the engine's best move.
+    """
+    # Find legal moves that capture the sacrificed piece
+    capturing_moves: list[Move] = [
+        legal_move for legal_move in board.legal_moves
+        if legal_move.to_square == sacrifice_square
+    ]
+
+    response_move = None
+
+    if len(capturing_moves) > 0:
+        # Find the move with the lowest value capturer
+        response_move = min(
+            capturing_moves,
+            key=lambda atk : piece_values[
+                board.piece_at(atk.from_square).piece_type
+            ]
+        )
+    elif sf_engine is not None:
+        # Fallback: Not a sacrifice or capture not possible. Use engine best move.
+        best_move_uci = analyse(sf_engine, board.fen(), **(search or {}))["bestmove"]
+        if best_move_uci:
+            response_move = Move.from_uci(best_move_uci)
+        elif list(board.legal_moves):
+            # Just in case engine yields nothing (mate?), try random legal
+            response_move = choice(list(board.legal_moves))
+
+    if response_move is not None and response_move.promotion is not None:
+        response_move.promotion = QUEEN
+
+    return response_move
+
+
+def get_solution_line(
+    board: Board,
+    sacrifice_square: int,
+    sf_engine=None,
+    length: int = LINE_LENGTH,
+    search: dict = None
+):
+    """
+    Returns the UCI moves shown after a brilliant move: the response move
+    followed by up to `length` moves of the top engine line, read from the
+    principal variation of one (cached) search under the `search` limit,
+    e.g. `{"movetime": 500}`. Another search only runs if the PV ends early.
+    """
+    board = board.copy()
+    line = []
+
+    response_move = get_response_move(board, sacrifice_square, sf_engine, search)
+    if response_move is not None:
+        line.append(response_move.uci())
+        board.push(response_move)
+
+    if sf_engine is None:
+        return line
+
+    engine_moves = 0
+    while engine_moves < length and not board.is_game_over():
+        pv = analyse(sf_engine, board.fen(), **(search or {}))["pv"]
+        pushed = 0
+
+        for pv_move in pv[:length - engine_moves]:
+            move = Move.from_uci(pv_move)
+            if move not in board.legal_moves:
+                break
+            line.append(pv_move)
+            board.push(move)
+            pushed += 1
+
+        if pushed == 0:
+            break
+        engine_moves += pushed
+
+    return line
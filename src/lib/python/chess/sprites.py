@@ -0,0 +1,29 @@
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+
+@lru_cache(maxsize=None)
+def get_sprite(path: str, width: int, height: int = None, opaque: bool = False):
+    """
+    Decodes an image asset once per target size and returns it as a
+    read-only RGBA uint8 array shared by every later render. `opaque`
+    ignores the file's own transparency, as moviepy does for palette PNGs.
+    """
+    with Image.open(path) as image:
+        sprite = np.array(
+            image.convert("RGBA").resize(
+                (width, height or width),
+                Image.LANCZOS
+            )
+        )
+    if opaque:
+        sprite[:, :, 3] = 255
+    sprite.setflags(write=False)
+    return sprite
+
+
+def clear_sprites():
+    """Drops every cached sprite."""
+    get_sprite.cache_clear()
@@ -0,0 +1,298 @@
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+from moviepy.config import get_setting
+
+
+# x264 settings per use. Threads and lookahead are derived from the cores
+# available when a short is written, so the same profile suits any machine.
+ENCODE_PROFILES = {
+    # Fast previews: lowest latency, reduced resolution, no lookahead
+    "draft": {
+        "preset": "ultrafast",
+        "crf": 28,
+        "tune": "zerolatency",
+        "max_height": 960,
+        "lookahead": 0,
+        "audio_bitrate": "96k"
+    },
+    # Uploads to Shorts/TikTok: high quality at a bitrate the platforms keep
+    "publish": {
+        "preset": "slow",
+        "crf": 18,
+        "tune": None,
+        "max_height": None,
+        "lookahead": 40,
+        "audio_bitrate": "192k"
+    },
+    # Batch farms: many shorts encoded side by side, a few threads each
+    "throughput": {
+        "preset": "veryfast",
+        "crf": 20,
+        "tune": None,
+        "max_height": None,
+        "lookahead": 10,
+        "audio_bitrate": "128k"
+    }
+}
+
+DEFAULT_ENCODE_PROFILE = os.environ.get("RENDER_ENCODE_PROFILE", "publish")
+
+# Seconds between keyframes, so platforms can seek and re-segment cheaply
+KEYFRAME_INTERVAL = 2
+
+# Shortest chunk a short is split into for parallel rendering
+MIN_CHUNK_SECONDS = 2
+
+
+def get_cpu_count():
+    """Returns the number of cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Windows and macOS
+        return os.cpu_count() or 1
+
+
+def get_render_workers():
+    """
+    Returns RENDER_WORKERS, the number of shorts rendered side by side:
+    half the cores by default, 0 when the workers are run by hand.
+    """
+    workers = os.environ.get("RENDER_WORKERS")
+    if workers:
+        return int(workers)
+    return max(1, get_cpu_count() // 2)
+
+
+def get_parallelism(duration: float = None):
+    """
+    Returns how many workers render shorts side by side and how many
+    chunks each short is split into: RENDER_CHUNKS if set, otherwise the
+    cores left to each worker. Chunks of a `duration` long short are kept
+    at least MIN_CHUNK_SECONDS long.
+    """
+    workers = max(1, get_render_workers())
+    chunks = os.environ.get("RENDER_CHUNKS")
+    chunks = int(chunks) if chunks else get_cpu_count() // workers
+    if duration is not None:
+        chunks = min(chunks, int(duration // MIN_CHUNK_SECONDS))
+    return workers, max(1, chunks)
+
+
+def get_encoder_threads(chunks: int = 1):
+    """
+    Returns the x264 threads of one encoder, the cores being shared by
+    every worker's `chunks` encoders.
+    """
+    workers, _ = get_parallelism()
+    return max(1, get_cpu_count() // (workers * chunks))
+
+
+def get_encode_profile(name: str = None):
+    """Returns the settings of an encode profile, by default RENDER_ENCODE_PROFILE."""
+    name = name or DEFAULT_ENCODE_PROFILE
+    if name not in ENCODE_PROFILES:
+        raise ValueError(
+            f"unknown encode profile: {name} (expected one of {', '.join(ENCODE_PROFILES)})"
+        )
+    return ENCODE_PROFILES[name]
+
+
+def get_output_size(size: tuple[int, int], profile: dict):
+    """Returns the encoded frame size, scaled down to the profile's maximum height."""
+    width, height = size
+    max_height = profile.get("max_height")
+    if max_height is None or height <= max_height:
+        return width, height
+    # x264 needs even dimensions
+    return int(width * max_height / height) // 2 * 2, max_height
+
+
+def get_ffmpeg_command(
+    output: str,
+    size: tuple[int, int],
+    fps: float,
+    profile: dict,
+    audio: str = None,
+    threads: int = None
+):
+    """Builds the ffmpeg command encoding raw RGB frames from stdin."""
+    threads = threads or get_encoder_threads()
+    lookahead = min(profile["lookahead"], round(fps * KEYFRAME_INTERVAL))
+
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-y",
+        "-loglevel", "error",
+        "-f", "rawvideo",
+        "-vcodec", "rawvideo",
+        "-s", "%dx%d" % size,
+        "-pix_fmt", "rgb24",
+        "-r", "%.02f" % fps,
+        "-i", "-"
+    ]
+    if audio is not None:
+        command += ["-i", audio]
+
+    command += ["-map", "0:v:0"]
+    if audio is not None:
+        command += [
+            "-map", "1:a:0",
+            "-c:a", "aac",
+            "-b:a", profile["audio_bitrate"]
+        ]
+
+    output_size = get_output_size(size, profile)
+    if output_size != tuple(size):
+        command += ["-vf", "scale=%d:%d:flags=bicubic" % output_size]
+
+    command += [
+        "-c:v", "libx264",
+        "-preset", profile["preset"],
+        "-crf", str(profile["crf"]),
+        "-pix_fmt", "yuv420p",
+        "-g", str(round(fps * KEYFRAME_INTERVAL)),
+        "-threads", str(threads),
+        "-x264-params", (
+            f"rc-lookahead={lookahead}"
+            f":lookahead-threads={max(1, threads // 4)}"
+        )
+    ]
+    if profile["tune"] is not None:
+        command += ["-tune", profile["tune"]]
+
+    command += ["-movflags", "+faststart", output]
+    return command
+
+
+class FrameWriter:
+    """
+    One ffmpeg process encoding a short: RGB frames are written straight
+    into its stdin as they are composited, and the soundtrack, if any, is
+    muxed in by the same process. `threads` overrides the encoder's share
+    of the cores.
+    """
+
+    def __init__(
+        self,
+        output: str,
+        size: tuple[int, int],
+        fps: float,
+        profile: dict,
+        audio: str = None,
+        threads: int = None
+    ):
+        self.output = output
+        self.size = tuple(size)
+        self.frames = 0
+
+        # ffmpeg's errors go to a file, so a chatty encoder can never block the pipe
+        self._errors = tempfile.TemporaryFile()
+
+        popen_params = {
+            "stdin": subprocess.PIPE,
+            "stdout": subprocess.DEVNULL,
+            "stderr": self._errors
+        }
+        if os.name == "nt":
+            popen_params["creationflags"] = 0x08000000
+
+        self._process = subprocess.Popen(
+            get_ffmpeg_command(output, self.size, fps, profile, audio, threads),
+            **popen_params
+        )
+
+    def _get_errors(self):
+        self._errors.seek(0)
+        return self._errors.read().decode("utf-8", "replace")[-1000:]
+
+    def write_frame(self, frame: np.ndarray):
+        """Sends one frame to the encoder."""
+        if frame.shape[2] == 4:
+            frame = frame[:, :, :3]
+        if frame.dtype != np.uint8:
+            frame = frame.astype(np.uint8)
+
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self._process.wait()
+            raise RuntimeError(f"ffmpeg stopped encoding {self.output}: {self._get_errors()}")
+        self.frames += 1
+
+    def close(self):
+        """Flushes the remaining frames and waits for the file to be written."""
+        if self._process is None:
+            return
+
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._process.wait()
+        self._process = None
+
+        errors = self._get_errors()
+        self._errors.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.output}: {errors}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._process is not None:
+            # Leave no half-written encoder running behind an error
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+            self._errors.close()
+
+
+def concat(videos: list, output: str, audio: str = None, audio_bitrate: str = "192k"):
+    """
+    Joins videos encoded with the same settings, e.g. the chunks of one
+    short, with ffmpeg's concat demuxer. The video streams are copied as
+    is, so only the soundtrack, if any, is encoded.
+    """
+    with tempfile.NamedTemporaryFile(
+        "w",
+        suffix=".txt",
+        dir=os.path.dirname(os.path.abspath(output)),
+        delete=False
+    ) as listing:
+        for video in videos:
+            path = os.path.abspath(video).replace("'", "'\\''")
+            listing.write(f"file '{path}'\n")
+
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-y",
+        "-loglevel", "error",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", listing.name
+    ]
+    if audio is not None:
+        command += ["-i", audio, "-map", "0:v:0", "-map", "1:a:0", "-c:a", "aac", "-b:a", audio_bitrate]
+    command += ["-c:v", "copy", "-movflags", "+faststart", output]
+
+    try:
+        process = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL
+        )
+    finally:
+        os.remove(listing.name)
+
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed to join {output}: {process.stderr.decode('utf-8', 'replace')[-500:]}"
+        )
+    return output
@@ -0,0 +1,300 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from lib.python import shorts
+from lib.python.encoder import get_render_workers
+from lib.python.helpers import BASE_DIR, DATA_DIR
+from lib.python.logger import MoviePyJobLogger
+
+
+JOBS_DB_PATH = os.path.join(DATA_DIR, "jobs.db")
+
+# Worker defaults, overridable through the environment
+DEFAULT_WORKERS = get_render_workers()
+POLL_INTERVAL = 1
+
+# Running jobs without a heartbeat for this long are assumed orphaned
+HEARTBEAT_INTERVAL = 5
+STALE_AFTER = 60
+
+# Jobs whose worker died this many times are failed instead of requeued,
+# so a short that crashes its worker cannot take the queue down forever
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    error TEXT,
+    output TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def connect():
+    """Opens the job queue, creating it if needed."""
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+    connection = sqlite3.connect(JOBS_DB_PATH, timeout=60, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+    if "attempts" not in columns:
+        connection.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    return connection
+
+
+def _to_dict(row):
+    job = dict(row)
+    job["spec"] = json.loads(job["spec"])
+    return job
+
+
+def submit(job_type: str, spec: dict):
+    """Queues a render of a `job_type` short with prepared arguments and returns its id."""
+    job_id = str(uuid.uuid4())
+
+    connection = connect()
+    connection.execute(
+        "INSERT INTO jobs (id, type, spec, status, created) VALUES (?, ?, ?, ?, ?)",
+        (job_id, job_type, json.dumps(spec), QUEUED, time.time())
+    )
+    connection.close()
+
+    return job_id
+
+
+def get_job(job_id: str):
+    """Returns a job's status, progress and result, or None."""
+    connection = connect()
+    row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    connection.close()
+    return _to_dict(row) if row is not None else None
+
+
+def list_jobs(limit: int = 20):
+    """Lists the most recently submitted jobs."""
+    connection = connect()
+    rows = connection.execute(
+        "SELECT * FROM jobs ORDER BY created DESC LIMIT ?",
+        (limit,)
+    ).fetchall()
+    connection.close()
+    return [_to_dict(row) for row in rows]
+
+
+def count_jobs(status: str):
+    """Counts the jobs with a status."""
+    connection = connect()
+    count = connection.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status = ?",
+        (status,)
+    ).fetchone()[0]
+    connection.close()
+    return count
+
+
+def claim_job(connection):
+    """
+    Atomically moves the oldest queued job to running and returns it, or
+    None. Previews go before full renders, so they come back in seconds.
+    Jobs left running by a worker that died are queued again first, or
+    failed once they were claimed MAX_ATTEMPTS times.
+    """
+    now = time.time()
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            """
+            UPDATE jobs SET status = ?, message = ?, error = ?, finished = ?
+            WHERE status = ? AND heartbeat < ? AND attempts >= ?
+            """,
+            (
+                FAILED,
+                "Error producing video: the worker stopped while rendering it",
+                f"Worker stopped during each of {MAX_ATTEMPTS} attempts",
+                now,
+                RUNNING,
+                now - STALE_AFTER,
+                MAX_ATTEMPTS
+            )
+        )
+        connection.execute(
+            """
+            UPDATE jobs SET status = ?, progress = 0, message = 'Requeued after worker stopped'
+            WHERE status = ? AND heartbeat < ?
+            """,
+            (QUEUED, RUNNING, now - STALE_AFTER)
+        )
+
+        row = connection.execute(
+            """
+            SELECT * FROM jobs WHERE status = ?
+            ORDER BY coalesce(json_extract(spec, '$.preview'), 0) DESC, created
+            LIMIT 1
+            """,
+            (QUEUED,)
+        ).fetchone()
+
+        if row is not None:
+            connection.execute(
+                """
+                UPDATE jobs SET status = ?, started = ?, heartbeat = ?, message = 'Starting',
+                    attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (RUNNING, now, now, row["id"])
+            )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+    return _to_dict(row) if row is not None else None
+
+
+def _keep_alive(job_id: str, stopped: threading.Event):
+    connection = connect()
+    while not stopped.wait(HEARTBEAT_INTERVAL):
+        connection.execute(
+            "UPDATE jobs SET heartbeat = ? WHERE id = ?",
+            (time.time(), job_id)
+        )
+    connection.close()
+
+
+def run_job(connection, job: dict):
+    """Renders a claimed job, reporting progress and recording its result."""
+    def report(progress, message):
+        if progress is None:
+            connection.execute(
+                "UPDATE jobs SET message = ?, heartbeat = ? WHERE id = ?",
+                (message, time.time(), job["id"])
+            )
+        else:
+            connection.execute(
+                "UPDATE jobs SET progress = ?, message = ?, heartbeat = ? WHERE id = ?",
+                (progress, message, time.time(), job["id"])
+            )
+
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=_keep_alive, args=(job["id"], stopped), daemon=True)
+    heartbeat.start()
+
+    try:
+        output = shorts.produce(job["type"], job["spec"], logger=MoviePyJobLogger(report))
+        connection.execute(
+            """
+            UPDATE jobs SET status = ?, progress = 1, message = 'Done', output = ?, finished = ?
+            WHERE id = ?
+            """,
+            (DONE, output, time.time(), job["id"])
+        )
+    except Exception as e:
+        connection.execute(
+            "UPDATE jobs SET status = ?, message = ?, error = ?, finished = ? WHERE id = ?",
+            (FAILED, f"Error producing video: {e}", traceback.format_exc(), time.time(), job["id"])
+        )
+    finally:
+        stopped.set()
+        heartbeat.join()
+
+
+def run_worker(poll_interval: float = POLL_INTERVAL, max_jobs: int = None):
+    """Claims and renders jobs until stopped, or until `max_jobs` ran."""
+    connection = connect()
+    jobs_run = 0
+
+    while max_jobs is None or jobs_run < max_jobs:
+        job = claim_job(connection)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        print(f"Rendering {job['type']} job {job['id']}")
+        run_job(connection, job)
+        jobs_run += 1
+
+    connection.close()
+
+
+def start_workers(workers: int = DEFAULT_WORKERS):
+    """
+    Starts `workers` render workers in a separate process, so renders
+    outlive the caller's requests. Returns the process, or None when
+    `workers` is 0 (workers are then expected to be run by hand).
+    """
+    if workers <= 0:
+        return None
+
+    source_dir = os.path.join(BASE_DIR, "src")
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        path for path in (source_dir, environment.get("PYTHONPATH")) if path
+    )
+
+    return subprocess.Popen(
+        [sys.executable, "-m", "lib.python.jobs", "--workers", str(workers)],
+        cwd=BASE_DIR,
+        env=environment
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render queued shorts from data/jobs.db."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="worker processes rendering in parallel"
+    )
+    args = parser.parse_args()
+
+    # Encoders and chunked renders share the cores between the workers
+    os.environ["RENDER_WORKERS"] = str(max(1, args.workers))
+
+    processes = [
+        multiprocessing.Process(target=run_worker, daemon=True)
+        for _ in range(max(1, args.workers))
+    ]
+    for process in processes:
+        process.start()
+
+    print(f"{len(processes)} render workers waiting for jobs.")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
@@ -1,3 +1,5 @@
+import time
+
 from proglog import ProgressBarLogger
 import streamlit as st
 
@@ -27,3 +29,37 @@ class MoviePyStreamlitLogger(ProgressBarLogger):
         self.last_message = message
         if self.label_widget:
             self.label_widget.text(message)
+
+
+class MoviePyJobLogger(ProgressBarLogger):
+    """
+    Reports render progress to a background job instead of widgets, with
+    the same bar and message handling as MoviePyStreamlitLogger. `report`
+    is called with (progress, message), at most every `interval` seconds
+    while a bar advances.
+    """
+
+    def __init__(self, report, interval: float = 0.5):
+        super().__init__()
+        self.report = report
+        self.interval = interval
+        self.last_report = 0
+        self.last_message = ""
+
+    def callback(self, **changes):
+        # Messages logged with `logger(message=...)`, e.g. frame statistics
+        if changes.get("message"):
+            self.last_message = changes["message"]
+            self.report(None, changes["message"])
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if attr != "index" or not self.bars[bar].get("total"):
+            return
+
+        now = time.monotonic()
+        percentage = min(1, value / self.bars[bar]["total"])
+        if percentage < 1 and now - self.last_report < self.interval:
+            return
+
+        self.last_report = now
+        self.report(percentage, f"Processing {bar}: {int(percentage * 100)}%")
@@ -0,0 +1,234 @@
+import json
+import os
+import subprocess
+import threading
+
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.editor import VideoClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from lib.python.helpers import DATA_DIR
+
+
+# Probed metadata per asset, keyed by absolute path and refreshed by mtime and size
+MEDIA_INFO_PATH = os.path.join(DATA_DIR, "cache", "media.json")
+
+_media_info = None
+_media_info_lock = threading.Lock()
+
+
+def _load_media_info():
+    global _media_info
+
+    if _media_info is None:
+        try:
+            with open(MEDIA_INFO_PATH, "r", encoding="utf-8") as f:
+                _media_info = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            _media_info = {}
+    return _media_info
+
+
+def _save_media_info(media_info: dict):
+    directory = os.path.dirname(MEDIA_INFO_PATH)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    # Write then rename so concurrent renders never read a partial file
+    temporary_path = f"{MEDIA_INFO_PATH}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(media_info, f, indent=2)
+    os.replace(temporary_path, MEDIA_INFO_PATH)
+
+
+def probe(path: str):
+    """
+    Returns an asset's duration, video size and fps and whether it has
+    audio, running ffmpeg only the first time the file is seen (or after
+    it changed).
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+
+    with _media_info_lock:
+        media_info = _load_media_info()
+        entry = media_info.get(key)
+        if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry["info"]
+
+    infos = ffmpeg_parse_infos(path)
+    info = {
+        "duration": infos.get("duration"),
+        "video_found": infos.get("video_found", False),
+        "video_size": infos.get("video_size"),
+        "video_fps": infos.get("video_fps"),
+        "audio_found": infos.get("audio_found", False),
+        "audio_fps": infos.get("audio_fps")
+    }
+
+    with _media_info_lock:
+        media_info = _load_media_info()
+        media_info[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "info": info}
+        try:
+            _save_media_info(media_info)
+        except OSError as e:
+            print(f"Warning: Could not cache media info. Error: {e}")
+
+    return info
+
+
+def get_cover_filter(size: tuple[int, int]):
+    """
+    Builds the ffmpeg filter matching a clip resized to the output height
+    and centered on the output frame: wider sources are cropped to the
+    frame, narrower ones padded with black. Cropping happens before
+    scaling, so only visible pixels are scaled.
+    """
+    width, height = size
+    return (
+        f"crop='min(iw,ih*{width}/{height})':ih,"
+        f"scale='min({width},trunc(iw*{height}/ih/2)*2)':{height}:flags=bicubic,"
+        f"pad={width}:{height}:(ow-iw)/2:0"
+    )
+
+
+def extract_frame(path: str, t: float, output: str, width: int = None):
+    """
+    Writes the frame shown `t` seconds into a video as an image, e.g. a
+    JPEG, scaled to `width` if given. Only the frames around `t` are decoded.
+    """
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-y",
+        "-loglevel", "error",
+        "-ss", "%.06f" % t,
+        "-i", path,
+        "-frames:v", "1"
+    ]
+    if width is not None:
+        command += ["-vf", f"scale={width}:-2"]
+    command += ["-q:v", "3", output]
+
+    process = subprocess.run(
+        command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL
+    )
+    if process.returncode != 0 or not os.path.exists(output):
+        raise RuntimeError(
+            f"could not extract a frame of {path}: {process.stderr.decode('utf-8', 'replace')[-500:]}"
+        )
+    return output
+
+
+class WindowReader:
+    """
+    Decodes [start, start + duration) of a video file with ffmpeg, which
+    scales and crops every frame to `size` while decoding. Frames are read
+    sequentially; seeking backwards restarts the decoder.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        start: float,
+        duration: float,
+        size: tuple[int, int],
+        fps: float
+    ):
+        self.path = path
+        self.start = start
+        self.duration = duration
+        self.size = size
+        self.fps = fps
+
+        self._process = None
+        self._index = None
+        self._frame = None
+
+    def _open(self, index: int):
+        self.close()
+
+        command = [
+            get_setting("FFMPEG_BINARY"),
+            "-loglevel", "error",
+            "-ss", "%.06f" % (self.start + index / self.fps),
+            "-t", "%.06f" % max(0, self.duration - index / self.fps),
+            "-i", self.path,
+            "-an",
+            "-vf", get_cover_filter(self.size),
+            "-r", str(self.fps),
+            "-pix_fmt", "rgb24",
+            "-f", "rawvideo",
+            "-"
+        ]
+        popen_params = {
+            "stdout": subprocess.PIPE,
+            "stderr": subprocess.DEVNULL,
+            "stdin": subprocess.DEVNULL,
+            "bufsize": 10 ** 8
+        }
+        if os.name == "nt":
+            popen_params["creationflags"] = 0x08000000
+
+        self._process = subprocess.Popen(command, **popen_params)
+        self._index = index - 1
+
+    def _read_frame(self):
+        width, height = self.size
+        frame_bytes = width * height * 3
+
+        data = self._process.stdout.read(frame_bytes)
+        if len(data) == frame_bytes:
+            self._frame = np.frombuffer(data, dtype=np.uint8).reshape((height, width, 3))
+        elif self._frame is None:
+            # Nothing decoded at all, e.g. a window past the end of the file
+            self._frame = np.zeros((height, width, 3), dtype=np.uint8)
+        # Short reads at the end of the window repeat the last frame
+        self._index += 1
+
+    def get_frame(self, t: float):
+        """Returns the frame shown `t` seconds into the window."""
+        index = int(t * self.fps + 1e-6)
+
+        if self._process is None or index < self._index:
+            self._open(index)
+
+        while self._index < index:
+            self._read_frame()
+
+        return self._frame
+
+    def close(self):
+        """Stops the decoder, if running."""
+        if self._process is not None:
+            self._process.terminate()
+            self._process.stdout.close()
+            self._process.wait()
+            self._process = None
+
+
+class BackgroundClip(VideoClip):
+    """
+    A window of a video file, decoded straight to the output size by ffmpeg
+    so no per-frame resizing happens in Python.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        start: float,
+        duration: float,
+        size: tuple[int, int] = (1080, 1920),
+        fps: float = 24
+    ):
+        self.reader = WindowReader(path, start, duration, size, fps)
+        super().__init__(self.reader.get_frame, duration=duration)
+        self.size = size
+        self.fps = fps
+
+    def close(self):
+        """Stops the decoder, if running."""
+        self.reader.close()
@@ -0,0 +1,218 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from lib.python.helpers import DATA_DIR
+
+
+# One JSON profile per rendered short is appended here
+PROFILE_LOG_PATH = os.path.join(DATA_DIR, "profiles.jsonl")
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+
+# Set to 1 to also dump a cProfile of every short into PROFILE_DIR
+CPROFILE_ENABLED = os.environ.get("RENDER_PROFILE", "") not in ("", "0")
+
+# The profile of the job running in this thread (or task), if any; jobs
+# rendered side by side in one process each record into their own
+_current = ContextVar("profile", default=None)
+
+
+def get_peak_rss_mb():
+    """Returns this process's peak resident memory in MB, or None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return round(peak / 2 ** 20, 1)
+    return round(peak / 2 ** 10, 1)
+
+
+def _get_children_cpu():
+    # CPU time of finished child processes, e.g. the ffmpeg encoder
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Adds the wall and CPU time spent in the block to a stage of the current
+    profile. Stages may nest, and repeated stages accumulate. Without a
+    profile running this only costs the context manager.
+    """
+    if _current.get() is None:
+        yield
+        return
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        add_stage(
+            name,
+            time.perf_counter() - wall,
+            time.process_time() - cpu
+        )
+
+
+def add_stage(name: str, wall: float, cpu: float = 0, calls: int = 1):
+    """Adds already measured time to a stage of the current profile."""
+    current = _current.get()
+    if current is None:
+        return
+    totals = current["stages"].setdefault(name, {"wall": 0, "cpu": 0, "calls": 0})
+    totals["wall"] += wall
+    totals["cpu"] += cpu
+    totals["calls"] += calls
+
+
+def get_stage_wall(name: str):
+    """Returns the wall time recorded so far for a stage of the current profile."""
+    current = _current.get()
+    if current is None or name not in current["stages"]:
+        return 0
+    return current["stages"][name]["wall"]
+
+
+def add_counters(**counters):
+    """Adds to named counters of the current profile, e.g. `frames=24`."""
+    current = _current.get()
+    if current is None:
+        return
+    for name, value in counters.items():
+        current["counters"][name] = current["counters"].get(name, 0) + value
+
+
+def annotate(**info):
+    """Attaches details such as the output path to the current profile."""
+    current = _current.get()
+    if current is not None:
+        current.update(info)
+
+
+def timed(name: str):
+    """Decorator recording every call of a function as a stage."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile(label: str, log_path: str = PROFILE_LOG_PATH):
+    """
+    Profiles one job: per-stage wall and CPU times, counters such as frames
+    composited, composite and encode frames/sec and peak memory, appended
+    as one JSON line to `log_path` (unless None). With RENDER_PROFILE=1 a
+    cProfile dump is written as well. Inside another profile this only
+    records a stage.
+    """
+    current = _current.get()
+    if current is not None:
+        with stage(label):
+            yield current
+        return
+
+    current = {
+        "label": label,
+        "date": datetime.now().isoformat(),
+        "stages": {},
+        "counters": {}
+    }
+    token = _current.set(current)
+
+    profiler = cProfile.Profile() if CPROFILE_ENABLED else None
+    wall, cpu, children_cpu = time.perf_counter(), time.process_time(), _get_children_cpu()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield current
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _current.reset(token)
+
+        current["wall"] = time.perf_counter() - wall
+        current["cpu"] = time.process_time() - cpu
+        if children_cpu is not None:
+            current["children_cpu"] = _get_children_cpu() - children_cpu
+        current["peak_rss_mb"] = get_peak_rss_mb()
+
+        composite = current["stages"].get("composite")
+        if composite and composite["wall"] > 0:
+            current["composite_fps"] = current["counters"].get("composited_frames", 0) / composite["wall"]
+
+        encode = current["stages"].get("encode")
+        if encode and encode["wall"] > 0:
+            current["encode_fps"] = current["counters"].get("encoded_frames", 0) / encode["wall"]
+
+        if profiler is not None:
+            current["cprofile"] = _dump_cprofile(profiler, label)
+
+        if log_path is not None:
+            _write_profile(current, log_path)
+
+
+def profiled(label: str):
+    """Decorator profiling every call of a function as one job."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _dump_cprofile(profiler, label: str):
+    if not os.path.exists(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    name = f"{label.replace('/', '-')}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    path = os.path.join(PROFILE_DIR, f"{name}.prof")
+    profiler.dump_stats(path)
+
+    # Readable summary next to the dump, for when no profile viewer is at hand
+    with open(os.path.join(PROFILE_DIR, f"{name}.txt"), "w") as f:
+        pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+
+    return path
+
+
+def _write_profile(current: dict, log_path: str):
+    try:
+        directory = os.path.dirname(log_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(current, default=str) + "\n")
+    except OSError as e:
+        print(f"Warning: Could not write render profile. Error: {e}")
+
+
+def load_profiles(log_path: str = PROFILE_LOG_PATH, limit: int = None):
+    """Reads the recorded profiles, oldest first."""
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, "r", encoding="utf-8") as f:
+        profiles = [json.loads(line) for line in f if line.strip()]
+    return profiles[-limit:] if limit else profiles
@@ -0,0 +1,180 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+
+from lib.python.helpers import DATA_DIR, TRIVIA_QUESTIONS_PATH
+
+
+QUESTION_BANK_DB_PATH = os.path.join(DATA_DIR, "trivia.db")
+
+# Questions drawn this recently are never drawn again, even across reshuffles
+RECENT_WINDOW = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decks (
+    category TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    cursor INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deck_cards (
+    category TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    question INTEGER NOT NULL,
+    PRIMARY KEY (category, position)
+) WITHOUT ROWID;
+"""
+
+_bank = None
+_bank_version = None
+_bank_lock = threading.Lock()
+
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+
+
+def load_bank(path: str = TRIVIA_QUESTIONS_PATH):
+    """
+    Returns the questions of every category, as tuples. The file is parsed
+    once and again only after its mtime or size changes, so callers can
+    ask for the bank per short.
+    """
+    global _bank, _bank_version
+
+    stat = os.stat(path)
+    version = f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    with _bank_lock:
+        if _bank is None or _bank_version != version:
+            with open(path, "r", encoding="utf-8") as f:
+                _bank = {
+                    category: tuple(questions)
+                    for category, questions in json.load(f).items()
+                }
+            _bank_version = version
+        return _bank
+
+
+def get_bank_version():
+    """Identifies the loaded questions file, so decks are rebuilt when it changes."""
+    load_bank()
+    return _bank_version
+
+
+def get_categories():
+    """Lists the trivia categories."""
+    return list(load_bank().keys())
+
+
+def connect():
+    """Opens this process's connection to the shared question decks."""
+    global _connection, _connection_pid
+
+    if _connection is None or _connection_pid != os.getpid():
+        if not os.path.exists(DATA_DIR):
+            os.makedirs(DATA_DIR)
+        _connection = sqlite3.connect(
+            QUESTION_BANK_DB_PATH,
+            timeout=60,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+        _connection_pid = os.getpid()
+    return _connection
+
+
+def _shuffle_deck(size: int, recent: list):
+    # A new pass over the category: the questions drawn last are kept out
+    # of the first `window` cards, so none repeats within the window
+    window = min(RECENT_WINDOW, size // 2)
+    recent = set(recent[-window:]) if window else set()
+
+    rest = [question for question in range(size) if question not in recent]
+    random.shuffle(rest)
+    tail = rest[window:] + list(recent)
+    random.shuffle(tail)
+    return rest[:window] + tail
+
+
+def _deal(connection, category: str, version: str, size: int, recent: list):
+    deck = _shuffle_deck(size, recent)
+    connection.execute("DELETE FROM deck_cards WHERE category = ?", (category,))
+    connection.executemany(
+        "INSERT INTO deck_cards (category, position, question) VALUES (?, ?, ?)",
+        [(category, position, question) for position, question in enumerate(deck)]
+    )
+    connection.execute(
+        "INSERT OR REPLACE INTO decks (category, version, size, cursor) VALUES (?, ?, ?, 0)",
+        (category, version, size)
+    )
+
+
+def _draw_cards(connection, category: str, start: int, count: int):
+    return [
+        row[0] for row in connection.execute(
+            """
+            SELECT question FROM deck_cards
+            WHERE category = ? AND position >= ? AND position < ?
+            ORDER BY position
+            """,
+            (category, start, start + count)
+        )
+    ]
+
+
+def sample(category: str, count: int = 3):
+    """
+    Draws `count` questions of a category without replacement. Every
+    category has one shuffled deck, shared by all processes through
+    SQLite, so consecutive shorts (from any worker) never repeat a
+    question until the whole category was used. A draw only reads the
+    cards it takes.
+    """
+    questions = load_bank().get(category)
+    if not questions:
+        return []
+    if len(questions) <= count:
+        return list(questions)
+
+    version = get_bank_version()
+    with _lock:
+        connection = connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            deck = connection.execute(
+                "SELECT version, size, cursor FROM decks WHERE category = ?",
+                (category,)
+            ).fetchone()
+
+            if deck is None or deck[0] != version or deck[1] != len(questions):
+                # New category or edited questions: start a fresh deck
+                _deal(connection, category, version, len(questions), [])
+                cursor = 0
+            else:
+                cursor = deck[2]
+
+            drawn = _draw_cards(connection, category, cursor, count)
+            cursor += len(drawn)
+            if len(drawn) < count:
+                # Deck used up: deal a new one, keeping the last questions back
+                start = max(0, cursor - RECENT_WINDOW)
+                recent = _draw_cards(connection, category, start, cursor - start)
+                _deal(connection, category, version, len(questions), recent)
+                cursor = count - len(drawn)
+                drawn += _draw_cards(connection, category, 0, cursor)
+
+            connection.execute(
+                "UPDATE decks SET cursor = ? WHERE category = ?",
+                (cursor, category)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    return [questions[question] for question in drawn]
@@ -0,0 +1,718 @@
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+import proglog
+from PIL import Image
+import moviepy.editor as editor
+
+from lib.python import profiling, render_cache
+from lib.python.audio import write_soundtrack
+from lib.python.encoder import (
+    DEFAULT_ENCODE_PROFILE,
+    FrameWriter,
+    concat,
+    get_encode_profile,
+    get_encoder_threads,
+    get_parallelism
+)
+from lib.python.helpers import BASE_DIR
+
+
+# Position functions are sampled at these fractions of an interval
+POSITION_SAMPLES = (0, 0.5, 1)
+
+# Frame size of a full resolution short; previews scale all geometry from it
+SHORT_SIZE = (1080, 1920)
+
+# Work of a frame repeated from a static interval, relative to compositing
+# a new one, when balancing chunks
+REUSED_FRAME_COST = 0.2
+
+
+def get_frame_size(scale: float = 1):
+    """Returns the frame size of a short rendered at `scale`, in even pixels for x264."""
+    return tuple(int(round(length * scale / 2)) * 2 for length in SHORT_SIZE)
+
+
+def get_change_times(clip, offset: float = 0):
+    """
+    Returns every time at which a clip or one of its nested composite
+    children starts or ends, in the outer clip's timeline.
+    """
+    times = {offset}
+    if clip.duration is not None:
+        times.add(offset + clip.duration)
+
+    if isinstance(clip, editor.CompositeVideoClip):
+        for child in clip.clips:
+            times.add(offset + child.start)
+            if child.end is not None:
+                times.add(offset + child.end)
+            times |= get_change_times(child, offset + child.start)
+
+    return times
+
+
+def _is_playing_within(clip, start: float, end: float):
+    return clip.start < end and (clip.end is None or clip.end > start)
+
+
+def mark_static(clip):
+    """
+    Marks a clip whose frames never change, e.g. rendered text or a still
+    board, so intervals showing only such clips are composited once. The
+    mark is tied to the clip's current frame function: a copy later
+    changed by `fl`, `fl_image` or `resize` is no longer static. Its mask
+    is marked with it. Returns the clip.
+    """
+    clip.static_frame = clip.make_frame
+    if clip.mask is not None:
+        mark_static(clip.mask)
+    return clip
+
+
+def _is_marked_static(clip):
+    return getattr(clip, "static_frame", None) is clip.make_frame
+
+
+@lru_cache(maxsize=1)
+def _get_composite_code():
+    # Every composite blits its children with the same code; one whose
+    # frame function was replaced (e.g. by `fl`) no longer shows them as is
+    return editor.CompositeVideoClip([editor.ColorClip((1, 1), color=(0, 0, 0), duration=1)]).make_frame.__code__
+
+
+def _is_composite(clip):
+    return (
+        isinstance(clip, editor.CompositeVideoClip)
+        and getattr(clip.make_frame, "__code__", None) is _get_composite_code()
+    )
+
+
+def _is_layer_static(child, start: float, end: float):
+    # A child of a composite, over [start, end) in the composite's timeline
+    return (
+        is_static(child, start - child.start, end - child.start)
+        and (child.mask is None or is_static(child.mask, start - child.start, end - child.start))
+    )
+
+
+def _is_background_static(clip, start: float, end: float):
+    # A composite's own background is a plain color, unless its first clip
+    # was made the background (use_bgclip)
+    return clip.created_bg or is_static(clip.bg, start, end)
+
+
+def is_static(clip, start: float, end: float):
+    """
+    Checks whether a clip's frames cannot change over [start, end) in its
+    own timeline. Clips are static when marked with mark_static and while
+    their position (sampled) and mask are; composites are static while
+    every child playing in the interval is. Any other clip is assumed to
+    change every frame.
+    """
+    if _is_composite(clip):
+        return _is_background_static(clip, start, end) and all(
+            _is_layer_static(child, start, end)
+            for child in clip.clips
+            if _is_playing_within(child, start, end)
+        )
+
+    if not _is_marked_static(clip):
+        return False
+    if clip.mask is not None and not is_static(clip.mask, start, end):
+        return False
+
+    last = max(start, end - 1e-6)
+    positions = {
+        tuple(clip.pos(start + fraction * (last - start)))
+        for fraction in POSITION_SAMPLES
+    }
+    return len(positions) == 1
+
+
+def _get_intervals(clip):
+    times = sorted(
+        t for t in get_change_times(clip)
+        if 0 <= t <= clip.duration
+    )
+    return [(start, end) for start, end in zip(times, times[1:]) if end > start]
+
+
+def get_static_intervals(clip):
+    """Lists the [start, end) intervals over which a clip's frames are constant."""
+    intervals = []
+    for start, end in _get_intervals(clip):
+        if is_static(clip, start, end):
+            if intervals and intervals[-1][1] == start:
+                intervals[-1] = (intervals[-1][0], end)
+            else:
+                intervals.append((start, end))
+
+    return intervals
+
+
+def get_overlay_intervals(clip):
+    """
+    Lists the [start, end) intervals of a composite over which only its
+    bottom layers change, e.g. a gameplay video under fixed text, with
+    the playing layers split into those changing and the static ones
+    above them.
+    """
+    if not _is_composite(clip):
+        return []
+
+    overlays = []
+    for start, end in _get_intervals(clip):
+        playing = [child for child in clip.clips if _is_playing_within(child, start, end)]
+        changing = [
+            index for index, child in enumerate(playing)
+            if not _is_layer_static(child, start, end)
+        ]
+        if changing:
+            split = changing[-1] + 1
+        elif not _is_background_static(clip, start, end):
+            split = 0
+        else:
+            # Nothing changes: a static interval
+            continue
+
+        if split < len(playing):
+            overlays.append((start, end, playing[:split], playing[split:]))
+
+    return overlays
+
+
+class _Overlay:
+    """
+    Static top layers of a composite, blitted once over black and once
+    over white. Any frame of the layers under them is then covered by
+    computing `black + frame * (white - black) / 255`, one multiply-add
+    instead of blitting every layer.
+    """
+
+    def __init__(self, layers: list, size: tuple[int, int], t: float):
+        width, height = size
+        black = np.zeros((height, width, 3), dtype=np.uint8)
+        white = np.full((height, width, 3), 255, dtype=np.uint8)
+        for layer in layers:
+            black = layer.blit_on(black, t)
+            white = layer.blit_on(white, t)
+
+        self.offset = black.astype(np.float32) + 0.5
+        self.scale = (white.astype(np.float32) - black) / 255
+
+    def apply(self, frame: np.ndarray):
+        """Returns the frame with the layers on top."""
+        result = frame * self.scale
+        result += self.offset
+        return result.astype(np.uint8)
+
+
+def deduplicate_static_frames(clip):
+    """
+    Wraps a composite so each static interval is composited once and its
+    frame handed to the encoder again for every later timestamp in it.
+    Over intervals where only the bottom layers move, the static layers
+    above them are composited once and laid over every frame. Compositing
+    time then scales with the amount of motion, not duration.
+    """
+    intervals = get_static_intervals(clip)
+    starts = [start for start, _ in intervals]
+    overlays = get_overlay_intervals(clip)
+    overlay_starts = [start for start, _, _, _ in overlays]
+    cache = {"interval": None, "frame": None, "overlay_interval": None, "overlay": None}
+    stats = {"composited": 0, "reused": 0, "overlaid": 0}
+
+    def make_overlaid_frame(index, t):
+        _, _, changing, static = overlays[index]
+        if cache["overlay_interval"] != index:
+            cache["overlay_interval"] = index
+            cache["overlay"] = _Overlay(static, clip.size, t)
+
+        frame = clip.bg.get_frame(t)
+        for layer in changing:
+            frame = layer.blit_on(frame, t)
+        return cache["overlay"].apply(frame)
+
+    def make_frame(t):
+        index = bisect_right(starts, t) - 1
+        if index >= 0 and t < intervals[index][1]:
+            if cache["interval"] == index:
+                stats["reused"] += 1
+                return cache["frame"]
+
+            cache["interval"] = index
+            with profiling.stage("composite"):
+                cache["frame"] = clip.get_frame(t)
+            stats["composited"] += 1
+            return cache["frame"]
+
+        stats["composited"] += 1
+        index = bisect_right(overlay_starts, t) - 1
+        if index >= 0 and t < overlays[index][1]:
+            stats["overlaid"] += 1
+            with profiling.stage("composite"):
+                return make_overlaid_frame(index, t)
+
+        with profiling.stage("composite"):
+            return clip.get_frame(t)
+
+    # Set after construction, which would otherwise composite frame 0 to
+    # find the size
+    deduplicated = editor.VideoClip(duration=clip.duration)
+    deduplicated.make_frame = make_frame
+    deduplicated.size = clip.size
+    deduplicated.audio = clip.audio
+    deduplicated.frame_stats = stats
+    deduplicated.static_intervals = intervals
+
+    return deduplicated
+
+
+def get_sounds(clip, offset: float = 0):
+    """
+    Collects the sounds attached to a clip and its nested composite
+    children, with start times in the outer clip's timeline.
+    """
+    sounds = [
+        dict(sound, start=offset + sound["start"])
+        for sound in getattr(clip, "sounds", ())
+    ]
+
+    if isinstance(clip, editor.CompositeVideoClip):
+        for child in clip.clips:
+            sounds += get_sounds(child, offset + child.start)
+
+    return sounds
+
+
+def save_poster(clip, output: str, t: float):
+    """Writes the frame shown `t` seconds into a clip as an image, e.g. a JPEG."""
+    with profiling.stage("composite"):
+        frame = clip.get_frame(t)
+    Image.fromarray(np.asarray(frame, dtype=np.uint8)[:, :, :3]).save(output, quality=90)
+    return output
+
+
+@contextmanager
+def _mix_soundtrack(sounds: list, duration: float):
+    # The WAV is written to the system's temporary directory, never next
+    # to the output, and deleted however the render ends
+    if not sounds:
+        yield None
+        return
+
+    with profiling.stage("audio"):
+        soundtrack = write_soundtrack(sounds, duration)
+    try:
+        yield soundtrack
+    finally:
+        os.remove(soundtrack)
+
+
+def split_frames(times: np.ndarray, intervals: list, chunks: int):
+    """
+    Splits frame times into `chunks` consecutive runs of about equal work,
+    frames repeated from a static interval being cheaper than new ones.
+    """
+    starts = [start for start, _ in intervals]
+    costs = np.ones(len(times))
+    previous = None
+    for i, t in enumerate(times):
+        index = bisect_right(starts, t) - 1
+        if index < 0 or t >= intervals[index][1]:
+            previous = None
+            continue
+        if index == previous:
+            costs[i] = REUSED_FRAME_COST
+        previous = index
+
+    work = np.cumsum(costs)
+    bounds = np.searchsorted(work, work[-1] * np.arange(1, chunks) / chunks)
+    return [run for run in np.split(times, bounds) if len(run)]
+
+
+def _get_readers(clip):
+    # Video decoders of a clip, its masks and its nested composite children
+    readers = []
+    if getattr(clip, "reader", None) is not None:
+        readers.append(clip.reader)
+    if getattr(clip, "mask", None) is not None:
+        readers += _get_readers(clip.mask)
+    if isinstance(clip, editor.CompositeVideoClip):
+        for child in clip.clips:
+            readers += _get_readers(child)
+    return readers
+
+
+def _close_readers(clip):
+    for reader in _get_readers(clip):
+        reader.close()
+
+
+def _write_frames(
+    deduplicated,
+    output: str,
+    profile: dict,
+    fps: float,
+    soundtrack: str,
+    times: np.ndarray,
+    threads: int = None,
+    logger=None
+):
+    measured = profiling.get_stage_wall("composite")
+    started = time.perf_counter()
+
+    if logger is not None:
+        times = logger.iter_bar(frame=times)
+    with FrameWriter(output, deduplicated.size, fps, profile, audio=soundtrack, threads=threads) as writer:
+        for t in times:
+            writer.write_frame(deduplicated.get_frame(t))
+
+    return dict(
+        deduplicated.frame_stats,
+        encoded=writer.frames,
+        elapsed=time.perf_counter() - started,
+        composite=profiling.get_stage_wall("composite") - measured
+    )
+
+
+def build_clip(clip_builder: dict):
+    """
+    Builds a clip from its serialisable description: the `function` of
+    `module` producing it, called with the JSON `args`.
+    """
+    module = importlib.import_module(clip_builder["module"])
+    return getattr(module, clip_builder["function"])(**clip_builder["args"])
+
+
+def _render_chunk(chunk: dict):
+    # Runs in a process of its own, started by _write_chunks, and reports
+    # to it through a JSON file next to the chunk
+    with profiling.profile("render/chunk", log_path=None):
+        clip = build_clip(chunk["clip"])
+        try:
+            deduplicated = deduplicate_static_frames(clip)
+            first, count = chunk["frames"]
+            times = np.arange(0, clip.duration, 1.0 / chunk["fps"])[first:first + count]
+            result = _write_frames(
+                deduplicated,
+                chunk["output"],
+                get_encode_profile(chunk["encode_profile"]),
+                chunk["fps"],
+                None,
+                times,
+                chunk["threads"]
+            )
+        finally:
+            _close_readers(clip)
+
+    with open(f"{chunk['output']}.json", "w") as f:
+        json.dump(result, f)
+
+
+def _write_chunks(
+    clip_builder: dict,
+    deduplicated,
+    output: str,
+    profile_name: str,
+    fps: float,
+    soundtrack: str,
+    times: np.ndarray,
+    chunks: int,
+    logger,
+    first: int = 0
+):
+    # `times` are frames [first, first + len(times)) of the short
+    profile = get_encode_profile(profile_name)
+    runs = split_frames(times, deduplicated.static_intervals, chunks)
+    threads = get_encoder_threads(len(runs))
+    directory = tempfile.mkdtemp(prefix=".chunks-", dir=os.path.dirname(os.path.abspath(output)))
+    videos = [os.path.join(directory, f"{index}.mp4") for index in range(len(runs))]
+    firsts = first + np.cumsum([0] + [len(run) for run in runs])
+    logger(message=f"Rendering {len(runs)} chunks in parallel")
+
+    source_dir = os.path.join(BASE_DIR, "src")
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        path for path in (source_dir, environment.get("PYTHONPATH")) if path
+    )
+
+    # Every chunk rebuilds the clip in a fresh interpreter, so it shares
+    # no decoders, connections or threads with this process
+    processes = []
+    try:
+        for index, video in enumerate(videos):
+            chunk = {
+                "clip": clip_builder,
+                "output": video,
+                "encode_profile": profile_name,
+                "fps": fps,
+                "frames": [int(firsts[index]), len(runs[index])],
+                "threads": threads
+            }
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "lib.python.render", json.dumps(chunk)],
+                env=environment
+            ))
+
+        results = []
+        for index in logger.iter_bar(chunk=range(len(processes))):
+            status = processes[index].wait()
+            if status != 0 or not os.path.exists(f"{videos[index]}.json"):
+                raise RuntimeError(f"chunk {index} of {output} failed, see the log above")
+            with open(f"{videos[index]}.json") as f:
+                results.append(json.load(f))
+
+        with profiling.stage("concat"):
+            concat(videos, output, soundtrack, profile["audio_bitrate"])
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # The chunks composited in their own processes
+    profiling.add_stage("composite", sum(result["composite"] for result in results))
+    return results
+
+
+def _write_range(
+    clip_builder: dict,
+    deduplicated,
+    output: str,
+    profile_name: str,
+    fps: float,
+    soundtrack: str,
+    times: np.ndarray,
+    logger,
+    first: int = 0
+):
+    # Only a clip that can be rebuilt elsewhere is split across processes
+    chunks = 1
+    if clip_builder is not None:
+        _, chunks = get_parallelism(len(times) / fps)
+    if chunks > 1:
+        return _write_chunks(
+            clip_builder, deduplicated, output, profile_name, fps, soundtrack, times, chunks, logger, first
+        )
+    profile = get_encode_profile(profile_name)
+    return [_write_frames(deduplicated, output, profile, fps, soundtrack, times, logger=logger)]
+
+
+def _write_segments(
+    clip,
+    clip_builder: dict,
+    deduplicated,
+    output: str,
+    profile_name: str,
+    fps: float,
+    soundtrack: str,
+    times: np.ndarray,
+    segments: list,
+    logger
+):
+    # Each segment is cached on its own, keyed by its spec and frames, so
+    # shorts sharing a segment (e.g. a puzzle's intro) encode it once
+    firsts = [int(np.searchsorted(times, start - 1e-6)) for start, _ in segments] + [len(times)]
+    videos = []
+    results = []
+    reused = 0
+
+    for (_, spec), first, last in zip(segments, firsts, firsts[1:]):
+        if last <= first:
+            continue
+
+        key = render_cache.get_key(render_cache.SEGMENT, {
+            "segment": spec,
+            "frames": [first, last - first],
+            "size": clip.size,
+            "fps": fps,
+            "encode_profile": profile_name
+        })
+        video = render_cache.lookup(key)
+        if video is None:
+            video = render_cache.get_video_path(key)
+            temporary_video = f"{video}.{os.getpid()}.tmp.mp4"
+            try:
+                results += _write_range(
+                    clip_builder, deduplicated, temporary_video, profile_name, fps, None,
+                    times[first:last], logger, first
+                )
+                os.replace(temporary_video, video)
+            finally:
+                if os.path.exists(temporary_video):
+                    os.remove(temporary_video)
+            render_cache.store(key, render_cache.SEGMENT, video)
+        else:
+            reused += 1
+        videos.append(video)
+
+    logger(message=f"Reused {reused} of {len(videos)} cached segments")
+    with profiling.stage("concat"):
+        concat(videos, output, soundtrack, get_encode_profile(profile_name)["audio_bitrate"])
+    return results, reused
+
+
+def _encode(
+    clip,
+    output: str,
+    profile_name: str,
+    fps: float,
+    soundtrack: str,
+    logger,
+    clip_builder: dict = None,
+    segments: list = None
+):
+    deduplicated = deduplicate_static_frames(clip)
+    times = np.arange(0, clip.duration, 1.0 / fps)
+
+    started = time.perf_counter()
+    reused_segments = 0
+    if segments is not None and len(segments) > 1:
+        results, reused_segments = _write_segments(
+            clip, clip_builder, deduplicated, output, profile_name, fps, soundtrack, times, segments, logger
+        )
+    else:
+        results = _write_range(clip_builder, deduplicated, output, profile_name, fps, soundtrack, times, logger)
+    elapsed = time.perf_counter() - started
+
+    # Whatever writing time is not compositing is spent encoding
+    encode_time = sum(result["elapsed"] - result["composite"] for result in results)
+    profiling.add_stage("encode", encode_time)
+
+    stats = {
+        name: sum(result[name] for result in results)
+        for name in ("composited", "reused", "overlaid", "encoded")
+    }
+    stats["chunks"] = len(results)
+    stats["reused_segments"] = reused_segments
+    stats["encode_fps"] = stats["encoded"] / max(encode_time, 1e-9)
+    stats["write_fps"] = stats["encoded"] / max(elapsed, 1e-9)
+
+    profiling.annotate(render_chunks=len(results), reused_segments=reused_segments)
+    profiling.add_counters(
+        composited_frames=stats["composited"],
+        overlaid_frames=stats["overlaid"],
+        reused_frames=stats["reused"],
+        encoded_frames=stats["encoded"]
+    )
+    logger(message=(
+        f"Composited {stats['composited']} frames ({stats['overlaid']} under static layers), "
+        f"reused {stats['reused']}"
+    ))
+    logger(message=(
+        f"Encoded {stats['encoded']} frames ({profile_name}) at "
+        f"{stats['encode_fps']:.1f} fps, {stats['write_fps']:.1f} fps overall"
+    ))
+
+    return stats
+
+
+def write_videofile(
+    clip,
+    output: str,
+    sounds: list = (),
+    encode_profile: str = None,
+    fps: float = 24,
+    cache_spec: dict = None,
+    clip_builder: dict = None,
+    segments: list = None,
+    logger="bar"
+):
+    """
+    Writes a short with static-frame deduplication, streaming frames into
+    one ffmpeg process with an encode profile's settings ("draft",
+    "publish" or "throughput"). The clips' sounds and `sounds` are mixed in
+    one pass into a WAV the encoder reads directly.
+
+    With a `cache_spec`, everything deciding the short's frames, renders
+    are cached: a short identical to an earlier one is not written again,
+    and one differing only in its soundtrack reuses the earlier frames with
+    the new soundtrack muxed in. Returns the frame statistics, with the
+    path of the short under "output" (an earlier file on a full hit).
+
+    With a `clip_builder` describing how to build the clip again (see
+    build_clip), long shorts are rendered in time chunks by parallel
+    processes; without one they are rendered in this process.
+
+    `segments` lists consecutive (start time, spec) parts of the short,
+    each spec holding everything deciding the frames from its start to
+    the next one. Segments are cached on their own, so shorts sharing one
+    only encode it once.
+    """
+    logger = proglog.default_bar_logger(logger)
+    profile_name = encode_profile or DEFAULT_ENCODE_PROFILE
+    profiling.annotate(encode_profile=profile_name)
+    sounds = get_sounds(clip) + list(sounds)
+
+    if cache_spec is None or not render_cache.RENDER_CACHE_ENABLED:
+        with _mix_soundtrack(sounds, clip.duration) as soundtrack:
+            stats = _encode(clip, output, profile_name, fps, soundtrack, logger, clip_builder)
+        stats["output"] = output
+        return stats
+
+    video_key = render_cache.get_key(render_cache.VIDEO, {
+        "clip": cache_spec,
+        "size": clip.size,
+        "duration": clip.duration,
+        "fps": fps,
+        "encode_profile": profile_name
+    })
+    output_key = render_cache.get_key(render_cache.OUTPUT, {
+        "video": video_key,
+        "sounds": render_cache.get_sounds_spec(sounds)
+    })
+
+    cached_output = render_cache.lookup(output_key)
+    if cached_output is not None:
+        logger(message=f"Identical short already rendered: {cached_output}")
+        profiling.annotate(render_cache=render_cache.OUTPUT)
+        return {"composited": 0, "reused": 0, "overlaid": 0, "encoded": 0, "output": cached_output}
+
+    video = render_cache.lookup(video_key)
+    if video is None:
+        profiling.annotate(render_cache="miss")
+        video = render_cache.get_video_path(video_key)
+        temporary_video = f"{video}.{os.getpid()}.tmp.mp4"
+        try:
+            stats = _encode(clip, temporary_video, profile_name, fps, None, logger, clip_builder, segments)
+            os.replace(temporary_video, video)
+        finally:
+            if os.path.exists(temporary_video):
+                os.remove(temporary_video)
+        render_cache.store(video_key, render_cache.VIDEO, video)
+    else:
+        logger(message="Reusing the frames of an earlier render")
+        profiling.annotate(render_cache=render_cache.VIDEO)
+        stats = {"composited": 0, "reused": 0, "overlaid": 0, "encoded": 0}
+
+    with _mix_soundtrack(sounds, clip.duration) as soundtrack, profiling.stage("mux"):
+        render_cache.mux(
+            video,
+            output,
+            soundtrack,
+            get_encode_profile(profile_name)["audio_bitrate"]
+        )
+
+    render_cache.store(output_key, render_cache.OUTPUT, output)
+    render_cache.evict()
+
+    stats["output"] = output
+    return stats
+
+
+if __name__ == "__main__":
+    _render_chunk(json.loads(sys.argv[1]))
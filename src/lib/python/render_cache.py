@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from functools import lru_cache
+
+from moviepy.config import get_setting
+
+from lib.python.assets import get_source_hash
+from lib.python.helpers import BASE_DIR, DATA_DIR
+
+
+RENDER_CACHE_DIR = os.path.join(DATA_DIR, "cache", "renders")
+RENDER_CACHE_DB_PATH = os.path.join(DATA_DIR, "cache", "renders.db")
+
+# Rendered videos are evicted, least recently used first, past this size
+MAX_CACHE_BYTES = int(os.environ.get("RENDER_CACHE_MB", 4096)) * 2 ** 20
+
+# Set to 0 to always render from scratch
+RENDER_CACHE_ENABLED = os.environ.get("RENDER_CACHE", "1") != "0"
+
+# Sources whose code decides what a short looks like; editing any of them
+# invalidates every cached render
+RENDER_SOURCES = (
+    "src/lib/python/render.py",
+    "src/lib/python/encoder.py",
+    "src/lib/python/media.py",
+    "src/lib/python/text_generator.py",
+    "src/lib/python/trivia.py",
+    "src/lib/python/chess/board.py",
+    "src/lib/python/chess/sprites.py",
+    "src/lib/python/chess/puzzle.py"
+)
+
+# Code mixing the soundtrack; it only decides finished shorts, so editing
+# it keeps the cached silent videos
+SOUNDTRACK_SOURCES = (
+    "src/lib/python/audio.py",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS renders_last_used ON renders (kind, last_used);
+"""
+
+# Kinds of entries: silent videos owned by the cache, of whole shorts or
+# of segments several shorts share, and finished shorts in out/, which
+# are only pointed to and never evicted
+VIDEO = "video"
+SEGMENT = "segment"
+OUTPUT = "output"
+OWNED = (VIDEO, SEGMENT)
+
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+
+
+def connect():
+    """Opens this process's connection to the render cache index."""
+    global _connection, _connection_pid
+
+    if _connection is None or _connection_pid != os.getpid():
+        if not os.path.exists(RENDER_CACHE_DIR):
+            os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        _connection = sqlite3.connect(
+            RENDER_CACHE_DB_PATH,
+            timeout=60,
+            check_same_thread=False
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+        _connection_pid = os.getpid()
+    return _connection
+
+
+@lru_cache(maxsize=2)
+def get_code_version(sources: tuple = RENDER_SOURCES):
+    """Hashes the rendering code, so cached renders never outlive a change to it."""
+    sha1 = hashlib.sha1()
+    for source in sources:
+        with open(os.path.join(BASE_DIR, source), "rb") as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+def get_file_hash(path: str):
+    """Hashes an asset's contents (remembered per path until it changes)."""
+    return get_source_hash(path)
+
+
+def get_key(kind: str, spec: dict):
+    """
+    Hashes a canonical spec of a render together with the code deciding
+    it: finished shorts also depend on the soundtrack mixing code.
+    """
+    sources = RENDER_SOURCES + SOUNDTRACK_SOURCES if kind == OUTPUT else RENDER_SOURCES
+    canonical = json.dumps(
+        {"kind": kind, "spec": spec, "code": get_code_version(sources)},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def get_sounds_spec(sounds: list):
+    """Describes a soundtrack by the contents of its files rather than their paths."""
+    return [
+        dict(sound, path=get_file_hash(sound["path"]))
+        for sound in sounds
+    ]
+
+
+def lookup(key: str):
+    """Returns the file cached under a key, or None if there is none or it was deleted."""
+    with _lock:
+        connection = connect()
+        row = connection.execute(
+            "SELECT path FROM renders WHERE key = ?",
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        if not os.path.exists(row[0]):
+            connection.execute("DELETE FROM renders WHERE key = ?", (key,))
+            connection.commit()
+            return None
+
+        connection.execute(
+            "UPDATE renders SET last_used = ? WHERE key = ?",
+            (time.time(), key)
+        )
+        connection.commit()
+        return row[0]
+
+
+def store(key: str, kind: str, path: str):
+    """Records a rendered file under a key."""
+    now = time.time()
+    with _lock:
+        connection = connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO renders (key, kind, path, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, kind, path, os.path.getsize(path), now, now)
+        )
+        connection.commit()
+
+
+def get_video_path(key: str):
+    """Returns where the silent video (or segment) cached under a key is written."""
+    return os.path.join(RENDER_CACHE_DIR, f"{key}.mp4")
+
+
+def evict(max_bytes: int = MAX_CACHE_BYTES):
+    """Deletes the least recently used videos until the cache fits in `max_bytes`."""
+    with _lock:
+        connection = connect()
+        total = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM renders WHERE kind IN (?, ?)",
+            OWNED
+        ).fetchone()[0]
+        if total <= max_bytes:
+            return
+
+        rows = connection.execute(
+            "SELECT key, path, size FROM renders WHERE kind IN (?, ?) ORDER BY last_used",
+            OWNED
+        ).fetchall()
+        for key, path, size in rows:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            connection.execute("DELETE FROM renders WHERE key = ?", (key,))
+            total -= size
+        connection.commit()
+
+
+def mux(video: str, output: str, audio: str = None, audio_bitrate: str = "192k"):
+    """
+    Writes a cached silent video to `output` with a soundtrack. The video
+    stream is copied as is, so only the audio is encoded.
+    """
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-y",
+        "-loglevel", "error",
+        "-i", video
+    ]
+    if audio is not None:
+        command += ["-i", audio, "-map", "0:v:0", "-map", "1:a:0", "-c:a", "aac", "-b:a", audio_bitrate]
+    command += ["-c:v", "copy", "-movflags", "+faststart", output]
+
+    process = subprocess.run(
+        command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL
+    )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed to mux {output}: {process.stderr.decode('utf-8', 'replace')[-500:]}"
+        )
+    return output
+
+
+def clear():
+    """Deletes every cached video and forgets every cached short."""
+    with _lock:
+        connection = connect()
+        for (path,) in connection.execute(
+            "SELECT path FROM renders WHERE kind IN (?, ?)",
+            OWNED
+        ).fetchall():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        connection.execute("DELETE FROM renders")
+        connection.commit()
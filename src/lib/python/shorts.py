@@ -0,0 +1,269 @@
+import json
+import os
+import random
+import uuid
+
+from lib.python import catalog, helpers, question_bank
+from lib.python.chess import library as pgn_library
+from lib.python.chess import mining as puzzle_mining
+
+# Shared assets, relative to the repository root like the rest of the app
+FONT = "src/resources/default.ttf"
+TRIVIA_BACKGROUND = "src/resources/parkour.mp4"
+PUZZLE_BACKGROUND = "src/resources/gridbackground.png"
+PHONK_TRACKS_PATH = os.path.join(helpers.MUSIC_DIR, "phonk", "tracks.json")
+
+SHORT_TITLES = {
+    "trivia": "Trivia Short",
+    "chess/puzzle": "Chess Puzzle Short"
+}
+
+# Previews render through the same pipeline at a fraction of the size and fps
+PREVIEW_DIR = os.path.join("out", "previews")
+PREVIEW_SETTINGS = {
+    "scale": 0.5,
+    "fps": 12,
+    "encode_profile": "draft"
+}
+MAX_PREVIEWS = 20
+
+# Feed posters, extracted once per video
+POSTER_DIR = os.path.join(helpers.DATA_DIR, "cache", "posters")
+POSTER_WIDTH = 360
+LEGACY_POSTER_TIME = 1
+
+
+def get_output_path():
+    """Returns a fresh output path under out/, creating the directory if needed."""
+    if not os.path.exists("out"):
+        os.makedirs("out")
+    return os.path.join("out", f"{uuid.uuid4()}.mp4")
+
+
+def get_seed():
+    """Returns a seed for the random choices made while rendering a short."""
+    return random.randrange(2 ** 31)
+
+
+def load_phonk_tracks():
+    """Loads the phonk tracks and their drop times."""
+    try:
+        with open(PHONK_TRACKS_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return []
+
+
+def prepare_trivia(category: str, output: str = None):
+    """
+    Picks the questions and music for a trivia short, returning the
+    arguments of `trivia.produce_short`.
+    """
+    questions = question_bank.sample(category)
+    music_path = helpers.get_random_music("lofi")
+
+    if not questions:
+        raise ValueError("No questions found for this category.")
+    if not music_path:
+        raise ValueError("No music found.")
+
+    return {
+        "questions": questions,
+        "background": TRIVIA_BACKGROUND,
+        "music": music_path,
+        "font": FONT,
+        "output": output or get_output_path(),
+        "seed": get_seed()
+    }
+
+
+def prepare_puzzle(
+    game_pgn: str = "",
+    use_mined_puzzle: bool = False,
+    puzzle_id: int = None,
+    output: str = None
+):
+    """
+    Picks the puzzle and music for a chess puzzle short, returning the
+    arguments of `puzzle.produce_short`. Without a PGN, a mined puzzle or
+    a random game from the library is used.
+    """
+    game_pgn = (game_pgn or "").strip()
+
+    # If empty, use a mined puzzle or a random game from the indexed 'games' library
+    if not game_pgn and puzzle_id is None and use_mined_puzzle:
+        puzzle_id = puzzle_mining.get_random_puzzle_id()
+    if not game_pgn and puzzle_id is None:
+        game_pgn = pgn_library.get_random_game_pgn() or ""
+
+    if not game_pgn and puzzle_id is None:
+        raise ValueError("Please provide a PGN or ensure 'games/' directory has PGN files.")
+
+    phonk_tracks = load_phonk_tracks()
+    if not phonk_tracks:
+        raise ValueError("No phonk tracks found.")
+    track = random.choice(phonk_tracks)
+
+    return {
+        "game_pgn": game_pgn,
+        "puzzle_id": puzzle_id,
+        "background": PUZZLE_BACKGROUND,
+        "font": FONT,
+        "music": f"src/resources/music/phonk/{track['filename']}",
+        "music_drop_time": track["dropTime"],
+        "output": output or get_output_path(),
+        "seed": get_seed()
+    }
+
+
+def prune_previews(max_files: int = MAX_PREVIEWS):
+    """Deletes all but the newest `max_files` previews."""
+    if not os.path.exists(PREVIEW_DIR):
+        return
+
+    paths = sorted(
+        (os.path.join(PREVIEW_DIR, name) for name in os.listdir(PREVIEW_DIR)),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for path in paths[max_files:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_preview_spec(spec: dict, poster: bool = False):
+    """
+    Returns the arguments rendering a quick preview of a prepared short: a
+    low resolution, low fps video, or with `poster` the single frame at the
+    solution moment. The spec's seed keeps the preview's content identical
+    to the full render's.
+    """
+    if not os.path.exists(PREVIEW_DIR):
+        os.makedirs(PREVIEW_DIR, exist_ok=True)
+    prune_previews()
+
+    extension = "jpg" if poster else "mp4"
+    return {
+        **spec,
+        **PREVIEW_SETTINGS,
+        "poster": poster,
+        "preview": True,
+        "output": os.path.join(PREVIEW_DIR, f"{uuid.uuid4()}.{extension}")
+    }
+
+
+def produce(short_type: str, spec: dict, logger=None):
+    """
+    Renders a short from prepared arguments and records it in the video
+    catalog, unless it is a preview. Returns the output path, which is an
+    earlier short's when an identical one was rendered before.
+    """
+    spec = dict(spec)
+    preview = spec.pop("preview", False)
+
+    if short_type == "trivia":
+        from lib.python import trivia as trivia_module
+        output = trivia_module.produce_short(**spec, logger=logger)
+    elif short_type == "chess/puzzle":
+        from lib.python.chess import puzzle as puzzle_module
+        output = puzzle_module.produce_short(**spec, logger=logger)
+    else:
+        raise ValueError(f"unknown short type: {short_type}")
+
+    # A cache hit returns a short that is already in the catalog
+    if preview or output != spec["output"]:
+        return output
+
+    catalog.add_video(
+        os.path.basename(output),
+        short_type,
+        SHORT_TITLES[short_type]
+    )
+    return output
+
+
+def get_poster_time(short_type: str):
+    """Returns when a short of a type shows its solution or answer."""
+    if short_type == "trivia":
+        from lib.python import trivia as trivia_module
+        return trivia_module.POSTER_TIME
+    if short_type == "chess/puzzle":
+        from lib.python.chess import puzzle as puzzle_module
+        return puzzle_module.POSTER_TIME
+    return LEGACY_POSTER_TIME
+
+
+def get_poster_path(filename: str):
+    """Returns where the poster of a video in out/ is cached."""
+    return os.path.join(POSTER_DIR, f"{os.path.splitext(filename)[0]}.jpg")
+
+
+def get_poster(video: dict):
+    """
+    Returns a JPEG poster of a catalog video at its solution or answer
+    moment. It is extracted from the video once, and again only if the
+    video changes. Returns None when the video is missing or unreadable.
+    """
+    from lib.python import media
+
+    video_path = os.path.join(helpers.OUT_DIR, video["filename"])
+    poster_path = get_poster_path(video["filename"])
+
+    try:
+        video_mtime = os.path.getmtime(video_path)
+    except OSError:
+        return None
+    if os.path.exists(poster_path) and os.path.getmtime(poster_path) >= video_mtime:
+        return poster_path
+
+    if not os.path.exists(POSTER_DIR):
+        os.makedirs(POSTER_DIR, exist_ok=True)
+
+    # Written then renamed, so a poster is never shown half written
+    temporary_path = f"{poster_path}.{os.getpid()}.tmp.jpg"
+    for t in (get_poster_time(video["type"]), 0):
+        try:
+            media.extract_frame(video_path, t, temporary_path, width=POSTER_WIDTH)
+        except RuntimeError:
+            # Shorter than the poster time, e.g. a legacy video
+            continue
+        os.replace(temporary_path, poster_path)
+        return poster_path
+
+    return None
+
+
+def delete_poster(filename: str):
+    """Deletes the cached poster of a video, if any."""
+    try:
+        os.remove(get_poster_path(filename))
+    except OSError:
+        pass
+
+
+def warm_up(short_types=SHORT_TITLES.keys(), font: str = FONT):
+    """
+    Loads what every render of these short types needs up front: moviepy,
+    fonts, board sprites and, for puzzles, a running Stockfish engine. A
+    long-lived process then pays for them once rather than per short.
+    """
+    from lib.python import text_generator
+
+    for fontsize in (90, 120):
+        text_generator._load_font(font, fontsize)
+
+    if "trivia" in short_types:
+        from lib.python import trivia as trivia_module
+
+    if "chess/puzzle" in short_types:
+        from lib.python.chess import board, engine
+        from lib.python.chess import puzzle as puzzle_module
+
+        board.preload_sprites()
+        try:
+            with engine.get_engine_pool().engine():
+                pass
+        except Exception as e:
+            print(f"Warning: Could not start Stockfish, solutions will start it on demand. Error: {e}")
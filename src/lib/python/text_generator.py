@@ -1,9 +1,133 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 from moviepy.editor import ImageClip
 import textwrap
 
-def create_text_clip(
+from lib.python.helpers import DATA_DIR
+from lib.python.profiling import timed
+from lib.python.render import mark_static
+
+# Rendered text is kept in memory (least recently used first out) and on
+# disk, so countdown digits and repeated banners are rasterized only once
+TEXT_CACHE_SIZE = 256
+TEXT_CACHE_DIR = os.path.join(DATA_DIR, "cache", "text")
+TEXT_CACHE_MAX_FILES = 2000
+TEXT_CACHE_PRUNE_INTERVAL = 100
+
+_text_cache = OrderedDict()
+_text_cache_lock = Lock()
+_disk_writes = 0
+
+
+@lru_cache(maxsize=32)
+def _load_font(font_path: str, fontsize: int):
+    """Loads a font once per (path, size)."""
+    try:
+        return ImageFont.truetype(font_path, fontsize)
+    except Exception as e:
+        print(f"Warning: Could not load font {font_path}, falling back to default. Error: {e}")
+        return ImageFont.load_default()
+
+
+def wrap_text(text: str, font, max_width: float):
+    """
+    Greedily wraps words into lines no wider than `max_width`. Only the
+    line being built is measured, so wrapping is linear in the word count.
+    """
+    lines = []
+    current_line = None
+
+    for word in text.split(' '):
+        test_line = word if current_line is None else f"{current_line} {word}"
+        if font.getlength(test_line) <= max_width:
+            current_line = test_line
+        else:
+            lines.append(current_line or '')
+            current_line = word
+
+    if current_line is not None:
+        lines.append(current_line)
+    return lines
+
+
+def _get_cache_key(*parts):
+    font_path = parts[1]
+    try:
+        font_stat = os.stat(font_path)
+        font_version = (font_stat.st_mtime, font_stat.st_size)
+    except OSError:
+        font_version = None
+
+    return hashlib.sha1(
+        json.dumps([*parts, font_version], default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _read_cached_text(key: str):
+    path = os.path.join(TEXT_CACHE_DIR, f"{key}.png")
+    try:
+        with Image.open(path) as image:
+            array = np.array(image.convert("RGBA"))
+        os.utime(path)
+        return array
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cached_text(key: str, array: np.ndarray):
+    global _disk_writes
+
+    if not os.path.exists(TEXT_CACHE_DIR):
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+
+    # Write then rename so concurrent renders never read a partial file
+    path = os.path.join(TEXT_CACHE_DIR, f"{key}.png")
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    Image.fromarray(array, "RGBA").save(temporary_path, format="PNG")
+    os.replace(temporary_path, path)
+
+    _disk_writes += 1
+    if _disk_writes % TEXT_CACHE_PRUNE_INTERVAL == 1:
+        prune_text_cache()
+
+
+def prune_text_cache(max_files: int = TEXT_CACHE_MAX_FILES):
+    """Deletes the least recently used rendered text beyond `max_files`."""
+    if not os.path.exists(TEXT_CACHE_DIR):
+        return
+
+    paths = [
+        os.path.join(TEXT_CACHE_DIR, filename)
+        for filename in os.listdir(TEXT_CACHE_DIR)
+        if filename.endswith(".png")
+    ]
+    if len(paths) <= max_files:
+        return
+
+    paths.sort(key=lambda path: os.path.getmtime(path))
+    for path in paths[:len(paths) - max_files]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def clear_text_cache():
+    """Drops every rendered text from memory and disk, and every loaded font."""
+    with _text_cache_lock:
+        _text_cache.clear()
+    _load_font.cache_clear()
+    prune_text_cache(0)
+
+
+def render_text(
     text: str,
     font_path: str,
     fontsize: int,
@@ -11,58 +135,66 @@ def create_text_clip(
     stroke_color: str = None,
     stroke_width: int = 0,
     size: tuple[int, int] = None,
-    method: str = "caption", # Ignored, kept for compatibility with signature if needed, but we implement 'caption' behavior logic
+    method: str = "caption",
     align: str = "center",
     interline: int = 4
-) -> ImageClip:
+) -> np.ndarray:
     """
-    Creates a MoviePy ImageClip with text rendered using Pillow.
-    This replaces moviepy.editor.TextClip which relies on ImageMagick.
-    
-    Args:
-        text: The text to render.
-        font_path: Path to the .ttf/.otf font file.
-        fontsize: Font size.
-        color: Text color (e.g. 'white', '#RRGGBB').
-        stroke_color: Color of the text outline.
-        stroke_width: Width of the text outline.
-        size: (width, height) of the image. Height can be None for auto-height.
-        align: 'center', 'left', or 'right'.
-        interline: Spacing between lines.
-        
-    Returns:
-        A moviepy.editor.ImageClip containing the rendered text.
+    Rasterizes text with Pillow into a read-only RGBA array. Arrays are
+    shared between calls with the same arguments and persisted under
+    data/cache/text, so repeated text is only drawn once.
     """
-    
+    key = _get_cache_key(
+        text, font_path, fontsize, color, stroke_color, stroke_width,
+        size, method, align, interline
+    )
+
+    with _text_cache_lock:
+        if key in _text_cache:
+            _text_cache.move_to_end(key)
+            return _text_cache[key]
+
+    array = _read_cached_text(key)
+    if array is None:
+        array = _draw_text(
+            text, font_path, fontsize, color, stroke_color, stroke_width,
+            size, method, align, interline
+        )
+        try:
+            _write_cached_text(key, array)
+        except OSError as e:
+            print(f"Warning: Could not cache rendered text. Error: {e}")
+
+    array.setflags(write=False)
+    with _text_cache_lock:
+        _text_cache[key] = array
+        if len(_text_cache) > TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+
+    return array
+
+
+def _draw_text(
+    text: str,
+    font_path: str,
+    fontsize: int,
+    color: str,
+    stroke_color: str,
+    stroke_width: int,
+    size: tuple[int, int],
+    method: str,
+    align: str,
+    interline: int
+) -> np.ndarray:
     # 1. Load Font
-    try:
-        font = ImageFont.truetype(font_path, fontsize)
-    except Exception as e:
-        print(f"Warning: Could not load font {font_path}, falling back to default. Error: {e}")
-        font = ImageFont.load_default()
+    font = _load_font(font_path, fontsize)
 
     # 2. Wrap Text (if width is provided)
     img_width = size[0] if size else 1080 # Default to 1080 if not specified
     
-    # Simple estimation for wrapping: average char width
-    # Pillow's getlength is better
-    lines = []
     if method == "caption" and img_width:
         # We need to wrap text manually since PIL doesn't do it automatically like ImageMagick 'caption:'
-        words = text.split(' ')
-        current_line = []
-        
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            line_width = font.getlength(test_line)
-            # Check if this line exceeds width (minus some padding)
-            if line_width <= (img_width - 40): # 20px padding on each side
-                current_line.append(word)
-            else:
-                lines.append(' '.join(current_line))
-                current_line = [word]
-        if current_line:
-            lines.append(' '.join(current_line))
+        lines = wrap_text(text, font, img_width - 40) # 20px padding on each side
     else:
         lines = [text] # No wrapping if not 'caption' or width not set (label mode)
 
@@ -114,6 +246,45 @@ def create_text_clip(
         
         y_offset += line_height
 
-    # 6. Convert to MoviePy ImageClip
-    # Convert PIL image to numpy array
-    return ImageClip(np.array(image), transparent=True)
+    return np.array(image)
+
+
+@timed("text")
+def create_text_clip(
+    text: str,
+    font_path: str,
+    fontsize: int,
+    color: str,
+    stroke_color: str = None,
+    stroke_width: int = 0,
+    size: tuple[int, int] = None,
+    method: str = "caption", # Ignored, kept for compatibility with signature if needed, but we implement 'caption' behavior logic
+    align: str = "center",
+    interline: int = 4
+) -> ImageClip:
+    """
+    Creates a MoviePy ImageClip with text rendered using Pillow.
+    This replaces moviepy.editor.TextClip which relies on ImageMagick.
+    
+    Args:
+        text: The text to render.
+        font_path: Path to the .ttf/.otf font file.
+        fontsize: Font size.
+        color: Text color (e.g. 'white', '#RRGGBB').
+        stroke_color: Color of the text outline.
+        stroke_width: Width of the text outline.
+        size: (width, height) of the image. Height can be None for auto-height.
+        align: 'center', 'left', or 'right'.
+        interline: Spacing between lines.
+        
+    Returns:
+        A moviepy.editor.ImageClip containing the rendered text, marked
+        static for the video writer.
+    """
+    return mark_static(ImageClip(
+        render_text(
+            text, font_path, fontsize, color, stroke_color, stroke_width,
+            size, method, align, interline
+        ),
+        transparent=True
+    ))
@@ -1,10 +1,14 @@
-from random import randint
+from random import Random
 from sys import argv
 from json import loads
 
 import moviepy.editor as editor
-from moviepy.video.fx.resize import resize
-from moviepy.audio.fx.volumex import volumex
+from lib.python.assets import get_background, get_music
+from lib.python.audio import sound
+from lib.python.media import BackgroundClip, probe
+from lib.python.profiling import annotate, profiled, stage
+from lib.python.render import get_frame_size, mark_static, save_poster, write_videofile
+from lib.python.render_cache import get_file_hash
 from lib.python.text_generator import create_text_clip
 
 
@@ -15,6 +19,9 @@ clip_durations = {
 }
 full_question_duration = sum(clip_durations.values())
 
+# Posters show the first question's answer
+POSTER_TIME = clip_durations["question"] + clip_durations["answer"] / 2
+
 
 class Question:
     title: str
@@ -25,58 +32,53 @@ class Question:
         self.answers = []
 
 
-def produce_short(
+def build_clip(
     questions: list[Question],
     background: str,
-    music: str,
+    background_start: float,
     font: str,
-    output: str,
-    logger=None
+    scale: float = 1,
+    fps: float = 24
 ):
+    """
+    Builds the frames of a trivia short, without sound, over a window of
+    the `background` video starting `background_start` seconds in. Every
+    argument is JSON, so chunks of the short can build it again.
+    """
     question_count = len(questions)
+    size = get_frame_size(scale)
+    width = size[0]
 
-    background_duration = editor.VideoFileClip(background).duration
-    background = resize(
-        (
-            editor.VideoFileClip(background)
-            .cutout(0, randint(1, round(background_duration) - 65))
-            .set_duration(full_question_duration * question_count)
-            .set_position(("center", "center"))
-        ),
-        height=1920
+    # A window of the gameplay video, scaled and cropped by ffmpeg
+    background = (
+        BackgroundClip(
+            background,
+            start=background_start,
+            duration=full_question_duration * question_count,
+            size=size,
+            fps=fps
+        )
+        .set_position(("center", "center"))
     )
 
-    dimmer = (
-        editor.ColorClip(size=(1080, 1920), color=(0,0,0))
+    dimmer = mark_static(
+        editor.ColorClip(size=size, color=(0,0,0))
         .set_opacity(0.4)
         .set_duration(full_question_duration * question_count)
     )
 
-    music_duration = editor.AudioFileClip(music).duration
-    music = volumex(
-        editor.CompositeAudioClip([
-            editor.AudioFileClip(music)
-            .cutout(0, randint(
-                1, 
-                int(music_duration - full_question_duration * question_count)
-            ))
-            .set_end(full_question_duration * question_count)
-        ]),
-        0.6
-    )
-
     clips = []
 
     for question_index, question in enumerate(questions):
         question_text = (
             create_text_clip(
                 question["title"],
-                fontsize=90, 
+                fontsize=round(90 * scale), 
                 color="white", 
                 stroke_color="black", 
-                stroke_width=4,
+                stroke_width=max(1, round(4 * scale)),
                 method="caption",
-                size=(1080, None),
+                size=(width, None),
                 font_path=font
             )
             .set_position(("center", 0.15), relative=True)
@@ -89,12 +91,12 @@ def produce_short(
             (
                 create_text_clip(
                     f"{list('ABCD')[i]} - {question['answers'][i]}", 
-                    fontsize=90, 
+                    fontsize=round(90 * scale), 
                     color="white", 
                     stroke_color="black", 
-                    stroke_width=4,
+                    stroke_width=max(1, round(4 * scale)),
                     method="caption",
-                    size=(1080, None),
+                    size=(width, None),
                     font_path=font
                 )
                 .set_position(("center", 0.4 + (i / 7)), relative=True)
@@ -108,12 +110,12 @@ def produce_short(
             (
                 create_text_clip(
                     str(clip_durations["question"] - i), 
-                    fontsize=120, 
+                    fontsize=round(120 * scale), 
                     color="white", 
                     stroke_color="black", 
-                    stroke_width=4,
+                    stroke_width=max(1, round(4 * scale)),
                     method="caption",
-                    size=(1080, None),
+                    size=(width, None),
                     font_path=font
                 )
                 .set_start(question_index * full_question_duration + i)
@@ -126,12 +128,12 @@ def produce_short(
         correct_answer_text = (
             create_text_clip(
                 question["answers"][question["correct"]], 
-                fontsize=120, 
+                fontsize=round(120 * scale), 
                 color="#4ADE80", 
                 stroke_color="black", 
-                stroke_width=4,
+                stroke_width=max(1, round(4 * scale)),
                 method="caption",
-                size=(1080, None),
+                size=(width, None),
                 font_path=font
             )
             .set_start(question_index * full_question_duration + clip_durations["question"])
@@ -147,23 +149,104 @@ def produce_short(
                 dimmer,
                 *clips
             ], 
-            size=(1080, 1920)
+            size=size
         )
-        .set_audio(music)
     )
 
-    result.write_videofile(
-        output, 
-        fps=24, 
-        audio_codec="aac",
-        threads=4,
-        temp_audiofile="out/TEMP_trivia.mp4",
+    return result
+
+
+@profiled("trivia")
+def produce_short(
+    questions: list[Question],
+    background: str,
+    music: str,
+    font: str,
+    output: str,
+    logger=None,
+    encode_profile: str = None,
+    scale: float = 1,
+    fps: float = 24,
+    poster: bool = False,
+    seed: int = None
+):
+    """
+    Renders a trivia short to `output`. `scale` and `fps` render a smaller,
+    choppier version through the same pipeline, e.g. for previews, and
+    `poster` writes only the frame revealing the first answer, as an image.
+    The same `seed` picks the same background and music windows. Returns
+    the path of the short.
+    """
+    question_count = len(questions)
+    rng = Random(seed)
+
+    annotate(output=output, questions=question_count)
+
+    # Background video and music, prepared versions when available
+    with stage("assets"):
+        background = get_background(background)
+        music = get_music(music)
+
+        # A random window of the gameplay video
+        background_duration = probe(background)["duration"]
+        background_start = rng.randint(1, round(background_duration) - 65)
+        cache_spec = {
+            "type": "trivia",
+            "questions": questions,
+            "durations": clip_durations,
+            "background": get_file_hash(background),
+            "background_start": background_start,
+            "font": get_file_hash(font)
+        }
+
+        music_duration = probe(music)["duration"]
+        music = sound(
+            music,
+            gain=0.6,
+            offset=rng.randint(
+                1, 
+                int(music_duration - full_question_duration * question_count)
+            )
+        )
+
+    clip_builder = {
+        "module": "lib.python.trivia",
+        "function": "build_clip",
+        "args": {
+            "questions": questions,
+            "background": background,
+            "background_start": background_start,
+            "font": font,
+            "scale": scale,
+            "fps": fps
+        }
+    }
+    result = build_clip(**clip_builder["args"])
+
+    if poster:
+        save_poster(result, output, POSTER_TIME)
+        result.close()
+        for clip in result.clips:
+            clip.close()
+        return output
+
+    stats = write_videofile(
+        result,
+        output,
+        sounds=[music],
+        encode_profile=encode_profile,
+        fps=fps,
+        cache_spec=cache_spec,
+        clip_builder=clip_builder,
         logger=logger
     )
 
     result.close()
-    music.close()
-    background.close()
+    for clip in result.clips:
+        clip.close()
+
+    # An identical short rendered earlier is returned instead of a new file
+    return stats["output"]
 
 if __name__ == "__main__":
     args = loads(argv[1])
@@ -175,5 +258,9 @@ if __name__ == "__main__":
         music=args["assets"]["music"],
         font=args["assets"]["font"],
 
-        output=args["output"]
+        output=args["output"],
+        encode_profile=args.get("encodeProfile"),
+        scale=args.get("scale", 1),
+        fps=args.get("fps", 24),
+        poster=args.get("poster", False)
     )
\ No newline at end of file
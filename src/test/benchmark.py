@@ -0,0 +1,354 @@
+"""
+Times the chess and trivia render pipelines and keeps a history of the
+results in data/benchmarks.json. Run from the repository root:
+
+    PYTHONPATH=src python src/test/benchmark.py
+    PYTHONPATH=src python src/test/benchmark.py --only draw_board --compare
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from glob import glob
+
+sys.path.append(os.path.abspath("src"))
+
+from lib.python import render, render_cache, text_generator
+from lib.python.encoder import ENCODE_PROFILES
+from lib.python.shorts import PREVIEW_SETTINGS
+from lib.python.helpers import BASE_DIR, DATA_DIR
+from lib.python.chess import board as chess_board
+from lib.python.chess import frames as board_frames
+from lib.python.chess import library, mining
+
+
+HISTORY_PATH = os.path.join(DATA_DIR, "benchmarks.json")
+REGRESSION_THRESHOLD = 0.1
+
+FONT = "src/resources/default.ttf"
+PUZZLE_BACKGROUND = "src/resources/gridbackground.png"
+PUZZLE_MUSIC = "src/resources/music/phonk/track2.mp3"
+TRIVIA_MUSIC = "src/resources/music/phonk/track2.mp3"
+TRIVIA_BACKGROUND = "src/resources/parkour.mp4"
+
+# Fixed positions, each with the move drawn on it
+POSITIONS = {
+    "start": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", "e2e4"),
+    "middlegame": ("r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/2N2N2/PPPP1PPP/R1BQK2R w KQkq - 4 5", "f3e5"),
+    "en_passant": ("rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3", "e5f6")
+}
+
+# Legal's mate: the knight sacrifice is the brilliant move
+PUZZLE_PGN = """[Event "Benchmark"]
+
+1. e4 e5 2. Nf3 d6 3. Bc4 Bg4 4. Nc3 g6 5. Nxe5!! Bxd1 6. Bxf7+ Ke7 7. Nd5# 1-0
+"""
+
+TRIVIA_QUESTIONS = [
+    {
+        "title": "Which chess piece can only move diagonally?",
+        "answers": ["Rook", "Bishop", "Knight", "King"],
+        "correct": 1
+    }
+]
+
+
+def render_frames(clip, fps: int = 24):
+    """Draws every frame of a clip, as the encoder would."""
+    for frame in clip.iter_frames(fps=fps):
+        pass
+
+
+def bench_draw_board(fen: str, move: str, cold: bool = True):
+    def run():
+        if cold:
+            board_frames.clear_frames()
+        render_frames(chess_board.draw_board(fen, highlighted_move=move, duration=1))
+        render_frames(chess_board.draw_board(
+            fen, highlighted_move=move, animated=True, brilliancy=True, audio=True, duration=0.2
+        ))
+    return run
+
+
+def bench_move_with_preview():
+    fen, move = POSITIONS["middlegame"]
+    board_frames.clear_frames()
+    render_frames(chess_board.draw_move_with_preview(fen, highlighted_move=move, audio=True))
+
+
+def bench_encode(output_dir: str, encode_profile: str):
+    # Two seconds of a sliding piece, so every frame is composited and encoded
+    fen, move = POSITIONS["middlegame"]
+
+    def run():
+        clip = chess_board.draw_board(
+            fen, highlighted_move=move, animated=True, brilliancy=True, duration=2
+        )
+        stats = render.write_videofile(
+            clip,
+            os.path.join(output_dir, f"encode-{encode_profile}.mp4"),
+            encode_profile=encode_profile,
+            logger=None
+        )
+        return stats["encoded"]
+    return run
+
+
+def bench_text(cold: bool):
+    def run():
+        if cold:
+            text_generator.clear_text_cache()
+        for i in range(10):
+            text_generator.create_text_clip(
+                str(i + 1), font_path=FONT, fontsize=120, color="white",
+                stroke_color="black", stroke_width=4, size=(1080, None)
+            )
+        text_generator.create_text_clip(
+            TRIVIA_QUESTIONS[0]["title"], font_path=FONT, fontsize=90, color="white",
+            stroke_color="black", stroke_width=4, size=(1080, None)
+        )
+    return run
+
+
+def clear_caches():
+    """Drops the boards and text drawn so far, so the next render starts cold."""
+    board_frames.clear_frames()
+    text_generator.clear_text_cache()
+
+
+def bench_puzzle_short(
+    output_dir: str,
+    encode_profile: str,
+    name: str = "puzzle.mp4",
+    cold: bool = False,
+    **settings
+):
+    from lib.python.chess import puzzle
+
+    def run():
+        if cold:
+            clear_caches()
+        puzzle.produce_short(
+            output=os.path.join(output_dir, name),
+            game_pgn=PUZZLE_PGN,
+            background=PUZZLE_BACKGROUND,
+            font=FONT,
+            music=PUZZLE_MUSIC,
+            music_drop_time=30,
+            encode_profile=encode_profile,
+            **settings
+        )
+    return run
+
+
+def bench_trivia_short(
+    output_dir: str,
+    background: str,
+    encode_profile: str,
+    name: str = "trivia.mp4",
+    cold: bool = False,
+    **settings
+):
+    from lib.python import trivia
+
+    def run():
+        if cold:
+            clear_caches()
+        if not os.path.exists(background):
+            raise FileNotFoundError(f"trivia background {background} not found, pass --background")
+        trivia.produce_short(
+            questions=TRIVIA_QUESTIONS,
+            background=background,
+            music=TRIVIA_MUSIC,
+            font=FONT,
+            output=os.path.join(output_dir, name),
+            encode_profile=encode_profile,
+            **settings
+        )
+    return run
+
+
+def bench_pgn_index():
+    games = 0
+    for path in sorted(glob(os.path.join(library.GAMES_DIR, "*.pgn"))):
+        games += len(library.scan_file(path))
+    return games
+
+
+def bench_mining(game_count: int):
+    def run():
+        games = 0
+        for record in library.get_games()[:game_count]:
+            mining.mine_game(library.read_game(record))
+            games += 1
+        return games
+    return run
+
+
+def get_benchmarks(args, output_dir: str):
+    """Lists (name, function, repeat) for every benchmark."""
+    benchmarks = [
+        (f"draw_board/{name}", bench_draw_board(fen, move), args.repeat)
+        for name, (fen, move) in POSITIONS.items()
+    ]
+    benchmarks += [
+        ("draw_board/warm", bench_draw_board(*POSITIONS["middlegame"], cold=False), args.repeat),
+        ("draw_move_with_preview", bench_move_with_preview, args.repeat),
+        ("create_text_clip/cold", bench_text(cold=True), args.repeat),
+        ("create_text_clip/warm", bench_text(cold=False), args.repeat),
+        ("pgn_index", bench_pgn_index, args.repeat),
+        *(
+            (f"encode/{name}", bench_encode(output_dir, name), 1)
+            for name in ENCODE_PROFILES
+        ),
+        ("mining/static", bench_mining(args.mining_games), 1),
+        # Cold runs draw every board and text again, warm runs right after
+        # reuse what the cold run drew
+        ("produce_short/puzzle/cold", bench_puzzle_short(output_dir, args.encode_profile, cold=True), 1),
+        ("produce_short/puzzle/warm", bench_puzzle_short(output_dir, args.encode_profile), 1),
+        ("produce_short/trivia/cold", bench_trivia_short(output_dir, args.background, args.encode_profile, cold=True), 1),
+        ("produce_short/trivia/warm", bench_trivia_short(output_dir, args.background, args.encode_profile), 1),
+        ("preview/puzzle", bench_puzzle_short(output_dir, name="puzzle-preview.mp4", **PREVIEW_SETTINGS), 1),
+        ("preview/trivia", bench_trivia_short(output_dir, args.background, name="trivia-preview.mp4", **PREVIEW_SETTINGS), 1),
+        ("poster/puzzle", bench_puzzle_short(output_dir, None, name="puzzle.jpg", poster=True), args.repeat)
+    ]
+    return [
+        benchmark for benchmark in benchmarks
+        if not args.only or any(only in benchmark[0] for only in args.only)
+    ]
+
+
+def run_benchmark(function, repeat: int):
+    """Runs a benchmark `repeat` times and summarizes its timings."""
+    timings = []
+    items = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = function()
+        timings.append(time.perf_counter() - started)
+
+    result = {
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "runs": repeat
+    }
+    # Benchmarks returning a count of processed items also report throughput
+    if isinstance(items, int):
+        result["items"] = items
+        result["per_second"] = items / result["median"]
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path: str = HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_history(history: list, path: str = HISTORY_PATH):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2)
+
+
+def compare(run: dict, history: list, threshold: float = REGRESSION_THRESHOLD):
+    """
+    Compares a run's medians against the latest earlier run of each
+    benchmark and returns the names slower by more than `threshold`.
+    """
+    regressions = []
+    for name, result in run["results"].items():
+        if "median" not in result:
+            continue
+
+        baseline = next(
+            (
+                earlier for earlier in reversed(history)
+                if "median" in earlier["results"].get(name, {})
+            ),
+            None
+        )
+        if baseline is None:
+            print(f"{name:<28} no baseline")
+            continue
+
+        before = baseline["results"][name]["median"]
+        change = (result["median"] - before) / before
+        flag = "REGRESSION" if change > threshold else ""
+        print(
+            f"{name:<28} {before:>9.3f}s -> {result['median']:>9.3f}s "
+            f"{change:>+7.1%}  (vs {baseline['commit'] or baseline['date']}) {flag}"
+        )
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the render pipelines.")
+    parser.add_argument("--only", nargs="*", help="run benchmarks whose name contains any of these")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per micro benchmark")
+    parser.add_argument("--mining-games", type=int, default=200, help="games mined (static scoring)")
+    parser.add_argument("--background", default=TRIVIA_BACKGROUND, help="trivia background video")
+    parser.add_argument("--encode-profile", choices=ENCODE_PROFILES.keys(), default="publish", help="encode profile of the end-to-end shorts")
+    parser.add_argument("--compare", action="store_true", help="compare against the history and flag regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="regression threshold (0.1 = 10%%)")
+    parser.add_argument("--no-save", action="store_true", help="do not add this run to the history")
+    args = parser.parse_args()
+
+    if not os.path.exists("out"):
+        os.makedirs("out")
+
+    run = {
+        "date": datetime.now().isoformat(),
+        "commit": get_commit(),
+        "results": {}
+    }
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Keep the real text cache out of cold runs
+        text_generator.TEXT_CACHE_DIR = os.path.join(output_dir, "text")
+        # Render benchmarks time rendering, never a lookup of an earlier
+        # short in the render cache
+        render_cache.RENDER_CACHE_ENABLED = False
+
+        for name, function, repeat in get_benchmarks(args, output_dir):
+            try:
+                result = run_benchmark(function, repeat)
+            except Exception as e:
+                result = {"error": f"{e}"}
+                print(f"{name:<28} FAILED: {e}")
+            else:
+                throughput = f"  {result['per_second']:.1f}/s" if "per_second" in result else ""
+                print(f"{name:<28} {result['median']:>9.3f}s median, {result['min']:.3f}s min{throughput}")
+            run["results"][name] = result
+
+    history = load_history()
+    regressions = []
+    if args.compare:
+        print()
+        regressions = compare(run, history, args.threshold)
+
+    if not args.no_save:
+        history.append(run)
+        save_history(history)
+
+    if regressions:
+        raise SystemExit(1)
@@ -0,0 +1,89 @@
+"""
+Tests for static frame detection in the video writer. Run from the
+repository root:
+
+    PYTHONPATH=src python -m unittest discover -s src/test
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+import moviepy.editor as editor
+
+sys.path.append(os.path.abspath("src"))
+
+from lib.python import render
+
+
+SIZE = (64, 48)
+
+
+def image(color, size=SIZE):
+    width, height = size
+    return editor.ImageClip(np.full((height, width, 3), color, dtype=np.uint8))
+
+
+def moving(duration=1):
+    # A different frame at every timestamp, like a background video
+    return editor.VideoClip(
+        lambda t: np.full((SIZE[1], SIZE[0], 3), int(t * 200) % 256, dtype=np.uint8),
+        duration=duration
+    )
+
+
+def render_all(clip, fps=24):
+    deduplicated = render.deduplicate_static_frames(clip)
+    frames = [deduplicated.get_frame(t) for t in np.arange(0, clip.duration, 1.0 / fps)]
+    return deduplicated.frame_stats, frames
+
+
+class StaticFramesTest(unittest.TestCase):
+    def test_marked_image_is_composited_once(self):
+        clip = editor.CompositeVideoClip([render.mark_static(image(80).set_duration(1))], size=SIZE)
+
+        stats, _ = render_all(clip)
+
+        self.assertEqual(stats["composited"], 1)
+        self.assertEqual(stats["reused"], 23)
+
+    def test_unmarked_image_is_not_static(self):
+        clip = editor.CompositeVideoClip([image(80).set_duration(1)], size=SIZE)
+
+        self.assertEqual(render.get_static_intervals(clip), [])
+
+    def test_fl_modified_image_is_not_deduplicated(self):
+        marked = render.mark_static(image(80).set_duration(1))
+        faded = marked.fl(lambda get_frame, t: (get_frame(t) * (1 - t)).astype(np.uint8))
+        clip = editor.CompositeVideoClip([faded], size=SIZE)
+
+        stats, frames = render_all(clip)
+
+        self.assertEqual(render.get_static_intervals(clip), [])
+        self.assertEqual(stats["reused"], 0)
+        self.assertGreater(frames[0].mean(), frames[-1].mean())
+
+    def test_moving_position_is_not_static(self):
+        marked = render.mark_static(image(80, (8, 8)).set_duration(1))
+        clip = editor.CompositeVideoClip([marked.set_position(lambda t: (int(t * 40), 0))], size=SIZE)
+
+        self.assertEqual(render.get_static_intervals(clip), [])
+
+    def test_static_layers_are_laid_over_moving_ones(self):
+        text = image(255, (16, 8)).set_duration(1).set_position(("center", "center"))
+        dimmer = image(0).set_opacity(0.4).set_duration(1)
+        clip = editor.CompositeVideoClip(
+            [moving(), render.mark_static(dimmer), render.mark_static(text)],
+            size=SIZE
+        )
+
+        stats, frames = render_all(clip)
+
+        self.assertEqual(stats["overlaid"], 24)
+        for t, frame in zip(np.arange(0, 1, 1 / 24), frames):
+            difference = np.abs(frame.astype(int) - clip.get_frame(t))
+            self.assertLessEqual(difference.max(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()